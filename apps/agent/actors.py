@@ -0,0 +1,139 @@
+# actors.py
+"""
+세션 단위 액터 스케줄러
+
+한 프로세스에서 많은 세션을 돌릴 때, 다른 세션의 턴은 동시에 실행하고 같은 세션의 턴은 제출 순서대로
+하나씩만 실행한다 (같은 기반 상태 위에서 두 step()/apply_patch가 겹치지 않도록).
+
+- mailbox  : session_id마다 deque. 세션은 실행 중이 아닐 때만 ready 큐에 들어간다 (최대 한 번)
+- 워커 풀  : max_workers개 스레드를 필요할 때까지 늘린다. 워커는 ready 큐 앞의 세션에서 작업 1건만 꺼내 실행하고,
+             mailbox에 남은 작업이 있으면 그 세션을 ready 큐 뒤로 보낸다 (세션 간 라운드로빈 → 한 세션이 몰아쳐도
+             다른 세션이 굶지 않는다)
+- backlog  : 실행 중인 것을 뺀 대기 작업이 max_backlog개인 세션에 더 넣으면 SessionBacklogFull
+- 컨텍스트 : 작업은 submit 시점의 contextvars 복사본에서 실행 (config/시나리오 pin, trace 문맥 유지)
+- 메트릭   : agent_session_queued_turns, agent_session_queue_seconds, agent_session_rejections_total
+
+설정(환경변수): AGENT_TURN_WORKERS, AGENT_SESSION_BACKLOG
+"""
+
+from __future__ import annotations
+import contextvars, os, threading, time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Set, Tuple
+
+from metrics import SESSION_QUEUED, SESSION_QUEUE_SECONDS, SESSION_REJECTIONS
+
+_Job = Tuple[Future, contextvars.Context, Callable[..., Any], tuple, dict, float]
+
+
+class SessionBacklogFull(RuntimeError):
+    pass
+
+
+class SessionScheduler:
+    def __init__(self, max_workers: int = 8, max_backlog: int = 8, name: str = "turns"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        self.max_workers = max_workers
+        self.max_backlog = max_backlog
+        self.name = name
+        self._boxes: Dict[str, Deque[_Job]] = {}
+        self._ready: Deque[str] = deque()
+        self._running: Set[str] = set()
+        self._threads: List[threading.Thread] = []
+        self._idle = 0
+        self._queued = 0
+        self._closed = False
+        self._cv = threading.Condition()
+
+    # ---- 제출 ----
+    def submit(self, session_id: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        fut: Future = Future()
+        job = (fut, contextvars.copy_context(), fn, args, kwargs, time.monotonic())
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            box = self._boxes.get(session_id)
+            if box is None:
+                box = self._boxes[session_id] = deque()
+            elif len(box) >= self.max_backlog:
+                SESSION_REJECTIONS.inc()
+                raise SessionBacklogFull(f"session {session_id!r} has {len(box)} queued turns")
+            box.append(job)
+            self._queued += 1
+            if len(box) == 1 and session_id not in self._running:
+                self._ready.append(session_id)
+            if self._idle == 0 and len(self._threads) < self.max_workers:
+                t = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                self._threads.append(t)
+                t.start()
+            else:
+                self._wake()
+            queued = self._queued
+        SESSION_QUEUED.set(queued)
+        return fut
+
+    def call(self, session_id: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return self.submit(session_id, fn, *args, **kwargs).result()
+
+    # ---- 워커 ----
+    def _wake(self) -> None:
+        # _cv 안에서 호출. 쉬는 워커가 있을 때만 하나 깨운다 (없으면 일하던 워커가 끝나고 ready 큐를 본다)
+        if self._idle:
+            self._idle -= 1
+            self._cv.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._cv:
+                while not self._ready and not self._closed:
+                    self._idle += 1              # 깨우는 쪽(_wake)이 줄인다
+                    self._cv.wait()
+                if not self._ready:
+                    return
+                sid = self._ready.popleft()
+                box = self._boxes[sid]
+                fut, ctx, fn, args, kwargs, queued_at = box.popleft()
+                self._running.add(sid)
+                self._queued -= 1
+                queued = self._queued
+            SESSION_QUEUED.set(queued)
+            SESSION_QUEUE_SECONDS.observe(time.monotonic() - queued_at)
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(ctx.run(fn, *args, **kwargs))
+                except BaseException as e:
+                    fut.set_exception(e)
+            with self._cv:
+                self._running.discard(sid)
+                if box:
+                    self._ready.append(sid)      # 남은 작업은 다른 세션들 뒤에서
+                    self._wake()
+                else:
+                    del self._boxes[sid]
+
+    # ---- 상태 / 종료 ----
+    def pending(self, session_id: str) -> int:
+        with self._cv:
+            return len(self._boxes.get(session_id) or ())
+
+    def stats(self) -> Dict[str, int]:
+        with self._cv:
+            return {"sessions": len(self._boxes), "queued": self._queued, "running": len(self._running),
+                    "workers": len(self._threads), "idle": self._idle}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """새 제출은 막고, 이미 받은 작업은 끝까지 실행한다"""
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for t in threads:
+                t.join()
+
+
+def from_env(name: str = "turns") -> SessionScheduler:
+    return SessionScheduler(max_workers=int(os.getenv("AGENT_TURN_WORKERS", "8")),
+                            max_backlog=int(os.getenv("AGENT_SESSION_BACKLOG", "8")), name=name)
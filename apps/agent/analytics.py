@@ -0,0 +1,382 @@
+# analytics.py
+"""
+세션 결과 컬럼형 분석 (NumPy)
+
+세션 스냅샷/저널(JSON·JSONL, GameState 또는 GraphState dict)을 한 번 읽어 컬럼 배열로 바꾸고,
+질의는 전부 벡터 연산으로 처리한다. 변환 결과는 save()/load()(.npz)로 보관해 다시 파싱하지 않는다.
+
+컬럼 (세션당 한 행, 같은 session_id의 스냅샷이 여러 개면 마지막 것이 행이 되고 나머지는 방문 기록에만 반영)
+- scene                : 마지막 씬 id (int32, 심볼은 compact_state.ScenarioSymbols와 같은 방식으로 intern)
+- turn / total_turns_used : int32
+- char_turns / affinity  : (세션 × 캐릭터) int32, 없는 캐릭터는 0 (apply_patch/rules와 같은 해석)
+- allies / flags / visited : (세션 × 64비트 워드) uint64 비트셋 (visited = 저널에 나온 씬 + scene_history)
+- ending               : ending 문자열 코드 (""는 미종료)
+
+저널(같은 세션의 턴별 스냅샷)에서는 선택 기록도 뽑는다: (직전 씬, 정규화한 입력, user_choice)
+정규화는 decision_cache.normalize_message와 같다. 직전 스냅샷보다 turn이 올랐거나 입력이 바뀐 스냅샷을
+선택 턴으로 센다 (씬 변화로 판단하면 제자리로 돌아오는 선택이 빠진다. 같은 턴의 중복 스냅샷은 한 번만).
+
+질의
+- reach(scene)            : 그 씬에 도달한 세션 비율
+- funnel([s1, s2, ...])   : s1, s1∧s2, ... 을 모두 방문한 세션 수 (방문 순서는 보지 않음)
+- drop_off()              : 엔딩 없이 멈춘 마지막 씬별 세션 수 / 그 씬 도달 대비 비율
+- endings()               : ending 분포
+- turn_usage()            : 턴·총 사용 턴·캐릭터별 사용 턴 분위수 (엔딩별로도)
+- condition(rule) / hidden_eligible(rule) : rules.compile_condition 규칙(require/forbid_flags, limits,
+                            affinity_min/max)을 세션 전체에 벡터로 평가. 기본 규칙은 parent._hidden_eligible과 같다
+- alias_choices()         : (씬, 입력, 선택) 빈도
+
+사용: python analytics.py 스냅샷.jsonl [...] [--save table.npz] [--funnel s1,s2,s3]
+"""
+
+from __future__ import annotations
+import argparse, json
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from compact_state import Interner
+from decision_cache import normalize_message
+
+_WORD = 64
+
+
+def _game_fields(state: Mapping[str, Any]) -> Mapping[str, Any]:
+    """GraphState(current_node/master_turn_count)면 GameView로, GameState면 그대로"""
+    if "current_node" in state or "master_turn_count" in state:
+        from session_state import game_view
+        return game_view(state)
+    return state
+
+
+def _words(n: int) -> int:
+    return max(1, (n + _WORD - 1) // _WORD)
+
+
+class _Triplets:
+    """(스냅샷 번호, 행, id, 값) 누적 → 행마다 마지막 스냅샷의 항목만 남겨 배열로"""
+    __slots__ = ("seq", "rows", "ids", "vals")
+
+    def __init__(self):
+        self.seq, self.rows, self.ids, self.vals = array("i"), array("i"), array("i"), array("i")
+
+    def add(self, seq: int, row: int, i: int, v: int = 1) -> None:
+        self.seq.append(seq)
+        self.rows.append(row)
+        self.ids.append(i)
+        self.vals.append(v)
+
+    def arrays(self, last_seq: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rows = np.frombuffer(self.rows, dtype=np.int32)
+        ids = np.frombuffer(self.ids, dtype=np.int32)
+        vals = np.frombuffer(self.vals, dtype=np.int32)
+        if last_seq is not None and len(rows):
+            keep = np.frombuffer(self.seq, dtype=np.int32) == last_seq[rows]
+            rows, ids, vals = rows[keep], ids[keep], vals[keep]
+        return rows, ids, vals
+
+
+def _bitset(n_rows: int, rows: np.ndarray, ids: np.ndarray, n_ids: int) -> np.ndarray:
+    out = np.zeros((n_rows, _words(n_ids)), dtype=np.uint64)
+    if len(rows):
+        bits = np.left_shift(np.uint64(1), (ids % _WORD).astype(np.uint64))
+        np.bitwise_or.at(out, (rows, ids // _WORD), bits)
+    return out
+
+
+def _matrix(n_rows: int, rows: np.ndarray, ids: np.ndarray, vals: np.ndarray, n_ids: int) -> np.ndarray:
+    out = np.zeros((n_rows, max(1, n_ids)), dtype=np.int32)
+    out[rows, ids] = vals
+    return out
+
+
+# ============================================
+# 빌더 (스냅샷 → 컬럼)
+# ============================================
+class SessionTableBuilder:
+    def __init__(self):
+        # 입력 문장 수는 수백만이 될 수 있으므로 id 상한 없음
+        self.scenes, self.chars, self.flags = Interner(limit=None), Interner(limit=None), Interner(limit=None)
+        self.endings = Interner([""], limit=None)
+        self.msgs, self.choices = Interner(limit=None), Interner(limit=None)
+        self._row_of: Dict[str, int] = {}
+        self._sids: List[str] = []
+        self._scene, self._turn, self._total, self._ending = array("i"), array("i"), array("i"), array("i")
+        self._msg = array("i")                   # 행마다 직전 스냅샷의 입력 id (-1 = 없음)
+        self._last_seq = array("i")
+        self._seq = 0
+        self._ct, self._aff, self._allies, self._flags = _Triplets(), _Triplets(), _Triplets(), _Triplets()
+        self._visited = _Triplets()
+        self._choice_scene, self._choice_msg, self._choice_value = array("i"), array("i"), array("i")
+
+    def add(self, state: Mapping[str, Any]) -> None:
+        g = _game_fields(state)
+        sid = str(g.get("session_id") or f"#{len(self._sids)}")
+        scene = self.scenes.id((g.get("scene") or {}).get("current_scene") or "")
+        seq = self._seq = self._seq + 1
+        row = self._row_of.get(sid)
+        if row is None:
+            row = self._row_of[sid] = len(self._sids)
+            self._sids.append(sid)
+            for col in (self._scene, self._turn, self._total, self._ending, self._last_seq):
+                col.append(0)
+            self._msg.append(-1)
+        turn = int(g.get("turn", 0) or 0)
+        raw = g.get("last_user_msg")
+        msg = self.msgs.id(normalize_message(raw)) if raw else -1
+        if self._last_seq[row]:
+            # 저널: 직전 스냅샷 이후 턴이 진행됐으면 (직전 씬, 입력, 선택) 기록
+            choice = g.get("user_choice")
+            if choice and msg >= 0 and (turn != self._turn[row] or msg != self._msg[row]):
+                self._choice_scene.append(self._scene[row])
+                self._choice_msg.append(msg)
+                self._choice_value.append(self.choices.id(str(choice)))
+        self._scene[row] = scene
+        self._turn[row] = turn
+        self._msg[row] = msg
+        self._total[row] = int(g.get("total_turns_used", 0) or 0)
+        self._ending[row] = self.endings.id(str(g.get("ending") or ""))
+        self._last_seq[row] = seq
+
+        self._visited.add(seq, row, scene)
+        for name in g.get("scene_history") or ():
+            self._visited.add(seq, row, self.scenes.id(name))
+        for ch, v in (g.get("character_turns_used") or {}).items():
+            self._ct.add(seq, row, self.chars.id(ch), int(v))
+        for ch, v in (g.get("affinity") or {}).items():
+            self._aff.add(seq, row, self.chars.id(ch), int(v))
+        for ch, v in (g.get("allies") or {}).items():
+            cid = self.chars.id(ch)
+            if v:
+                self._allies.add(seq, row, cid)
+        for f in g.get("flags") or ():
+            self._flags.add(seq, row, self.flags.id(f))
+
+    def add_all(self, states: Iterable[Mapping[str, Any]]) -> "SessionTableBuilder":
+        for st in states:
+            self.add(st)
+        return self
+
+    def build(self) -> "SessionTable":
+        n = len(self._sids)
+        last = np.frombuffer(self._last_seq, dtype=np.int32)
+        nc = len(self.chars)
+        col = lambda a: np.frombuffer(a, dtype=np.int32).copy()
+        return SessionTable(
+            session_ids=np.array(self._sids, dtype=object),
+            scene=col(self._scene), turn=col(self._turn), total_turns_used=col(self._total), ending=col(self._ending),
+            char_turns=_matrix(n, *self._ct.arrays(last), nc),
+            affinity=_matrix(n, *self._aff.arrays(last), nc),
+            allies=_bitset(n, *self._allies.arrays(last)[:2], nc),
+            flags=_bitset(n, *self._flags.arrays(last)[:2], len(self.flags)),
+            visited=_bitset(n, *self._visited.arrays()[:2], len(self.scenes)),
+            choice_scene=col(self._choice_scene), choice_msg=col(self._choice_msg),
+            choice_value=col(self._choice_value),
+            names={"scenes": self.scenes.names, "chars": self.chars.names, "flags": self.flags.names,
+                   "endings": self.endings.names, "msgs": self.msgs.names, "choices": self.choices.names},
+        )
+
+
+def iter_snapshots(paths: Sequence[str]) -> Iterator[Dict[str, Any]]:
+    """JSONL(한 줄에 상태 하나) 또는 JSON(상태 하나 / 상태 리스트 / {session_id: 상태}) 파일들"""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+                continue
+            data = json.load(f)
+        if isinstance(data, list):
+            yield from data
+        elif isinstance(data, dict) and data and all(isinstance(v, dict) for v in data.values()) \
+                and not ("scene" in data or "current_node" in data):
+            yield from data.values()
+        else:
+            yield data
+
+
+# ============================================
+# 컬럼 테이블 / 질의
+# ============================================
+class SessionTable:
+    ARRAYS = ("session_ids", "scene", "turn", "total_turns_used", "ending", "char_turns", "affinity",
+              "allies", "flags", "visited", "choice_scene", "choice_msg", "choice_value")
+
+    def __init__(self, names: Dict[str, List[str]], **arrays: np.ndarray):
+        self.names = names
+        for key in self.ARRAYS:
+            setattr(self, key, arrays[key])
+        self._ids = {kind: {n: i for i, n in enumerate(ns)} for kind, ns in names.items()}
+
+    def __len__(self) -> int:
+        return len(self.scene)
+
+    @classmethod
+    def from_snapshots(cls, states: Iterable[Mapping[str, Any]]) -> "SessionTable":
+        return SessionTableBuilder().add_all(states).build()
+
+    # ---- 보관 ----
+    def save(self, path: str) -> str:
+        arrays = {k: getattr(self, k) for k in self.ARRAYS if k != "session_ids"}
+        np.savez_compressed(path, session_ids=self.session_ids.astype(str), names=json.dumps(self.names), **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "SessionTable":
+        with np.load(path, allow_pickle=False) as z:
+            arrays = {k: z[k] for k in cls.ARRAYS}
+            names = json.loads(str(z["names"]))
+        arrays["session_ids"] = arrays["session_ids"].astype(object)
+        return cls(names, **arrays)
+
+    # ---- 비트셋 ----
+    def _id(self, kind: str, name: str) -> Optional[int]:
+        return self._ids[kind].get(name)
+
+    @staticmethod
+    def _bit(bits: np.ndarray, i: Optional[int]) -> np.ndarray:
+        if i is None or i // _WORD >= bits.shape[1]:
+            return np.zeros(bits.shape[0], dtype=bool)
+        return ((bits[:, i // _WORD] >> np.uint64(i % _WORD)) & np.uint64(1)).astype(bool)
+
+    def has_flag(self, flag: str) -> np.ndarray:
+        return self._bit(self.flags, self._id("flags", flag))
+
+    def is_ally(self, char: str) -> np.ndarray:
+        return self._bit(self.allies, self._id("chars", char))
+
+    def visited_scene(self, scene: str) -> np.ndarray:
+        return self._bit(self.visited, self._id("scenes", scene))
+
+    def _char_col(self, m: np.ndarray, char: str) -> np.ndarray:
+        i = self._id("chars", char)
+        return m[:, i] if i is not None and i < m.shape[1] else np.zeros(len(self), dtype=np.int32)
+
+    # ---- 질의 ----
+    def reach(self, scene: str) -> float:
+        return float(self.visited_scene(scene).mean()) if len(self) else 0.0
+
+    def funnel(self, scenes: Sequence[str]) -> List[Tuple[str, int, float]]:
+        """[(씬, 여기까지 모두 방문한 세션 수, 직전 단계 대비 비율)]"""
+        out: List[Tuple[str, int, float]] = []
+        mask = np.ones(len(self), dtype=bool)
+        prev = len(self)
+        for scene in scenes:
+            mask &= self.visited_scene(scene)
+            n = int(mask.sum())
+            out.append((scene, n, n / prev if prev else 0.0))
+            prev = n
+        return out
+
+    def drop_off(self) -> Dict[str, Dict[str, float]]:
+        """엔딩 없이 끝난(마지막 스냅샷의) 씬별 세션 수와, 그 씬 도달 세션 대비 비율. 많은 순"""
+        open_ = self.ending == 0
+        n_scenes = len(self.names["scenes"])
+        stopped = np.bincount(self.scene[open_], minlength=n_scenes)
+        out: Dict[str, Dict[str, float]] = {}
+        for i in np.argsort(-stopped, kind="stable"):
+            if stopped[i] == 0:
+                break
+            reached = int(self._bit(self.visited, int(i)).sum())
+            out[self.names["scenes"][i]] = {"sessions": int(stopped[i]),
+                                            "rate": float(stopped[i] / reached) if reached else 0.0}
+        return out
+
+    def endings(self, mask: Optional[np.ndarray] = None) -> Dict[str, int]:
+        codes = self.ending if mask is None else self.ending[mask]
+        counts = np.bincount(codes, minlength=len(self.names["endings"]))
+        return {(self.names["endings"][i] or "none"): int(c) for i, c in enumerate(counts) if c}
+
+    def turn_usage(self, by_ending: bool = False, q: Sequence[float] = (0.5, 0.9, 0.99)) -> Dict[str, Any]:
+        if by_ending:
+            return {(self.names["endings"][e] or "none"): self._usage(self.ending == e, q)
+                    for e in np.unique(self.ending)}
+        return self._usage(np.ones(len(self), dtype=bool), q)
+
+    def _usage(self, mask: np.ndarray, q: Sequence[float]) -> Dict[str, Any]:
+        def stats(x: np.ndarray) -> Dict[str, float]:
+            if not len(x):
+                return {}
+            qs = np.quantile(x, q)
+            return {"mean": float(x.mean()), **{f"p{int(p * 100)}": float(v) for p, v in zip(q, qs)},
+                    "max": float(x.max())}
+        return {
+            "sessions": int(mask.sum()),
+            "turn": stats(self.turn[mask]),
+            "total_turns_used": stats(self.total_turns_used[mask]),
+            "character_turns_used": {ch: stats(self.char_turns[mask, i])
+                                     for i, ch in enumerate(self.names["chars"])
+                                     if i < self.char_turns.shape[1] and self.char_turns[mask, i].any()},
+        }
+
+    def condition(self, rule: Mapping[str, Any]) -> np.ndarray:
+        """rules.compile_condition과 같은 규칙을 세션 전체에 (없는 캐릭터는 0)"""
+        from rules import compile_condition
+        compile_condition(dict(rule))   # 잘못된 limits 키 등은 같은 오류로
+        m = np.ones(len(self), dtype=bool)
+        for f in rule.get("require_flags", []) or []:
+            m &= self.has_flag(f)
+        for f in rule.get("forbid_flags", []) or []:
+            m &= ~self.has_flag(f)
+        limits = rule.get("limits") or {}
+        if "total_turns_used_max" in limits:
+            m &= self.total_turns_used <= int(limits["total_turns_used_max"])
+        for ch, n in (limits.get("char_turns_max") or {}).items():
+            m &= self._char_col(self.char_turns, ch) <= int(n)
+        for ch, n in (rule.get("affinity_min") or {}).items():
+            m &= self._char_col(self.affinity, ch) >= int(n)
+        for ch, n in (rule.get("affinity_max") or {}).items():
+            m &= self._char_col(self.affinity, ch) <= int(n)
+        return m
+
+    def hidden_eligible(self, rule: Optional[Mapping[str, Any]] = None) -> np.ndarray:
+        """parent._hidden_eligible과 같은 판정 (rule이 없으면 DEFAULT_HIDDEN_RULE)"""
+        from parent import DEFAULT_HIDDEN_RULE
+        return self.condition(rule or DEFAULT_HIDDEN_RULE)
+
+    def alias_choices(self, scene: Optional[str] = None, top: int = 20) -> List[Tuple[str, str, str, int]]:
+        """[(씬, 정규화 입력, 선택값, 횟수)] 많은 순"""
+        cs, cm, cv = self.choice_scene, self.choice_msg, self.choice_value
+        if scene is not None:
+            sid = self._id("scenes", scene)
+            keep = cs == (sid if sid is not None else -1)
+            cs, cm, cv = cs[keep], cm[keep], cv[keep]
+        if not len(cs):
+            return []
+        keys = np.stack([cs, cm, cv], axis=1)
+        uniq, counts = np.unique(keys, axis=0, return_counts=True)
+        order = np.argsort(-counts, kind="stable")[:top]
+        n = self.names
+        return [(n["scenes"][uniq[i, 0]], n["msgs"][uniq[i, 1]], n["choices"][uniq[i, 2]], int(counts[i]))
+                for i in order]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="session outcome analytics")
+    ap.add_argument("inputs", nargs="+", help="스냅샷/저널 .json/.jsonl 또는 저장한 .npz")
+    ap.add_argument("--save", default=None, help="변환한 컬럼 테이블을 .npz로 저장")
+    ap.add_argument("--funnel", default="", help="쉼표로 구분한 씬 id")
+    args = ap.parse_args(argv)
+
+    if len(args.inputs) == 1 and args.inputs[0].endswith(".npz"):
+        table = SessionTable.load(args.inputs[0])
+    else:
+        table = SessionTable.from_snapshots(iter_snapshots(args.inputs))
+    if args.save:
+        print(f"saved → {table.save(args.save)}")
+    print(f"sessions: {len(table)}")
+    print("endings:", json.dumps(table.endings(), ensure_ascii=False))
+    if args.funnel:
+        for scene, n, rate in table.funnel(args.funnel.split(",")):
+            print(f"  {scene:40s} {n:8d}  {rate:6.1%}")
+    print("drop-off:", json.dumps(dict(list(table.drop_off().items())[:10]), ensure_ascii=False))
+    print("hidden eligible:", int(table.hidden_eligible().sum()))
+    print("turn usage:", json.dumps(table.turn_usage(), ensure_ascii=False))
+    for row in table.alias_choices(top=10):
+        print("  alias", row)
+
+
+if __name__ == "__main__":
+    main()
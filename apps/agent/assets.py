@@ -0,0 +1,241 @@
+# assets.py
+"""
+씬 이미지/에셋 선행 로딩(prefetch)
+
+- ByteLRU        : 바이트 크기 상한(max_bytes)으로 관리하는 LRU. 스레드 안전
+- reachable()    : split_rules 그래프에서 현재 씬으로부터 depth번 이내 전이로 갈 수 있는 씬 (BFS 순)
+- AssetPrefetcher: 씬 전이 직후 prefetch(scene_id)를 부르면
+                   현재 씬 → 1홉 → 2홉 순서로 default_images를 백그라운드 스레드에서 캐시에 채운다.
+                   get(rid)는 캐시 히트면 즉시, 받는 중이면 그 Future를 기다리고, 없으면 직접 받는다.
+
+에셋 위치(fetch_asset): ImagesRepo 항목의 "url"(http/https) 또는 "path",
+둘 다 없으면 asset_dir/<resource_id>.{png,jpg,jpeg,webp,gif}
+
+찾을 수 없는 에셋(위치 정보도 로컬 파일도 없음, 또는 받기 실패)은 missing_ttl_sec 동안 기억해
+매 턴 같은 fetch를 다시 예약/실패하지 않는다. resolvable(rid)가 False면 prefetch도 get도 건너뛴다.
+"""
+
+from __future__ import annotations
+import os, threading, time, urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import CACHE_REQUESTS, CACHE_ENTRIES, CACHE_BYTES, PREFETCH, ASSET_FETCH_SECONDS
+
+DEFAULT_ASSET_DIR = os.path.join(os.path.dirname(__file__), "assets")
+ASSET_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+Fetcher = Callable[[str, Dict[str, Any]], bytes]
+
+
+# ============================================
+# 크기 제한 LRU
+# ============================================
+class ByteLRU:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, name: str = "images"):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._d: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            v = self._d.get(key)
+            if v is not None:
+                self._d.move_to_end(key)
+        CACHE_REQUESTS.inc(cache=self.name, result="hit" if v is not None else "miss")
+        return v
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._d
+
+    def put(self, key: str, value: bytes) -> bool:
+        """상한보다 큰 값은 넣지 않고 False"""
+        if len(value) > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._d.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._d[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, ev = self._d.popitem(last=False)
+                self._bytes -= len(ev)
+            n, size = len(self._d), self._bytes
+        CACHE_ENTRIES.set(n, cache=self.name)
+        CACHE_BYTES.set(size, cache=self.name)
+        return True
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+
+# ============================================
+# 씬 그래프 탐색
+# ============================================
+def reachable(scenes: Any, scene_id: str, depth: int = 2) -> List[str]:
+    """scene_id 자신 + depth번 이내 전이로 도달 가능한 씬 (가까운 순, 중복 없음)"""
+    order = [scene_id]
+    seen = {scene_id}
+    frontier = deque([(scene_id, 0)])
+    while frontier:
+        sid, d = frontier.popleft()
+        if d >= depth:
+            continue
+        for nxt in scenes.compiled(sid).targets():
+            if nxt not in seen:
+                seen.add(nxt)
+                order.append(nxt)
+                frontier.append((nxt, d + 1))
+    return order
+
+
+def scene_resource_ids(scene_def: Dict[str, Any]) -> List[str]:
+    return [img["resource_id"] for img in scene_def.get("default_images", []) or [] if img.get("resource_id")]
+
+
+# ============================================
+# 에셋 가져오기
+# ============================================
+def fetch_asset(resource_id: str, meta: Dict[str, Any], asset_dir: str = DEFAULT_ASSET_DIR,
+                timeout: float = 10.0) -> bytes:
+    url = meta.get("url")
+    if url:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return resp.read()
+    path = meta.get("path")
+    if not path:
+        for ext in ASSET_EXTS:
+            cand = os.path.join(asset_dir, resource_id + ext)
+            if os.path.exists(cand):
+                path = cand
+                break
+    if not path:
+        raise KeyError(f"asset not found: {resource_id}")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class AssetPrefetcher:
+    def __init__(self, images: Any = None, cache: Optional[ByteLRU] = None, fetch: Optional[Fetcher] = None,
+                 depth: int = 2, workers: int = 2, asset_dir: str = DEFAULT_ASSET_DIR,
+                 missing_ttl_sec: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.images = images                      # ImagesRepo (없으면 asset_dir만 사용)
+        self.cache = cache if cache is not None else ByteLRU()  # 빈 캐시는 len()==0이라 falsy
+        self.depth = depth
+        self.asset_dir = asset_dir
+        self.missing_ttl_sec = missing_ttl_sec
+        self._custom_fetch = fetch is not None    # 주입된 fetch는 위치를 알 수 없으므로 실패 기록으로만 거른다
+        self._fetch = fetch or (lambda rid, meta: fetch_asset(rid, meta, asset_dir))
+        self._missing: Dict[str, float] = {}      # resource_id → 다시 시도해도 되는 시각
+        self._clock = clock
+        self._workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="prefetch")
+        return self._pool
+
+    def _meta(self, rid: str) -> Dict[str, Any]:
+        return self.images.get(rid) if self.images is not None else {}
+
+    def _mark_missing(self, rid: str) -> None:
+        with self._lock:
+            self._missing[rid] = self._clock() + self.missing_ttl_sec
+
+    def resolvable(self, rid: str) -> bool:
+        """받을 수 있어 보이는 에셋인지 (캐시/받는 중이면 True, 최근 실패했거나 위치가 없으면 False)"""
+        if rid in self.cache or rid in self._inflight:
+            return True
+        until = self._missing.get(rid)
+        if until is not None:
+            if until > self._clock():
+                return False
+            with self._lock:
+                self._missing.pop(rid, None)
+        if self._custom_fetch:
+            return True
+        meta = self._meta(rid)
+        if meta.get("url") or meta.get("path"):
+            return True
+        if any(os.path.exists(os.path.join(self.asset_dir, rid + ext)) for ext in ASSET_EXTS):
+            return True
+        self._mark_missing(rid)
+        return False
+
+    def _load(self, rid: str, mode: str) -> Optional[bytes]:
+        t0 = time.perf_counter()
+        data: Optional[bytes] = None
+        try:
+            data = self._fetch(rid, self._meta(rid))
+        except Exception:
+            self._mark_missing(rid)
+            PREFETCH.inc(outcome="failed")
+        else:
+            self.cache.put(rid, data)   # in-flight 해제 전에 캐시에 넣어 get()이 중복으로 받지 않게
+            PREFETCH.inc(outcome="fetched")
+        finally:
+            ASSET_FETCH_SECONDS.observe(time.perf_counter() - t0, mode=mode)
+            with self._lock:
+                self._inflight.pop(rid, None)
+        return data
+
+    def schedule(self, rid: str) -> Optional[Future]:
+        if rid in self.cache:
+            PREFETCH.inc(outcome="cached")
+            return None
+        if not self.resolvable(rid):
+            PREFETCH.inc(outcome="missing")
+            return None
+        pool = self._executor()
+        with self._lock:
+            fut = self._inflight.get(rid)
+            if fut is not None:
+                return fut
+            # 락을 쥔 채 등록 → 작업이 먼저 끝나도 _load의 pop은 등록 이후에 실행된다
+            fut = self._inflight[rid] = pool.submit(self._load, rid, "prefetch")
+        PREFETCH.inc(outcome="scheduled")
+        return fut
+
+    def prefetch(self, scene_id: str, scenes: Any) -> List[str]:
+        """현재 씬과 depth홉 이내 씬들의 이미지를 가까운 순으로 예약. 예약한(또는 이미 캐시에 있는) resource_id 목록 반환"""
+        rids: List[str] = []
+        for sid in reachable(scenes, scene_id, self.depth):
+            for rid in scene_resource_ids(scenes.get_scene(sid)):
+                if rid not in rids and self.resolvable(rid):
+                    rids.append(rid)
+        for rid in rids:
+            self.schedule(rid)
+        return rids
+
+    def get(self, rid: str, timeout: Optional[float] = 10.0) -> Optional[bytes]:
+        data = self.cache.get(rid)
+        if data is not None:
+            return data
+        with self._lock:
+            fut = self._inflight.get(rid)
+        if fut is not None:
+            try:
+                return fut.result(timeout)
+            except Exception:
+                return None
+        if not self.resolvable(rid):
+            return None
+        return self._load(rid, "demand")
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
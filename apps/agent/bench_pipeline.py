@@ -0,0 +1,218 @@
+# bench_pipeline.py
+"""
+에이전트 파이프라인 벤치마크 (config/scenes.json 기준)
+
+micro
+- apply_patch / eval_split_rules / _resolve_allowed_speakers / parse_user_choice_alias / build_prompt
+step
+- ParentAgent.step + MockChildren (씬별)
+graph
+- 컴파일된 LangGraph 한 턴 (router → guardrail → parent), FakeOpenAIClient로 LLM 지연 주입
+  라우터/가드레일 판정 캐시와 중복 제출 캐시는 끄고 잰다 (매 턴 같은 입력이라 켜 두면 캐시 히트만 잰다)
+  --cassette를 주면 FakeOpenAIClient 대신 카세트(cassette.CassetteClient)로 녹화/재생
+  (record: 실제 OpenAI 호출을 녹화, replay: 녹화 응답과 --cassette-latency 지연으로 오프라인 재현)
+
+결과는 benchlib.write_results()로 bench_results/pipeline-<commit>.json에 저장 → 커밋 간 비교
+사용: python bench_pipeline.py [--quick] [--llm-latency-ms 50] [--only micro,step,graph] [--out path]
+      [--baseline 이전결과.json [--threshold 0.1]]  → p50이 threshold 이상 느려지면 종료 코드 1
+      [--cassette 카세트.jsonl [--cassette-mode record|replay] [--cassette-latency none|recorded|sampled]]
+"""
+
+from __future__ import annotations
+import argparse, contextlib, io, os, sys, time
+from typing import Any, Callable, Dict
+
+from benchlib import compare_results, measure, summarize, write_results
+from children import MockChildren
+from cassette import CassetteClient
+from fake_llm import FakeOpenAIClient
+from parent import (
+    ParentAgent, ScenesRepo, CharactersRepo, load_json, apply_patch, eval_split_rules,
+    _resolve_allowed_speakers, parse_user_choice_alias, _iso_now,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENES_PATH = os.path.join(HERE, "config", "scenes.json")
+
+SCN_FORK = "scene5_fork_decision"
+SCN_GATHER = "scene5_mission_gather"
+SCN_JUDGE = "scene5_mission_judgement"
+
+
+def _base_state(scene_id: str) -> Dict[str, Any]:
+    return {
+        "scene": {"current_scene": scene_id},
+        "turn": 3, "total_turns_used": 3,
+        "character_turns_used": {"inosuke": 1, "zenitsu": 1},
+        "allies": {"inosuke": True, "zenitsu": True},
+        "affinity": {"tanjiro": 650, "inosuke": 420, "zenitsu": 380},
+        "flags": ["order_first_inosuke", "order_inosuke_then_zenitsu",
+                  "recruited_inosuke", "recruited_zenitsu"],
+        "ending": "", "end_reason": "", "user_choice": None,
+        "last_user_msg": "", "scene_history": [SCN_FORK, SCN_GATHER], "updated_at": _iso_now(),
+        "user_id": "u1", "session_id": "bench", "scenario_id": "cutscene5_akaza",
+    }
+
+
+def _envelope(msg: str, hint: str | None = None) -> Dict[str, Any]:
+    env: Dict[str, Any] = {
+        "session_id": "bench", "turn": 3, "user_msg_raw": msg,
+        "recent_messages": [{"role": "user", "content": msg}],
+        "guardrail": {"allowed": True, "sanitized_user_msg": msg},
+    }
+    if hint:
+        env["router_choice_hint"] = {"value": hint, "confidence": 0.9}
+    return env
+
+
+def _op(samples) -> Dict[str, float]:
+    st = summarize(samples)
+    st["ops_per_sec"] = 1000.0 / st["p50_ms"] if st.get("p50_ms") else 0.0
+    return st
+
+
+def bench_micro(scenes: ScenesRepo, characters: CharactersRepo, number: int, repeat: int) -> Dict[str, Any]:
+    judge = scenes.get_scene(SCN_JUDGE)
+    fork = scenes.get_scene(SCN_FORK)
+    state = _base_state(SCN_JUDGE)
+    patch = {
+        "turn": {"$inc": 1}, "total_turns_used": {"$inc": 1},
+        "character_turns_used": {"zenitsu": {"$inc": 1}},
+        "affinity": {"zenitsu": {"$inc": 30}},
+        "allies": {"zenitsu": True},
+        "scene_history": {"$push": SCN_GATHER},
+    }
+    parent = ParentAgent(scenes=scenes, llm=MockChildren(), characters=characters)
+    env = _envelope("결과 확인", "finish")
+
+    cases: Dict[str, Callable[[], Any]] = {
+        "apply_patch": lambda: apply_patch(state, patch),
+        "eval_split_rules": lambda: eval_split_rules(judge, state, "finish"),
+        "resolve_allowed_speakers": lambda: _resolve_allowed_speakers(judge, state),
+        "parse_user_choice_alias": lambda: parse_user_choice_alias("곧장 렌고쿠에게 달려간다", fork),
+        "build_prompt": lambda: parent.build_prompt(state, env),
+    }
+    return {name: _op(measure(fn, number=number, repeat=repeat)) for name, fn in cases.items()}
+
+
+def bench_step(scenes: ScenesRepo, characters: CharactersRepo, number: int, repeat: int) -> Dict[str, Any]:
+    parent = ParentAgent(scenes=scenes, llm=MockChildren(), characters=characters)
+    cases = {
+        "step_fork_decision": (_base_state(SCN_FORK), _envelope("동료를 모으자", "gather_allies")),
+        "step_mission_gather": (_base_state(SCN_GATHER), _envelope("젠이츠 설득", "try_zenitsu")),
+        "step_judgement": (_base_state(SCN_JUDGE), _envelope("결과 확인", "finish")),
+        "step_no_choice": (_base_state(SCN_GATHER), _envelope("...")),
+    }
+    return {name: _op(measure(lambda s=s, e=e: parent.step(s, e), number=number, repeat=repeat))
+            for name, (s, e) in cases.items()}
+
+
+def _graph_state() -> Dict[str, Any]:
+    return dict(
+        session_id="bench", current_node=SCN_FORK, game_mode="story",
+        user_history=["user는 렌고쿠의 제자이다. 무한 열차가 멈추고,",
+                      "탄지로: 렌고쿠 씨! 저 녀석은 상현의 오니야!"],
+        agent_outputs=[], master_turn_count=0, sub_turn_count=0, turn_limit=100,
+        is_voting_active=False, affinity={}, vote_options=[], user_votes={},
+        scene_image_url="", next_node="", classification="", severity="",
+        flags=[], scene_history=[],
+    )
+
+
+@contextlib.contextmanager
+def _decision_caches_off():
+    import decision_cache
+    saved = {site: decision_cache._caches.get(site) for site in ("router", "guardrail")}
+    for site in saved:
+        decision_cache.set_decision_cache(site, decision_cache.DecisionCache(f"{site}_decisions", ttl_sec=0))
+    try:
+        yield
+    finally:
+        for site, cache in saved.items():
+            decision_cache.set_decision_cache(site, cache)
+
+
+def bench_graph(llm_latency_ms: float, turns: int, client: Any = None) -> Dict[str, Any]:
+    from main import AppFactory
+    from idempotency import TurnDeduper
+
+    client = client if client is not None else FakeOpenAIClient(latency_ms=llm_latency_ms, seed=0)
+    factory = AppFactory(use_mock_children=False, children_model="gpt-4o",
+                         scenes_source=SCENES_PATH, openai_client=client)
+    # 매 턴이 같은 세션·turn·메시지라 중복 제출 캐시가 켜져 있으면 파이프라인 대신 캐시를 재게 된다
+    factory.turn_dedup = TurnDeduper(window_sec=0)
+    sink = io.StringIO()
+    # 라우터/가드레일 판정 캐시도 끈다 (워밍업 뒤 모든 턴이 캐시 히트가 되어 LLM 호출이 3 → 1로 줄어든다)
+    with contextlib.redirect_stdout(sink), _decision_caches_off():
+        factory.graph  # 컴파일 비용은 측정에서 제외
+        state = _graph_state()
+        factory.run_turn(state, "워밍업")
+        samples = []
+        calls0 = client.calls
+        for _ in range(turns):
+            state = _graph_state()
+            t0 = time.perf_counter()
+            factory.run_turn(state, "동료 규합하자")
+            samples.append(time.perf_counter() - t0)
+    st = summarize(samples)
+    st["llm_latency_ms"] = llm_latency_ms
+    st["llm_calls_per_turn"] = (client.calls - calls0) / max(turns, 1)
+    st["overhead_p50_ms"] = st["p50_ms"] - llm_latency_ms * st["llm_calls_per_turn"]
+    return {"graph_turn": st}
+
+
+def main(argv=None) -> str:
+    ap = argparse.ArgumentParser(description="agent pipeline benchmarks")
+    ap.add_argument("--quick", action="store_true", help="반복 횟수를 줄여 빠르게 실행")
+    ap.add_argument("--llm-latency-ms", type=float, default=0.0)
+    ap.add_argument("--only", default="micro,step,graph")
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--baseline", default=None, help="비교할 이전 결과 JSON")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    ap.add_argument("--cassette", default=None, help="graph 벤치 LLM 호출을 녹화/재생할 카세트 JSONL")
+    ap.add_argument("--cassette-mode", default="replay", choices=("record", "replay"))
+    ap.add_argument("--cassette-latency", default="recorded", choices=("none", "recorded", "sampled"))
+    args = ap.parse_args(argv)
+
+    only = set(args.only.split(","))
+    number, repeat, turns = (200, 3, 20) if args.quick else (2000, 7, 200)
+
+    scenes = ScenesRepo(load_json(SCENES_PATH))
+    characters = CharactersRepo.from_profiles()
+
+    results: Dict[str, Any] = {"params": {"number": number, "repeat": repeat, "turns": turns,
+                                          "llm_latency_ms": args.llm_latency_ms}}
+    if "micro" in only:
+        results["micro"] = bench_micro(scenes, characters, number, repeat)
+    if "step" in only:
+        results["step"] = bench_step(scenes, characters, max(number // 10, 10), repeat)
+    if "graph" in only:
+        client = None
+        if args.cassette:
+            from llm_client import get_openai_client
+            client = CassetteClient(args.cassette, mode=args.cassette_mode, inner_factory=get_openai_client,
+                                    latency=args.cassette_latency)
+            results["params"]["cassette"] = {"path": args.cassette, "mode": args.cassette_mode,
+                                             "latency": args.cassette_latency}
+        results["graph"] = bench_graph(args.llm_latency_ms, turns, client)
+
+    # 같은 커밋에서 다시 돌리면 baseline 파일을 덮어쓸 수 있으므로 비교를 먼저 한다
+    diff = compare_results(args.baseline, results, args.threshold) if args.baseline else None
+    path = write_results("pipeline", results, args.out)
+    for group in ("micro", "step", "graph"):
+        for name, st in results.get(group, {}).items():
+            print(f"{group:5s} {name:26s} p50={st['p50_ms'] * 1000:.1f}µs p95={st['p95_ms'] * 1000:.1f}µs")
+    print(f"→ {path}")
+
+    if diff is not None:
+        regressed = [name for name, d in diff.items() if d["regressed"]]
+        for name, d in sorted(diff.items()):
+            mark = "  ⚠ REGRESSION" if d["regressed"] else ""
+            print(f"  {name:32s} {d['base_ms'] * 1000:9.1f}µs → {d['new_ms'] * 1000:9.1f}µs  x{d['ratio']:.2f}{mark}")
+        if regressed:
+            sys.exit(1)
+    return path
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# bench_startup.py
+"""
+콜드 스타트 벤치마크
+
+매 반복마다 새 파이썬 프로세스를 띄워서 측정한다 (모듈 캐시가 없는 상태).
+- import_main     : `import main` 소요 시간 (import 시점 부작용 비용)
+- factory_graph   : AppFactory(use_mock_children=True).graph 빌드 시간 (첫 턴 직전 준비 비용)
+- interpreter     : 빈 인터프리터 기동 시간 (기준선)
+
+사용: python bench_startup.py [--runs 10] [--out path.json]
+"""
+
+from __future__ import annotations
+import argparse, json, os, subprocess, sys, time
+
+from benchlib import summarize, write_results
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+f = main.AppFactory(use_mock_children=True)
+f.graph
+t2 = time.perf_counter()
+print(json.dumps({"import_main": t1 - t0, "factory_graph": t2 - t1}))
+"""
+
+
+def _run_probe() -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=HERE, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _run_interpreter() -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - t0
+
+
+def main(argv=None) -> str:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+
+    samples = {"import_main": [], "factory_graph": [], "interpreter": []}
+    for _ in range(args.runs):
+        probe = _run_probe()
+        samples["import_main"].append(probe["import_main"])
+        samples["factory_graph"].append(probe["factory_graph"])
+        samples["interpreter"].append(_run_interpreter())
+
+    results = {name: summarize(vals) for name, vals in samples.items()}
+    path = write_results("startup", results, args.out)
+    for name, st in results.items():
+        print(f"{name:14s} p50={st['p50_ms']:.1f}ms p95={st['p95_ms']:.1f}ms")
+    print(f"→ {path}")
+    return path
+
+
+if __name__ == "__main__":
+    main()
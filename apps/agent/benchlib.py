@@ -0,0 +1,109 @@
+# benchlib.py
+"""
+벤치마크 공용 유틸
+- summarize(): 샘플(초) → ms 단위 통계(p50/p95/p99 등)
+- measure(): fn을 number회씩 repeat번 돌려 1회당 소요 시간 샘플 수집
+- write_results(): 커밋 간 비교가 가능하도록 실행 환경 정보와 함께 JSON으로 저장
+- compare_results(): 이전 결과 파일 대비 p50 변화율 계산 (회귀 탐지)
+"""
+
+from __future__ import annotations
+import datetime, json, os, platform, statistics, subprocess, sys, time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "bench_results")
+
+
+def percentile(sorted_vals: Sequence[float], q: float) -> float:
+    """정렬된 값에서 선형 보간 백분위 (q: 0~100)"""
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def summarize(samples_sec: List[float]) -> Dict[str, float]:
+    vals = sorted(s * 1000.0 for s in samples_sec)
+    if not vals:
+        return {"n": 0}
+    return {
+        "n": len(vals),
+        "mean_ms": statistics.fmean(vals),
+        "min_ms": vals[0],
+        "p50_ms": percentile(vals, 50),
+        "p95_ms": percentile(vals, 95),
+        "p99_ms": percentile(vals, 99),
+        "max_ms": vals[-1],
+    }
+
+
+def measure(fn: Callable[[], Any], number: int = 1000, repeat: int = 7, warmup: int = 1) -> List[float]:
+    """1회당 평균 소요 시간(초) 샘플 repeat개"""
+    for _ in range(warmup):
+        for _ in range(number):
+            fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number)
+    return samples
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__) or ".",
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_info() -> Dict[str, Any]:
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(suite: str, results: Dict[str, Any], out: Optional[str] = None) -> str:
+    """bench_results/<suite>-<commit>.json (또는 out 경로)에 저장하고 경로를 반환"""
+    info = run_info()
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{suite}-{info['commit'] or 'nogit'}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"suite": suite, "run": info, "results": results}, f, ensure_ascii=False, indent=2)
+    return out
+
+
+def _iter_stats(results: Dict[str, Any], prefix: str = ""):
+    for k, v in results.items():
+        if isinstance(v, dict) and "p50_ms" in v:
+            yield prefix + k, v
+        elif isinstance(v, dict):
+            yield from _iter_stats(v, prefix + k + ".")
+
+
+def compare_results(baseline_path: str, results: Dict[str, Any], threshold: float = 0.10) -> Dict[str, Dict[str, float]]:
+    """
+    baseline 파일과 현재 results의 p50을 비교.
+    반환: {name: {"base_ms", "new_ms", "ratio", "regressed"}}  (ratio = new/base)
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        base = dict(_iter_stats(json.load(f).get("results", {})))
+    out: Dict[str, Dict[str, float]] = {}
+    for name, st in _iter_stats(results):
+        b = base.get(name)
+        if not b or not b.get("p50_ms"):
+            continue
+        ratio = st["p50_ms"] / b["p50_ms"]
+        out[name] = {"base_ms": b["p50_ms"], "new_ms": st["p50_ms"], "ratio": ratio,
+                     "regressed": ratio > 1.0 + threshold}
+    return out
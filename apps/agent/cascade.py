@@ -0,0 +1,125 @@
+# cascade.py
+"""
+호출 지점(call_site)별 모델 캐스케이드
+
+작은 모델부터 호출하고, 아래 경우에만 다음(더 큰) 모델로 올린다.
+- schema         : 응답이 형식(JSON 키/허용 값, ParentLLMResult)을 만족하지 않음
+- low_confidence : 모델이 스스로 보고한 confidence가 정책의 min_confidence 미만 (보고가 없으면 0으로 간주)
+- borderline     : 가드레일이 "borderline": true로 애매하다고 표시
+- error          : 호출/파싱 실패
+마지막 단계 모델의 응답은 판정 없이 채택한다. 데드라인 초과(DeadlineExceeded)와 브레이커 open(CircuitOpen)은
+올리지 않고 그대로 던진다 (호출 지점 예산을 이미 다 썼거나 큰 모델도 같은 브레이커에 막힌다).
+
+정책 기본값은 CASCADE_POLICIES. 환경변수 AGENT_CASCADE_<CALL_SITE>="모델1,모델2"로 바꿀 수 있고
+모델을 하나만 주면 캐스케이드 없이 그 모델만 쓴다 (예: AGENT_CASCADE_ROUTER=gpt-4o).
+
+단계별 결과는 agent_cascade_calls_total{call_site, model, outcome}에 쌓이고
+hit_rates()가 (call_site, model)별 채택 비율을 돌려준다.
+"""
+
+from __future__ import annotations
+import json, os
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, TypeVar
+
+from metrics import CASCADE_CALLS
+from resilience import CircuitOpen, DeadlineExceeded
+
+T = TypeVar("T")
+Judge = Callable[[Any], Optional[str]]   # 결과 → 올릴 이유(None이면 채택)
+
+
+@dataclass(frozen=True)
+class CascadePolicy:
+    call_site: str
+    models: Tuple[str, ...]              # 작은 모델 → 큰 모델 순
+    min_confidence: float = 0.7
+
+    def with_final(self, model: str) -> "CascadePolicy":
+        """마지막 단계를 model로 (앞 단계에 같은 모델이 있으면 거기서 끝)"""
+        models = tuple(m for m in self.models[:-1] if m != model) + (model,)
+        return replace(self, models=models)
+
+
+def _env_models(call_site: str, default: Tuple[str, ...]) -> Tuple[str, ...]:
+    raw = os.getenv(f"AGENT_CASCADE_{call_site.upper()}", "")
+    models = tuple(m.strip() for m in raw.split(",") if m.strip())
+    return models or default
+
+
+CASCADE_POLICIES: Dict[str, CascadePolicy] = {
+    site: CascadePolicy(site, _env_models(site, ("gpt-4o-mini", "gpt-4o")), conf)
+    for site, conf in (("router", 0.7), ("guardrail", 0.8), ("children", 0.0))
+}
+
+
+def cascade_policy(call_site: str, default_model: str = "gpt-4o") -> CascadePolicy:
+    """등록된 정책, 없으면 default_model 단일 단계"""
+    return CASCADE_POLICIES.get(call_site) or CascadePolicy(call_site, (default_model,))
+
+
+# ============================================
+# 실행
+# ============================================
+def run_cascade(policy: CascadePolicy, attempt: Callable[[str], T], judge: Judge) -> T:
+    result: Any = None
+    last = len(policy.models) - 1
+    for i, model in enumerate(policy.models):
+        try:
+            result = attempt(model)
+            reason = judge(result) if i < last else None
+        except Exception as e:
+            if i == last or isinstance(e, (DeadlineExceeded, CircuitOpen)):
+                CASCADE_CALLS.inc(call_site=policy.call_site, model=model, outcome="error")
+                raise
+            reason = "error"
+        CASCADE_CALLS.inc(call_site=policy.call_site, model=model, outcome=reason or "accepted")
+        if reason is None:
+            return result
+    return result
+
+
+# ============================================
+# 판정 함수
+# ============================================
+def json_judge(field: str, allowed: Iterable[str], min_confidence: float,
+               borderline_key: Optional[str] = None) -> Judge:
+    """dict 응답: field 값이 allowed 안에 있고, confidence ≥ min_confidence, borderline 표시가 없어야 채택"""
+    allowed_set = frozenset(allowed)
+
+    def judge(result: Any) -> Optional[str]:
+        if not isinstance(result, dict) or result.get(field) not in allowed_set:
+            return "schema"
+        if borderline_key and result.get(borderline_key):
+            return "borderline"
+        try:
+            conf = float(result.get("confidence", 0.0))
+        except (TypeError, ValueError):
+            return "schema"
+        return "low_confidence" if conf < min_confidence else None
+    return judge
+
+
+def children_judge(text: Any) -> Optional[str]:
+    """Children 원문: ParentLLMResult 스키마 통과 여부"""
+    from parent import ParentLLMResult  # parent → children 순환 import 방지
+    try:
+        ParentLLMResult(**json.loads(text))
+    except Exception:
+        return "schema"
+    return None
+
+
+def hit_rates() -> Dict[str, Dict[str, float]]:
+    """{call_site: {model: 그 단계에서 채택된 비율}}"""
+    totals: Dict[Tuple[str, str], float] = {}
+    hits: Dict[Tuple[str, str], float] = {}
+    for labels, value in CASCADE_CALLS.samples():
+        key = (labels["call_site"], labels["model"])
+        totals[key] = totals.get(key, 0.0) + value
+        if labels["outcome"] == "accepted":
+            hits[key] = hits.get(key, 0.0) + value
+    out: Dict[str, Dict[str, float]] = {}
+    for (site, model), total in sorted(totals.items()):
+        out.setdefault(site, {})[model] = hits.get((site, model), 0.0) / total if total else 0.0
+    return out
@@ -0,0 +1,202 @@
+# cassette.py
+"""
+LLM 호출 녹화/재생(cassette) 전송 계층
+
+OpenAI 클라이언트와 같은 모양(client.chat.completions.create)으로 감싸므로
+call_llm(라우터/가드레일), router.run_router_agent, OpenAIChildren이 모두 그대로 통과한다.
+
+- record : 실제(inner) 클라이언트를 호출하고 요청/응답/소요 시간을 JSONL 카세트에 덧붙인다
+- replay : 정규화한 요청의 해시로 녹화본을 찾아 돌려준다 (inner 불필요, 네트워크 없음)
+           같은 요청이 여러 번 녹화됐으면 녹화 순서대로 돌아가며 재생 → 결정적
+           없는 요청은 CassetteMiss
+- latency: "none"(즉시) | "recorded"(그 응답의 실제 소요 시간) | "sampled"(같은 모델의 녹화 지연 분포에서 seed로 추출)
+           latency_scale로 배율 조정
+
+요청 정규화(canonical_request): model + messages(role, 공백 정리한 content) + 결과에 영향 주는 인자
+(temperature, response_format 등). 키 순서/공백 차이는 같은 요청으로 본다.
+
+환경변수: AGENT_CASSETTE=카세트.jsonl, AGENT_CASSETTE_MODE=record|replay,
+          AGENT_CASSETTE_LATENCY=none|recorded|sampled  (llm_client.get_openai_client가 사용)
+"""
+
+from __future__ import annotations
+import hashlib, itertools, json, os, random, re, threading, time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+MODES = ("record", "replay")
+LATENCY_MODES = ("none", "recorded", "sampled")
+_WS = re.compile(r"\s+")
+# 응답 내용에 영향이 없는 전송 옵션은 키에서 뺀다
+_IGNORED_KWARGS = frozenset({"timeout", "extra_headers", "extra_query", "extra_body", "stream_options", "user"})
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+def canonical_request(model: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+    msgs = [{"role": m.get("role", ""), "content": _WS.sub(" ", str(m.get("content", ""))).strip()}
+            for m in messages]
+    extra = {k: v for k, v in kwargs.items() if k not in _IGNORED_KWARGS}
+    return json.dumps({"model": model, "messages": msgs, "kwargs": extra},
+                      ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def request_key(canonical: str) -> str:
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+
+def _usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    if usage is None:
+        return None
+    return {k: int(getattr(usage, k, 0) or 0) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+
+def _response(entry: Dict[str, Any]) -> SimpleNamespace:
+    resp = entry["response"]
+    usage = resp.get("usage")
+    return SimpleNamespace(
+        model=resp.get("model", ""),
+        choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=resp.get("content", "")),
+                                 finish_reason=resp.get("finish_reason", "stop"), index=0)],
+        usage=SimpleNamespace(**usage) if usage else None,
+    )
+
+
+class _Completions:
+    def __init__(self, owner: "CassetteClient"):
+        self._owner = owner
+
+    def create(self, model: str = "", messages: Optional[List[Dict[str, Any]]] = None, **kwargs: Any):
+        return self._owner._create(model, messages or [], kwargs)
+
+
+class CassetteClient:
+    def __init__(self, path: str, mode: str = "replay", inner: Any = None,
+                 inner_factory: Optional[Callable[[], Any]] = None,
+                 latency: str = "none", latency_scale: float = 1.0, seed: Optional[int] = 0):
+        if mode not in MODES:
+            raise ValueError(f"unknown cassette mode: {mode!r} (expected one of {MODES})")
+        if latency not in LATENCY_MODES:
+            raise ValueError(f"unknown latency mode: {latency!r} (expected one of {LATENCY_MODES})")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self._inner = inner
+        self._inner_factory = inner_factory
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, Any] = {}
+        self._elapsed: Dict[str, List[float]] = {}   # model → 녹화된 소요 시간들
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        if mode == "replay" or os.path.exists(path):
+            self._load()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    # ---- 카세트 파일 ----
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+
+    def _index(self, entry: Dict[str, Any]) -> None:
+        self._entries.setdefault(entry["key"], []).append(entry)
+        self._elapsed.setdefault(entry["request"]["model"], []).append(float(entry.get("elapsed", 0.0)))
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._index(entry)
+            self.recorded += 1
+
+    @property
+    def calls(self) -> int:
+        return self.hits + self.recorded
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._entries.values())
+
+    # ---- 호출 ----
+    def _client(self) -> Any:
+        if self._inner is None:
+            if self._inner_factory is None:
+                raise RuntimeError("record mode needs an inner client")
+            self._inner = self._inner_factory()
+        return self._inner
+
+    def _create(self, model: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]):
+        canonical = canonical_request(model, messages, kwargs)
+        key = request_key(canonical)
+        if self.mode == "record":
+            return self._record(key, canonical, model, messages, kwargs)
+        return self._replay(key, model)
+
+    def _record(self, key: str, canonical: str, model: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]):
+        t0 = time.perf_counter()
+        resp = self._client().chat.completions.create(model=model, messages=messages, **kwargs)
+        elapsed = time.perf_counter() - t0
+        choice = resp.choices[0]
+        self._append({
+            "key": key,
+            "request": json.loads(canonical),
+            "response": {"model": getattr(resp, "model", model), "content": choice.message.content,
+                         "finish_reason": getattr(choice, "finish_reason", "stop"),
+                         "usage": _usage_dict(getattr(resp, "usage", None))},
+            "elapsed": round(elapsed, 6),
+            "recorded_at": time.time(),
+        })
+        return resp
+
+    def _replay(self, key: str, model: str):
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise CassetteMiss(f"no recorded response for request {key} (model={model}) in {self.path}")
+            cursor = self._cursors.get(key)
+            if cursor is None:
+                cursor = self._cursors[key] = itertools.cycle(entries)
+            entry = next(cursor)
+            self.hits += 1
+            delay = self._delay(entry, model)
+        if delay > 0:
+            time.sleep(delay)
+        return _response(entry)
+
+    def _delay(self, entry: Dict[str, Any], model: str) -> float:
+        # _lock 안에서 호출 (rng 공유)
+        if self.latency == "recorded":
+            return float(entry.get("elapsed", 0.0)) * self.latency_scale
+        if self.latency == "sampled":
+            pool = self._elapsed.get(model) or [float(entry.get("elapsed", 0.0))]
+            return self._rng.choice(pool) * self.latency_scale
+        return 0.0
+
+    def latency_profile(self) -> Dict[str, Dict[str, float]]:
+        """모델별 녹화 지연 요약 (초): count / p50 / p95 / max"""
+        out: Dict[str, Dict[str, float]] = {}
+        for model, xs in self._elapsed.items():
+            s = sorted(xs)
+            out[model] = {"count": len(s), "p50": s[len(s) // 2], "p95": s[min(len(s) - 1, int(len(s) * 0.95))],
+                          "max": s[-1]}
+        return out
+
+
+def cassette_from_env(inner_factory: Callable[[], Any]) -> Optional[CassetteClient]:
+    path = os.getenv("AGENT_CASSETTE")
+    if not path:
+        return None
+    return CassetteClient(path, mode=os.getenv("AGENT_CASSETTE_MODE", "replay"), inner_factory=inner_factory,
+                          latency=os.getenv("AGENT_CASSETTE_LATENCY", "none"),
+                          latency_scale=float(os.getenv("AGENT_CASSETTE_LATENCY_SCALE", "1.0")))
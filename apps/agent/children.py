@@ -1,7 +1,12 @@
 # children.py
 from __future__ import annotations
-import json
-from typing import Any, Dict
+import json, time
+from typing import Any, Dict, Optional
+
+from tracing import record_llm
+from metrics import observe_llm_call, CHILDREN_RETRIES, LLM_RESILIENCE
+from cascade import CascadePolicy, children_judge, run_cascade
+from resilience import deadline_for, guarded
 
 # ------------------------------
 # 1) 공통: Children 인터페이스
@@ -66,10 +71,16 @@ class OpenAIChildren(ChildrenBase):
     OpenAI Chat Completions(혹은 Responses)로 Children 구현 예시.
     - 모델에게: "반드시 JSON만" 반환하도록 강하게 지시
     - 실패 시 1회 재시도 + 간단한 JSON 복구
+    - cascade를 주면 작은 모델부터 호출하고 ParentLLMResult 스키마를 통과하지 못할 때만 다음 모델로
+    - 각 호출은 resilience.guarded("children")로 데드라인/헤지/브레이커 적용 (데드라인은 캐스케이드 전체에 한 번).
+      끝내 실패하면(브레이커 open 포함) fallback(기본 MockChildren: 씬 beats/choices 기반)으로 대체
     """
-    def __init__(self, client, model: str = "gpt-4o-mini"):
+    def __init__(self, client, model: str = "gpt-4o-mini", cascade: Optional[CascadePolicy] = None,
+                 fallback: Optional[ChildrenBase] = None):
         self.client = client
         self.model = model
+        self.cascade = cascade or CascadePolicy("children", (model,))
+        self.fallback = fallback if fallback is not None else MockChildren()
 
         # 시스템 프롬프트: 절대 JSON 외 형식 금지
         self.system_msg = (
@@ -79,6 +90,18 @@ class OpenAIChildren(ChildrenBase):
         )
 
     def __call__(self, prompt_json_str: str) -> str:
+        deadline = deadline_for("children")   # 캐스케이드 단계 전체가 나눠 쓰는 예산
+        try:
+            return run_cascade(self.cascade,
+                               lambda model: guarded("children", lambda: self._generate(prompt_json_str, model),
+                                                     deadline),
+                               children_judge)
+        except Exception as e:
+            print(f"[Children] LLM 호출 실패 → 로컬 대체 출력 사용: {e}")
+            LLM_RESILIENCE.inc(call_site="children", event="degraded")
+            return self.fallback(prompt_json_str)
+
+    def _generate(self, prompt_json_str: str, model: str) -> str:
         prompt = prompt_json_str
 
         # 1) LLM 호출
@@ -86,11 +109,19 @@ class OpenAIChildren(ChildrenBase):
             {"role": "system", "content": self.system_msg},
             {"role": "user", "content": prompt},
         ]
-        raw = self.client.chat.completions.create(
-            model=self.model,
-            messages=content,
-            temperature=0.7,
-        )
+        t0 = time.perf_counter()
+        try:
+            raw = self.client.chat.completions.create(
+                model=model,
+                messages=content,
+                temperature=0.7,
+            )
+        except Exception:
+            observe_llm_call("children", model, time.perf_counter() - t0, "error")
+            raise
+        elapsed = time.perf_counter() - t0
+        record_llm(model, elapsed, getattr(raw, "usage", None))
+        observe_llm_call("children", model, elapsed, "ok", getattr(raw, "usage", None))
 
         txt = raw.choices[0].message.content.strip()
 
@@ -99,12 +130,21 @@ class OpenAIChildren(ChildrenBase):
             data = json.loads(txt)
         except Exception:
             # 재요청(엄격 지시)
+            CHILDREN_RETRIES.inc()
             content.append({"role":"system","content":"Return ONLY valid JSON. No prose. No markdown."})
-            raw2 = self.client.chat.completions.create(
-                model=self.model,
-                messages=content,
-                temperature=0.2,
-            )
+            t0 = time.perf_counter()
+            try:
+                raw2 = self.client.chat.completions.create(
+                    model=model,
+                    messages=content,
+                    temperature=0.2,
+                )
+            except Exception:
+                observe_llm_call("children", model, time.perf_counter() - t0, "error")
+                raise
+            elapsed = time.perf_counter() - t0
+            record_llm(model, elapsed, getattr(raw2, "usage", None))
+            observe_llm_call("children", model, elapsed, "retry", getattr(raw2, "usage", None))
             txt = raw2.choices[0].message.content.strip()
             # 마지막으로 억지 파싱 시도 (중괄호만 추출)
             start = txt.find("{")
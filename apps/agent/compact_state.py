@@ -0,0 +1,344 @@
+# compact_state.py
+"""
+유휴 세션용 압축 표현
+
+턴 사이에 보관되는 GraphState dict는 affinity / allies / character_turns_used / flags / scene_history마다
+같은 몇 개의 씬·캐릭터·플래그 이름을 문자열 키로 반복해서 들고 있다. 워커 하나에 몇 개의 세션이
+올라가는지는 유휴 세션 하나의 메모리가 정하므로, 턴이 끝나면 CompactSession으로 접어 둔다.
+
+- ScenarioSymbols : 컴파일된 시나리오(ScenesRepo.symbols())에서 뽑은 씬/캐릭터/플래그 이름 ↔ 정수 id
+                    시나리오에 없는 이름(핫 리로드로 추가된 씬, 코드 상수 플래그 등)은 처음 볼 때 뒤에 붙인다
+- CompactSession  : __slots__ 객체
+                    · 씬 → 씬 id, scene_history → array('H')
+                    · character_turns_used / affinity → 캐릭터 id로 색인한 array('i') + 존재 비트마스크
+                    · allies → 존재/값 비트마스크 두 개, flags → 정수 비트셋
+                    · 턴마다 초기화되는 일시 필드(render, classification 등)는 기본값이면 저장하지 않음
+                    Mapping[str, Any]으로 GraphState 키를 그대로 읽을 수 있다 (dict 호환 뷰)
+- CompactSessions : session_id → GraphState의 MutableMapping. 넣을 때 압축, 꺼낼 때 일반 dict로 펼침
+                    (server.TurnRunner / sharding 워커의 세션 테이블을 그대로 대체)
+
+펼친 dict는 LangGraph에 그대로 넘긴다. 그래프 안의 apply_patch / 규칙 엔진은 바뀌지 않는다.
+"""
+
+from __future__ import annotations
+import threading
+from array import array
+from collections.abc import Mapping, MutableMapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# ============================================
+# 심볼 테이블
+# ============================================
+_MAX_IDS = 1 << 16   # scene_history가 array('H')
+
+
+class Interner:
+    """이름 ↔ 0부터 시작하는 id. 추가만 되고 id는 바뀌지 않는다."""
+    __slots__ = ("names", "_ids", "_lock", "_limit")
+
+    def __init__(self, names: Iterable[str] = (), limit: Optional[int] = _MAX_IDS):
+        self.names: List[str] = []
+        self._limit = limit
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        for n in names:
+            self.id(n)
+
+    def id(self, name: str) -> int:
+        i = self._ids.get(name)
+        if i is None:
+            with self._lock:
+                i = self._ids.get(name)
+                if i is None:
+                    if self._limit is not None and len(self.names) >= self._limit:
+                        raise OverflowError(f"too many interned names ({self._limit})")
+                    i = len(self.names)
+                    self.names.append(name)
+                    self._ids[name] = i
+        return i
+
+    def get(self, name: str) -> Optional[int]:
+        return self._ids.get(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class ScenarioSymbols:
+    __slots__ = ("scenes", "chars", "flags")
+
+    def __init__(self, scenes: Iterable[str] = (), chars: Iterable[str] = (), flags: Iterable[str] = ()):
+        self.scenes = Interner(scenes)
+        self.chars = Interner(chars)
+        self.flags = Interner(flags)
+
+
+def scenario_symbols(scenes: Mapping[str, Any]) -> ScenarioSymbols:
+    """scenes.json에서 씬 id / goto 대상, 화자·조건·set에 나오는 캐릭터, 조건·set에 나오는 플래그를 모은다"""
+    from parent import (FLAG_RECRUIT_INOSUKE, FLAG_RECRUIT_ZENITSU, FLAG_ORDER_FIRST_INOSUKE,
+                        FLAG_ORDER_INOSUKE_THEN_ZENITSU, FLAG_HIDDEN_ELIGIBLE)
+    scene_ids: List[str] = list(scenes)
+    chars: List[str] = []
+    flags: List[str] = [FLAG_RECRUIT_INOSUKE, FLAG_RECRUIT_ZENITSU, FLAG_ORDER_FIRST_INOSUKE,
+                        FLAG_ORDER_INOSUKE_THEN_ZENITSU, FLAG_HIDDEN_ELIGIBLE]
+
+    def _flag_names(v: Any) -> List[str]:
+        if isinstance(v, dict):
+            return list(v.get("$add", []) or []) + list(v.get("$remove", []) or [])
+        return list(v or [])
+
+    for scene in scenes.values():
+        chars += scene.get("allowed_speakers", []) or []
+        for rule in (scene.get("speaker_rules", []) or []) + (scene.get("split_rules", []) or []):
+            chars += rule.get("override", []) or []
+            chars += list((rule.get("limits") or {}).get("char_turns_max") or {})
+            chars += list(rule.get("affinity_min") or {}) + list(rule.get("affinity_max") or {})
+            flags += list(rule.get("require_flags", []) or []) + list(rule.get("forbid_flags", []) or [])
+            if rule.get("goto"):
+                scene_ids.append(rule["goto"])
+            st = rule.get("set") or {}
+            for key in ("affinity", "allies", "character_turns_used"):
+                chars += list(st.get(key) or {})
+            flags += _flag_names(st.get("flags"))
+    return ScenarioSymbols(dict.fromkeys(scene_ids), dict.fromkeys(chars), dict.fromkeys(flags))
+
+
+# ============================================
+# dict 호환 뷰
+# ============================================
+def _bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class CounterView(Mapping):
+    """캐릭터 id로 색인한 array + 존재 마스크 → {캐릭터: int}"""
+    __slots__ = ("_sym", "_arr", "_mask")
+
+    def __init__(self, sym: Interner, arr: Optional[array], mask: int):
+        self._sym, self._arr, self._mask = sym, arr, mask
+
+    def __getitem__(self, key: str) -> int:
+        i = self._sym.get(key)
+        if i is None or not self._mask >> i & 1:
+            raise KeyError(key)
+        return self._arr[i]  # type: ignore[index]
+
+    def __iter__(self) -> Iterator[str]:
+        names = self._sym.names
+        return (names[i] for i in _bits(self._mask))
+
+    def __len__(self) -> int:
+        return bin(self._mask).count("1")
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class AlliesView(Mapping):
+    __slots__ = ("_sym", "_present", "_value")
+
+    def __init__(self, sym: Interner, present: int, value: int):
+        self._sym, self._present, self._value = sym, present, value
+
+    def __getitem__(self, key: str) -> bool:
+        i = self._sym.get(key)
+        if i is None or not self._present >> i & 1:
+            raise KeyError(key)
+        return bool(self._value >> i & 1)
+
+    def __iter__(self) -> Iterator[str]:
+        names = self._sym.names
+        return (names[i] for i in _bits(self._present))
+
+    def __len__(self) -> int:
+        return bin(self._present).count("1")
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class NamesView(Sequence):
+    """id 나열 → 이름 시퀀스 (flags는 apply_patch와 같이 정렬, scene_history는 순서 유지)"""
+    __slots__ = ("_names", "_ids")
+
+    def __init__(self, names: List[str], ids: Sequence[int]):
+        self._names, self._ids = names, ids
+
+    def __getitem__(self, i):  # type: ignore[override]
+        if isinstance(i, slice):
+            return [self._names[j] for j in self._ids[i]]
+        return self._names[self._ids[i]]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, tuple, Sequence)) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+# ============================================
+# 압축 세션
+# ============================================
+_MISSING = object()
+
+# 턴마다 다시 채워지는 필드의 기본값 (server.new_graph_state와 같은 값). 기본값이면 저장하지 않는다.
+_IDLE_DEFAULTS: Dict[str, Any] = {
+    "game_mode": "story", "sub_turn_count": 0, "turn_limit": 100, "is_voting_active": False,
+    "vote_options": [], "user_votes": {}, "scene_image_url": "", "next_node": "", "classification": "",
+    "severity": "", "render": {}, "router_choice_hint": {}, "agent_outputs": [],
+}
+# 슬롯에 그대로 두는 값 필드 (GraphState 키 == 슬롯 이름, 원래 없던 키는 _MISSING)
+_PLAIN = ("session_id", "user_id", "scenario_id", "route", "ending", "end_reason", "user_choice",
+          "updated_at", "config_version", "dialogue_rules", "user_history", "history_refs")
+_ENCODED = ("current_node", "master_turn_count", "total_turns_used", "character_turns_used", "affinity",
+            "allies", "flags", "scene_history")
+
+
+def _pack_counters(sym: Interner, d: Optional[Mapping[str, Any]]) -> Tuple[Optional[array], int]:
+    if not d:
+        return None, 0
+    ids = [(sym.id(k), int(v)) for k, v in d.items()]
+    arr = array("i", bytes(4 * (max(i for i, _ in ids) + 1)))
+    mask = 0
+    for i, v in ids:
+        arr[i] = v
+        mask |= 1 << i
+    return arr, mask
+
+
+class CompactSession(Mapping):
+    __slots__ = ("_sym", "_keys", "_scene", "_turn", "_total", "_ct", "_ct_mask", "_aff", "_aff_mask",
+                 "_allies_present", "_allies_value", "_flags", "_history", "_extra") + _PLAIN
+
+    # ---- 압축 ----
+    @classmethod
+    def pack(cls, state: Mapping[str, Any], symbols: ScenarioSymbols) -> "CompactSession":
+        self = cls.__new__(cls)
+        self._sym = symbols
+        self._keys = sum(1 << j for j, k in enumerate(_ENCODED) if k in state)   # 원래 있던 _ENCODED 키
+        for key in _PLAIN:
+            setattr(self, key, state.get(key, _MISSING))
+        node = state.get("current_node")
+        self._scene = -1 if not node else symbols.scenes.id(node)
+        self._turn = int(state.get("master_turn_count", 0) or 0)
+        self._total = int(state.get("total_turns_used", 0) or 0)
+        self._ct, self._ct_mask = _pack_counters(symbols.chars, state.get("character_turns_used"))
+        self._aff, self._aff_mask = _pack_counters(symbols.chars, state.get("affinity"))
+        present = value = 0
+        for k, v in (state.get("allies") or {}).items():
+            bit = 1 << symbols.chars.id(k)
+            present |= bit
+            if v:
+                value |= bit
+        self._allies_present, self._allies_value = present, value
+        flags = 0
+        for f in state.get("flags") or ():
+            flags |= 1 << symbols.flags.id(f)
+        self._flags = flags
+        hist = state.get("scene_history")
+        self._history = array("H", (symbols.scenes.id(s) for s in hist)) if hist else None
+        extra = {k: v for k, v in state.items()
+                 if k not in _PLAIN and k not in _ENCODED and _IDLE_DEFAULTS.get(k, _MISSING) != v}
+        self._extra = extra or None
+        return self
+
+    # ---- 읽기 ----
+    def _encoded(self, key: str) -> Any:
+        sym = self._sym
+        if key == "current_node":
+            return sym.scenes.names[self._scene] if self._scene >= 0 else None
+        if key == "master_turn_count":
+            return self._turn
+        if key == "total_turns_used":
+            return self._total
+        if key == "character_turns_used":
+            return CounterView(sym.chars, self._ct, self._ct_mask)
+        if key == "affinity":
+            return CounterView(sym.chars, self._aff, self._aff_mask)
+        if key == "allies":
+            return AlliesView(sym.chars, self._allies_present, self._allies_value)
+        if key == "flags":
+            names = sym.flags.names
+            return NamesView(names, sorted(_bits(self._flags), key=names.__getitem__))
+        return NamesView(sym.scenes.names, self._history or ())   # scene_history
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _PLAIN:
+            v = getattr(self, key)
+            if v is _MISSING:
+                raise KeyError(key)
+            return v
+        if key in _ENCODED:
+            if not self._keys >> _ENCODED.index(key) & 1:
+                raise KeyError(key)
+            return self._encoded(key)
+        extra = self._extra
+        if extra and key in extra:
+            return extra[key]
+        if key in _IDLE_DEFAULTS:
+            return _IDLE_DEFAULTS[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        extra = self._extra or {}
+        yield from (k for k in _PLAIN if getattr(self, k) is not _MISSING)
+        yield from (k for j, k in enumerate(_ENCODED) if self._keys >> j & 1)
+        yield from (k for k in _IDLE_DEFAULTS if k not in extra)
+        yield from extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"CompactSession({self.session_id!r}, scene={self['current_node']!r}, turn={self._turn})"
+
+    # ---- 펼치기 ----
+    def to_state(self) -> Dict[str, Any]:
+        """그래프 입력용 일반 dict (뷰 대신 새 dict/list, 일시 필드 기본값은 새 객체)"""
+        out: Dict[str, Any] = {}
+        for key in self:
+            v = self[key]
+            if isinstance(v, Mapping):
+                v = dict(v)
+            elif isinstance(v, (list, NamesView)):
+                v = list(v)
+            out[key] = v
+        return out
+
+
+class CompactSessions(MutableMapping):
+    """session_id → GraphState. 저장은 CompactSession, 조회는 펼친 dict."""
+
+    def __init__(self, symbols: Optional[ScenarioSymbols] = None):
+        self.symbols = symbols or ScenarioSymbols()
+        self._d: Dict[str, CompactSession] = {}
+
+    def __getitem__(self, sid: str) -> Dict[str, Any]:
+        return self._d[sid].to_state()
+
+    def __setitem__(self, sid: str, state: Mapping[str, Any]) -> None:
+        self._d[sid] = state if isinstance(state, CompactSession) else CompactSession.pack(state, self.symbols)
+
+    def __delitem__(self, sid: str) -> None:
+        del self._d[sid]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._d)
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def __contains__(self, sid: object) -> bool:
+        return sid in self._d
+
+    def session(self, sid: str) -> Optional[CompactSession]:
+        """펼치지 않은 압축 세션 (읽기 전용 Mapping 뷰)"""
+        return self._d.get(sid)
@@ -0,0 +1,262 @@
+# config_source.py
+"""
+설정 파일 핫 리로드 (scenes.json / routing_rules.json)
+
+- WatchedConfig  : 파일 하나. stat(mtime/size)이 바뀌면 읽기 → 검증 → 빌드(컴파일)까지 끝낸 뒤
+                   스냅샷 참조만 교체한다. 실패하면 이전 스냅샷을 그대로 유지.
+- ConfigRegistry : 이름 → WatchedConfig 묶음. 멤버가 바뀌면 새 ConfigGeneration(불변)을 만들어 교체
+- pinned()       : 턴 시작 시 현재 generation을 contextvar에 고정.
+                   턴 도중 리로드가 일어나도 그 턴의 노드들은 끝까지 같은 버전을 본다.
+
+리로드는 start()로 띄운 폴링 스레드(또는 명시적 refresh())에서만 일어나므로
+요청 경로에서는 참조 하나를 읽는 비용뿐이다.
+버전 문자열은 내용 해시 기반이라 워커가 달라도 같은 내용이면 같은 값이 된다.
+"""
+
+from __future__ import annotations
+import contextlib, contextvars, hashlib, json, os, threading, time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from metrics import CONFIG_RELOADS, CONFIG_GENERATION
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "config")
+ROUTING_RULES_PATH = os.path.join(CONFIG_DIR, "routing_rules.json")
+SCENES_PATH = os.path.join(CONFIG_DIR, "scenes.json")
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    name: str
+    digest: str          # 원본 JSON 내용 해시(앞 12자리)
+    loaded_at: float
+    data: Any            # 파싱된 원본
+    value: Any           # build(data) 결과 (예: ScenesRepo)
+
+
+@dataclass(frozen=True)
+class ConfigGeneration:
+    number: int                              # 프로세스 내 증가 번호 (로그/메트릭용)
+    version: str                             # 멤버 digest 조합 해시 → state["config_version"]
+    snapshots: Dict[str, ConfigSnapshot]
+
+    def __getitem__(self, name: str) -> Any:
+        return self.snapshots[name].value
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.snapshots
+
+
+def _digest(raw: bytes) -> str:
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+class WatchedConfig:
+    """
+    source가 경로면 파일 변경을 감시하고, dict면 고정 스냅샷 하나만 가진다.
+    validate(data)는 잘못된 설정이면 예외를 던지고, build(data)는 요청 경로에서 쓸 객체를 만든다.
+    """
+
+    def __init__(self, name: str, source: str | dict,
+                 build: Optional[Callable[[Any], Any]] = None,
+                 validate: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.source = source
+        self._build = build or (lambda data: data)
+        self._validate = validate
+        self._lock = threading.Lock()
+        self._stat: Optional[Tuple[float, int]] = None
+        self.last_error: Optional[str] = None
+        if isinstance(source, dict):
+            raw = json.dumps(source, sort_keys=True, ensure_ascii=False).encode("utf-8")
+            self._current = self._load(source, _digest(raw))
+        else:
+            self._stat = self._stat_source()
+            with open(source, "rb") as f:
+                raw = f.read()
+            # 최초 로드 실패는 그대로 올린다 (이전 버전이 없으므로)
+            self._current = self._load(json.loads(raw), _digest(raw))
+
+    def _stat_source(self) -> Optional[Tuple[float, int]]:
+        try:
+            st = os.stat(self.source)  # type: ignore[arg-type]
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def _load(self, data: Any, digest: str) -> ConfigSnapshot:
+        if self._validate is not None:
+            self._validate(data)
+        return ConfigSnapshot(self.name, digest, time.time(), data, self._build(data))
+
+    @property
+    def current(self) -> ConfigSnapshot:
+        return self._current
+
+    def check(self) -> bool:
+        """파일이 바뀌었으면 새 스냅샷으로 교체하고 True. 검증/빌드 실패 시 기존 유지 후 False."""
+        if isinstance(self.source, dict):
+            return False
+        st = self._stat_source()
+        if st is None or st == self._stat:
+            return False
+        with self._lock:
+            if st == self._stat:
+                return False
+            self._stat = st
+            try:
+                with open(self.source, "rb") as f:
+                    raw = f.read()
+                digest = _digest(raw)
+                if digest == self._current.digest:
+                    CONFIG_RELOADS.inc(config=self.name, outcome="unchanged")
+                    return False
+                snap = self._load(json.loads(raw), digest)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                CONFIG_RELOADS.inc(config=self.name, outcome="rejected")
+                print(f"[config] {self.name} 리로드 실패, 이전 버전 유지: {self.last_error}")
+                return False
+            self.last_error = None
+            self._current = snap  # 참조 교체 한 번 → 읽는 쪽은 락 불필요
+        CONFIG_RELOADS.inc(config=self.name, outcome="ok")
+        return True
+
+
+class ConfigRegistry:
+    def __init__(self, **configs: WatchedConfig):
+        self._configs = dict(configs)
+        self._lock = threading.Lock()
+        self._generation = self._make_generation(0)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        CONFIG_GENERATION.set(0)
+
+    def _make_generation(self, number: int) -> ConfigGeneration:
+        snaps = {name: c.current for name, c in self._configs.items()}
+        combined = "|".join(f"{name}={snaps[name].digest}" for name in sorted(snaps))
+        return ConfigGeneration(number, _digest(combined.encode("utf-8")), snaps)
+
+    def current(self) -> ConfigGeneration:
+        return self._generation
+
+    def config(self, name: str) -> WatchedConfig:
+        return self._configs[name]
+
+    def refresh(self) -> bool:
+        """모든 멤버를 확인하고, 하나라도 바뀌었으면 새 generation으로 원자적으로 교체"""
+        for c in self._configs.values():
+            c.check()
+        with self._lock:
+            gen = self._generation
+            if all(c.current is gen.snapshots[name] for name, c in self._configs.items()):
+                return False
+            self._generation = self._make_generation(gen.number + 1)
+            CONFIG_GENERATION.set(self._generation.number)
+        return True
+
+    @contextlib.contextmanager
+    def pinned(self) -> Iterator[ConfigGeneration]:
+        """이 블록(한 턴) 안에서는 active_config()가 시작 시점의 generation을 돌려준다."""
+        gen = self._generation
+        token = _active.set(gen)
+        try:
+            yield gen
+        finally:
+            _active.reset(token)
+
+    # ---- 백그라운드 폴링 ----
+    def start(self, poll_interval: float = 2.0) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def _loop():
+            while not self._stop.wait(poll_interval):
+                try:
+                    self.refresh()
+                except Exception as e:  # 폴러가 죽으면 이후 변경을 못 받으므로 삼킨다
+                    print(f"[config] refresh 오류: {e}")
+
+        self._thread = threading.Thread(target=_loop, name="config-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+_active: contextvars.ContextVar[Optional[ConfigGeneration]] = contextvars.ContextVar("active_config", default=None)
+
+
+def active_config() -> Optional[ConfigGeneration]:
+    """현재 턴에 고정된 generation (pinned() 밖이면 None)"""
+    return _active.get()
+
+
+# ============================================
+# 검증 / 빌드 함수
+# ============================================
+def validate_routing_rules(data: Any) -> None:
+    if not isinstance(data, dict) or not all(isinstance(v, dict) for v in data.values()):
+        raise ValueError("routing_rules: {game_mode: {...}} 형식이어야 합니다")
+
+
+def validate_scenes(data: Any) -> None:
+    """goto 대상 존재 여부 + 모든 조건 규칙 컴파일(limits 키 오류 등)"""
+    from rules import compile_scene
+
+    if not isinstance(data, dict):
+        raise ValueError("scenes: {scene_id: {...}} 형식이어야 합니다")
+    for scene_id, scene in data.items():
+        for rule in scene.get("split_rules", []) or []:
+            if rule.get("goto") not in data:
+                raise ValueError(f"{scene_id}: unknown goto {rule.get('goto')!r}")
+        compile_scene(scene)
+
+
+def build_scenes_repo(data: Any):
+    from parent import ScenesRepo
+
+    repo = ScenesRepo(data)
+    repo.compile_all()  # 규칙 컴파일을 요청 경로가 아니라 리로드 시점에
+    return repo
+
+
+def routing_rules_config(path: str = ROUTING_RULES_PATH) -> WatchedConfig:
+    return WatchedConfig("routing_rules", path, validate=validate_routing_rules)
+
+
+def scenes_config(source: str | dict = SCENES_PATH) -> WatchedConfig:
+    return WatchedConfig("scenes", source, build=build_scenes_repo, validate=validate_scenes)
+
+
+# ============================================
+# 프로세스 기본 레지스트리 (router.py / final_RG_test.py용)
+# ============================================
+_default_registry: Optional[ConfigRegistry] = None
+_default_lock = threading.Lock()
+
+
+def get_config_registry() -> ConfigRegistry:
+    global _default_registry
+    if _default_registry is None:
+        with _default_lock:
+            if _default_registry is None:
+                _default_registry = ConfigRegistry(routing_rules=routing_rules_config())
+    return _default_registry
+
+
+def set_config_registry(registry: Optional[ConfigRegistry]) -> None:
+    global _default_registry
+    _default_registry = registry
+
+
+def current_value(name: str) -> Any:
+    """고정된 generation에 name이 있으면 그 값, 없으면 기본 레지스트리의 현재 값"""
+    gen = _active.get()
+    if gen is not None and name in gen:
+        return gen[name]
+    return get_config_registry().current()[name]
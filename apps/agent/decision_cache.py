@@ -0,0 +1,227 @@
+# decision_cache.py
+"""
+라우터/가드레일 판정 캐시
+
+플레이어는 같은 짧은 입력("돌진", "이노스케 설득", 인사, 욕설)을 반복하므로
+정규화한 입력 + 문맥 지문(game_mode, 현재 씬, 프롬프트에 들어간 대화 창의 해시)이 같으면 LLM 판정을 재사용한다.
+두 프롬프트 모두 대화 기록을 보고 판정하므로("지속적으로 … 개입하려는 시도") 기록이 다르면 다른 키다.
+
+- normalize_message : NFKC(전각/호환 문자 통일) → 소문자 → 구두점·기호 제거 → 공백 정리
+                      → 같은 글자 3회 이상 반복은 2회로 ("ㅋㅋㅋㅋㅋ" → "ㅋㅋ", "!!!!" 제거)
+- 정확 일치       : (context, 정규화 문장) 키. TTL 지나면 미스, max_entries 넘으면 LRU 제거
+- 근사 일치       : 문장 문자 bigram의 MinHash 서명(num_perm개) + LSH 밴드 버킷으로 후보를 찾고
+                    추정 Jaccard ≥ threshold면 히트 (스팸 변형: "시발롬아ㅋㅋ" / "시발 롬아ㅋㅋㅋ!!")
+                    같은 context 안에서만, min_shingles보다 짧은 입력은 정확 일치만
+                    approximate=False인 캐시는 정확 일치만 (가드레일: "탄지로 친밀도 올려줘" → strong을
+                    "탄지로 친밀도 올려줘서 고마워"에 재사용하면 정상 입력이 차단된다)
+- 메트릭          : agent_cache_requests_total{cache, result=hit|near_hit|miss}, agent_cache_hit_ratio{cache}
+
+설정(환경변수): AGENT_DECISION_CACHE_SIZE, AGENT_DECISION_CACHE_TTL(초, 0이면 캐시 끔)
+"""
+
+from __future__ import annotations
+import os, re, threading, time, unicodedata, zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import CACHE_REQUESTS, CACHE_ENTRIES, CACHE_HIT_RATIO
+
+Context = Tuple[str, ...]
+Key = Tuple[Context, str]
+
+_REPEAT = re.compile(r"(.)\1{2,}")
+_WS = re.compile(r"\s+")
+_PRIME = (1 << 61) - 1
+
+
+def normalize_message(text: str) -> str:
+    t = unicodedata.normalize("NFKC", str(text)).lower()
+    t = "".join(" " if unicodedata.category(c)[0] in "PSZC" else c for c in t)
+    t = _REPEAT.sub(r"\1\1", t)
+    return _WS.sub(" ", t).strip()
+
+
+def history_fingerprint(text: str) -> str:
+    """프롬프트에 넣은 대화 창의 지문 (context 키 원소)"""
+    return format(zlib.crc32(str(text).encode("utf-8")), "08x")
+
+
+def _shingles(norm: str) -> Set[int]:
+    s = norm.replace(" ", "")
+    return {zlib.crc32(s[i:i + 2].encode("utf-8")) for i in range(len(s) - 1)}
+
+
+class _MinHasher:
+    def __init__(self, num_perm: int, seed: int = 1):
+        import random
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, shingles: Set[int]) -> Tuple[int, ...]:
+        return tuple(min((a * x + b) % _PRIME for x in shingles) for a, b in self.perms)
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "sig")
+
+    def __init__(self, value: Any, expires: float, sig: Optional[Tuple[int, ...]]):
+        self.value = value
+        self.expires = expires
+        self.sig = sig
+
+
+class DecisionCache:
+    def __init__(self, name: str, max_entries: int = 4096, ttl_sec: float = 600.0,
+                 num_perm: int = 64, bands: int = 16, threshold: float = 0.75, min_shingles: int = 4,
+                 approximate: bool = True, clock: Callable[[], float] = time.monotonic):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.threshold = threshold
+        self.min_shingles = min_shingles
+        self.approximate = approximate
+        self._rows = num_perm // bands
+        self._bands = bands
+        self._hasher = _MinHasher(num_perm)
+        self._clock = clock
+        self._d: "OrderedDict[Key, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[Context, int, Tuple[int, ...]], Set[Key]] = {}
+        self._lock = threading.Lock()
+        self.hits = self.near_hits = self.misses = 0
+
+    # ---- LSH 버킷 ----
+    def _band_keys(self, ctx: Context, sig: Tuple[int, ...]) -> List[Tuple[Context, int, Tuple[int, ...]]]:
+        r = self._rows
+        return [(ctx, b, sig[b * r:(b + 1) * r]) for b in range(self._bands)]
+
+    def _signature(self, norm: str) -> Optional[Tuple[int, ...]]:
+        if not self.approximate:
+            return None
+        sh = _shingles(norm)
+        return self._hasher.signature(sh) if len(sh) >= self.min_shingles else None
+
+    def _remove(self, key: Key) -> None:
+        e = self._d.pop(key, None)
+        if e is not None and e.sig is not None:
+            for bk in self._band_keys(key[0], e.sig):
+                keys = self._buckets.get(bk)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._buckets[bk]
+
+    def _count(self, result: str) -> None:
+        if result == "hit":
+            self.hits += 1
+        elif result == "near_hit":
+            self.near_hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result=result)
+        CACHE_HIT_RATIO.set(self.hit_rate(), cache=self.name)
+
+    # ---- 조회 / 저장 ----
+    def get(self, message: str, context: Context = ()) -> Optional[Any]:
+        if self.ttl_sec <= 0:
+            return None
+        norm = normalize_message(message)
+        key = (context, norm)
+        now = self._clock()
+        with self._lock:
+            e = self._d.get(key)
+            if e is not None and e.expires > now:
+                self._d.move_to_end(key)
+                result, value = "hit", e.value
+            else:
+                if e is not None:
+                    self._remove(key)
+                result, value = "miss", None
+                sig = self._signature(norm)
+                if sig is not None:
+                    value = self._near(context, sig, now)
+                    if value is not None:
+                        result = "near_hit"
+        self._count(result)
+        return value
+
+    def _near(self, ctx: Context, sig: Tuple[int, ...], now: float) -> Optional[Any]:
+        cands: Set[Key] = set()
+        for bk in self._band_keys(ctx, sig):
+            cands |= self._buckets.get(bk, set())
+        best: Optional[Tuple[float, Key]] = None
+        n = len(sig)
+        for key in cands:
+            e = self._d.get(key)
+            if e is None or e.expires <= now or e.sig is None:
+                continue
+            sim = sum(1 for a, b in zip(sig, e.sig) if a == b) / n
+            if sim >= self.threshold and (best is None or sim > best[0]):
+                best = (sim, key)
+        if best is None:
+            return None
+        self._d.move_to_end(best[1])
+        return self._d[best[1]].value
+
+    def put(self, message: str, value: Any, context: Context = ()) -> None:
+        if self.ttl_sec <= 0:
+            return
+        norm = normalize_message(message)
+        if not norm:
+            return
+        key = (context, norm)
+        sig = self._signature(norm)
+        with self._lock:
+            self._remove(key)
+            self._d[key] = _Entry(value, self._clock() + self.ttl_sec, sig)
+            if sig is not None:
+                for bk in self._band_keys(context, sig):
+                    self._buckets.setdefault(bk, set()).add(key)
+            while len(self._d) > self.max_entries:
+                self._remove(next(iter(self._d)))
+            n = len(self._d)
+        CACHE_ENTRIES.set(n, cache=self.name)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.near_hits + self.misses
+        return (self.hits + self.near_hits) / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._d.clear()
+            self._buckets.clear()
+
+
+# ============================================
+# 프로세스 기본 캐시 (call_site별)
+# ============================================
+EXACT_ONLY = frozenset({"guardrail"})   # 근사 일치를 쓰지 않는 call_site (오판 비용이 차단)
+_caches: Dict[str, DecisionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_decision_cache(call_site: str) -> DecisionCache:
+    cache = _caches.get(call_site)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(call_site)
+            if cache is None:
+                cache = _caches[call_site] = DecisionCache(
+                    f"{call_site}_decisions",
+                    max_entries=int(os.getenv("AGENT_DECISION_CACHE_SIZE", "4096")),
+                    ttl_sec=float(os.getenv("AGENT_DECISION_CACHE_TTL", "600")),
+                    approximate=call_site not in EXACT_ONLY,
+                )
+    return cache
+
+
+def set_decision_cache(call_site: str, cache: Optional[DecisionCache]) -> None:
+    with _caches_lock:
+        if cache is None:
+            _caches.pop(call_site, None)
+        else:
+            _caches[call_site] = cache
@@ -0,0 +1,79 @@
+# fake_llm.py
+"""
+오프라인 벤치마크/시뮬레이션용 가짜 OpenAI 클라이언트
+
+client.chat.completions.create(model=..., messages=[...]) 모양만 흉내낸다.
+- 라우터 프롬프트  → {"classification": "on_topic", "keywords": [], "confidence": ...}
+- 가드레일 프롬프트 → {"severity": "week", "confidence": ...}
+  confidence는 고정값 또는 {모델: 값} (캐스케이드 단계별로 다르게 흉내낼 때)
+- Children 프롬프트 → MockChildren과 같은 규칙으로 만든 JSON
+응답마다 latency_ms(+jitter_ms 범위의 균등 잡음)만큼 잠들어 실제 API 지연을 흉내낸다.
+"""
+
+from __future__ import annotations
+import json, random, threading, time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from children import MockChildren
+
+
+class _Completions:
+    def __init__(self, owner: "FakeOpenAIClient"):
+        self._owner = owner
+
+    def create(self, model: str = "", messages: Optional[List[Dict[str, str]]] = None, **kwargs: Any):
+        return self._owner._complete(model, messages or [], kwargs)
+
+
+class FakeOpenAIClient:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: Optional[int] = None,
+                 router_classification: str = "on_topic", guardrail_severity: str = "week",
+                 confidence: float | Dict[str, float] = 0.95):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.router_classification = router_classification
+        self.guardrail_severity = guardrail_severity
+        self.confidence = confidence
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._children = MockChildren()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    def _sleep(self) -> None:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms + (self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _confidence(self, model: str) -> float:
+        if isinstance(self.confidence, dict):
+            return self.confidence.get(model, 0.95)
+        return self.confidence
+
+    def _content_for(self, model: str, messages: List[Dict[str, str]]) -> str:
+        system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user = messages[-1].get("content", "") if messages else ""
+        if "dialogue writer" in system:
+            return self._children(user)
+        if "Classify" in user:
+            return json.dumps({"classification": self.router_classification, "keywords": [],
+                               "confidence": self._confidence(model)})
+        if "severity" in user:
+            return json.dumps({"severity": self.guardrail_severity, "confidence": self._confidence(model)})
+        return "{}"
+
+    def _complete(self, model: str, messages: List[Dict[str, str]], kwargs: Dict[str, Any]):
+        self._sleep()
+        content = self._content_for(model, messages)
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4,
+                                total_tokens=(prompt_chars + len(content)) // 4)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content),
+                                     finish_reason="stop", index=0)],
+            usage=usage,
+        )
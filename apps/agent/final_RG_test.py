@@ -1,20 +1,27 @@
 import json
-from typing import TypedDict, Dict, Any, List, Union
+from typing import TypedDict, Dict, Any, List, Union, Annotated, Callable
 import os
-from langgraph.graph import StateGraph, END
-from dotenv import load_dotenv
-from openai import OpenAI
+import time
+
+from llm_client import get_openai_client
+from tracing import record_llm
+from metrics import observe_llm_call, GUARDRAIL_DECISIONS
+from config_source import current_value
+from history import append_outputs
+from session_state import turn_view
+from cascade import cascade_policy, json_judge, run_cascade
+from resilience import deadline_for, guarded
+from decision_cache import get_decision_cache, history_fingerprint
 
 # --- 기본 환경 설정 ---
+# import 시점에는 파일/네트워크 I/O를 하지 않는다.
+# (.env·API 키는 llm_client, 룰 파일은 get_routing_rules(), 그래프는 build_app()에서 지연 처리)
 
-# API 키 호출
-load_dotenv()
-OpenAI.api_key = os.getenv("OPENAI_API_KEY")
-
-# Config 파일 오픈
 CONFIG_DIR = os.path.join(os.path.dirname(__file__), "config")
-with open(os.path.join(CONFIG_DIR, "routing_rules.json"), "r", encoding="utf-8") as f:
-    ROUTING_RULES = json.load(f)
+
+def get_routing_rules() -> Dict[str, Any]:
+    # config_source가 파일 변경을 감시하고, 턴 도중에는 시작 시점 버전으로 고정
+    return current_value("routing_rules")
 
 # --- Class 설정(렝그래프 시 무조건 필요함) ---
 # GraphState는 노션에 있는 거 그대로 사용
@@ -22,8 +29,10 @@ class GraphState(TypedDict):
     session_id: str              # 현재 게임 세션 ID
     current_node: str            # 현재 실행된 노드 이름 (예: "RECRUIT_INOSUKE")
     game_mode : str              # 일단 넣을게 ㅋㅋㅋㅋㅋ
-    user_history: List[str]      # 사용자의 이전 입력 기록
-    agent_outputs: List[Dict]    # 에이전트의 응답 기록 ({"speaker": "Tanjiro", "text": "..."})# 게임 진행 상태
+    user_history: List[str]      # 사용자의 최근 입력 기록 (history.HISTORY_CAPACITY개, 이전 분은 history_refs)
+    history_refs: List[str]      # 아카이브로 옮긴 이전 입력 묶음의 참조 (history.HistoryArchive)
+    # 에이전트의 응답 기록 ({"speaker": "Tanjiro", "text": "..."}) — 노드는 새 출력만 반환, reducer가 붙이고 최근 N개로 자름
+    agent_outputs: Annotated[List[Dict], append_outputs]
     master_turn_count: int       # 전체 턴 수 (마스터 턴)
     sub_turn_count: int          # 현재 캐릭터의 서브턴 수
     turn_limit: int              # 최대 턴 제한
@@ -36,27 +45,84 @@ class GraphState(TypedDict):
     # <<< 라우터와 가드레일 결과를 저장할 필드 추가 (디버깅에 용이)
     classification: str          # 라우터에서의 분류
     severity: str                # 가드레일에서의 분류 (week, strong) 
+    render: Dict                 # 이번 턴 parent 렌더 페이로드 {narration, lines, choices, image} (server가 팬아웃)
+    router_choice_hint: Dict     # 다음 parent 턴에 넘길 선택 힌트 (예: 투표 결과 {"value","confidence",...})
+    config_version: str          # 이 턴이 사용한 설정 버전 (config_source.ConfigGeneration.version)
+    # <<< ParentAgent 게임 상태 (GameState와 같은 이름, session_state.GameView로 복사 없이 읽음)
+    #     turn → master_turn_count, scene → current_node, last_user_msg → user_history[-1]
+    user_id: str
+    scenario_id: str
+    route: str
+    total_turns_used: int
+    character_turns_used: Dict[str, int]
+    allies: Dict[str, bool]
+    flags: List[str]
+    ending: str
+    end_reason: str
+    user_choice: str
+    scene_history: List[str]
+    dialogue_rules: Dict
+    updated_at: str
 
 # --- LLM 호출 ---
-def call_llm(prompt: str) -> Dict:
+# call_site별 캐스케이드 판정 (작은 모델 응답이 여기를 통과하면 큰 모델을 부르지 않음)
+_JUDGES = {
+    "router": lambda policy: json_judge("classification", ("on_topic", "off_topic"), policy.min_confidence),
+    "guardrail": lambda policy: json_judge("severity", ("week", "strong"), policy.min_confidence, "borderline"),
+}
+
+def call_llm(prompt: str, call_site: str = "call_llm") -> Dict:
+    """
+    call_site 정책(cascade.CASCADE_POLICIES)에 따라 작은 모델부터 호출. 정책이 없으면 gpt-4o 한 번.
+    각 호출은 resilience.guarded로 데드라인/헤지/브레이커 적용 (데드라인은 단계별이 아니라 이 호출 전체에 한 번).
+    """
+    policy = cascade_policy(call_site)
+    judge = _JUDGES.get(call_site, lambda p: (lambda result: None))(policy)
+    deadline = deadline_for(call_site)   # 캐스케이드 단계 전체가 나눠 쓰는 예산
+    try:
+        return run_cascade(policy, lambda model: guarded(call_site, lambda: _call_model(prompt, call_site, model),
+                                                         deadline), judge)
+    except Exception as e:
+        # API 오류·데드라인 초과·브레이커 open → 빈 결과 (노드별 기본값으로 진행)
+        print(f"API 호출 중 심각한 오류 발생: {e}")
+        return {}
+
+def _call_model(prompt: str, call_site: str, model: str) -> Dict:
+    t0 = time.perf_counter()
     try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_openai_client()
         resp = client.chat.completions.create(
-            model="gpt-4o",
+            model=model,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
         )
+        elapsed = time.perf_counter() - t0
+        record_llm(model, elapsed, getattr(resp, "usage", None))
         # 혹시 모를 오류 대비
         if not resp.choices or not resp.choices[0].message.content:
             print("API 응답이 비어있습니다.")
+            observe_llm_call(call_site, model, elapsed, "empty", getattr(resp, "usage", None))
             return {}
 
+        observe_llm_call(call_site, model, elapsed, "ok", getattr(resp, "usage", None))
         content = resp.choices[0].message.content.strip()
         return json.loads(content)
 
-    except Exception as e:
-        print(f"API 호출 중 심각한 오류 발생: {e}")
-        return {}
+    except Exception:
+        observe_llm_call(call_site, model, time.perf_counter() - t0, "error")
+        raise
+
+def cached_decision(call_site: str, field: str, allowed: tuple, message: str, context: tuple,
+                    prompt: Callable[[], str]) -> Dict:
+    """정규화한 입력 + 문맥 지문으로 판정 캐시 조회, 미스면 LLM 호출 후 유효한 판정만 저장"""
+    cache = get_decision_cache(call_site)
+    hit = cache.get(message, context)
+    if hit is not None:
+        return dict(hit)
+    llm_response = call_llm(prompt(), call_site=call_site)
+    if isinstance(llm_response, dict) and llm_response.get(field) in allowed:
+        cache.put(message, {field: llm_response[field]}, context)
+    return llm_response
 
 # --- ROUTER 에이전트 ---
 def router_agent(state: Dict[str, Any]) -> Dict[str, Any]:
@@ -64,42 +130,35 @@ def router_agent(state: Dict[str, Any]) -> Dict[str, Any]:
 
     if not state.get("user_history") or not isinstance(state["user_history"], list):
         print("Error: state에 'user_history'가 없거나 리스트 형식이 아닙니다.")
-        state["next_node"] = "wait_for_user_input" 
-        return state
-    
-    last_message = state["user_history"][-1]
+        return {"next_node": "wait_for_user_input"}
 
-    if isinstance(last_message, dict) and 'content' in last_message:
-        user_input = last_message['content']
-    else:
-        user_input = str(last_message)
-
-    user_history = "\n".join(
-        [m["content"] if isinstance(m, dict) and "content" in m else str(m) for m in state["user_history"][:-1]]
-        )
+    view = turn_view(state)
+    user_input = view.last_message
+    # 프롬프트에는 최근 대화 창만 (세션 길이와 무관하게 일정한 크기)
+    user_history = "\n".join(view.context())
     
-    router_prompt = (
-        f"Game mode: {state.get('game_mode')}\n"
-        f"Routing rules: {ROUTING_RULES.get(state.get('game_mode'), {})}\n"
+    router_prompt = lambda: (
+        f"Game mode: {view.game_mode}\n"
+        f"Routing rules: {get_routing_rules().get(view.game_mode, {})}\n"
         f"Classify the following user input as 'on_topic' or 'off_topic'.\n"
         f"based on whether it is relevant to the above conversation/game context."
         f"context: \"{user_history}\"\n"
         f"User input: \"{user_input}\"\n"
         "Answer format JSON:\n"
-        "{ \"classification\": <on_topic|off_topic>, \"keywords\": [ ... ] }\n"
+        "{ \"classification\": <on_topic|off_topic>, \"keywords\": [ ... ], \"confidence\": <0.0~1.0> }\n"
     )
 
-    llm_response = call_llm(router_prompt)
+    context = (view.game_mode or "", state.get("current_node") or "", history_fingerprint(user_history))
+    llm_response = cached_decision("router", "classification", ("on_topic", "off_topic"),
+                                   user_input, context, router_prompt)
     if not isinstance(llm_response, dict):
         print(f"Error: LLM 응답이 JSON(딕셔너리) 형식이 아닙니다. 응답: {llm_response}")
         classification = "off_topic"
     else:
         classification = llm_response.get("classification", "off_topic")
 
-    state["classification"] = classification
-    state["next_node"] = "guardrail_node"
     print(f"라우터 분류 결과: {classification}") # 디버깅용 LLM의 분류 결과 확인
-    return state
+    return {"classification": classification, "next_node": "guardrail_node"}
 
 # --- 가드레일 에이전트 ---
 def guardrail_node(state: GraphState) -> Dict[str, Any]:
@@ -107,14 +166,13 @@ def guardrail_node(state: GraphState) -> Dict[str, Any]:
     
     # state에서 classification 값 가져오기
     try:
-        user_input = state['user_history'][-1]
-        classification = state.get("classification")
-        user_history = "\n".join(
-                [m["content"] if isinstance(m, dict) and "content" in m else str(m) for m in state["user_history"][:-1]]
-            )
+        view = turn_view(state)
+        user_input = view.last_message
+        classification = view.classification
+        user_history = "\n".join(view.context())
 
         # 가드레일 프롬포트
-        guardrail_prompt = f"""
+        guardrail_prompt = lambda: f"""
         당신은 게임 대화의 맥락을 분석하는 AI입니다. 
         사용자의 마지막 입력이 게임의 현재 상황과 얼마나 벗어났는지 분석하고, 
         그 심각도를 'week' 또는 'strong' 으로 분류해 주세요.
@@ -142,10 +200,13 @@ def guardrail_node(state: GraphState) -> Dict[str, Any]:
 
         [출력 형식]
         분석 결과를 다음 JSON 형식처럼 출력하세요.
-        {{ "severity": "<week | strong>" }}
+        confidence는 판단에 대한 확신도(0.0~1.0), 기준 경계에 걸쳐 애매하면 borderline을 true로 하세요.
+        {{ "severity": "<week | strong>", "confidence": <0.0~1.0>, "borderline": <true | false> }}
         """
 
-        llm_response = call_llm(guardrail_prompt)
+        context = (view.game_mode or "", state.get("current_node") or "", history_fingerprint(user_history))
+        llm_response = cached_decision("guardrail", "severity", ("week", "strong"),
+                                       user_input, context, guardrail_prompt)
         severity = llm_response.get("severity", "week")
 
         # --- 다음 노드 분류 ---
@@ -157,6 +218,7 @@ def guardrail_node(state: GraphState) -> Dict[str, Any]:
         else:
             destination = "character_agent"
             
+        GUARDRAIL_DECISIONS.inc(severity=severity, destination=destination)
         print(f"가드레일 심각도: {severity}, 다음 노드: {destination}") #디버깅용 출력 확인
         return {
             "severity": severity,
@@ -164,6 +226,7 @@ def guardrail_node(state: GraphState) -> Dict[str, Any]:
         }
     except Exception as e:
         print(f"가드레일 노드 실행 중 오류 발생: {e}")
+        GUARDRAIL_DECISIONS.inc(severity="error", destination="parent_agent")
         return {
             "severity": "week",
             "next_node": "parent_agent" 
@@ -173,8 +236,7 @@ def guardrail_node(state: GraphState) -> Dict[str, Any]:
 def kasugai_crows_node(state: GraphState) -> Dict[str, Any]:
     print("--- Strong 위반 처리 ---")
     block_message = {"speaker": "꺾쇠 까마귀", "text": "부적절하거나 게임 진행에 맞지 않는 내용이 포함되어 있어 응답을 생성할 수 없습니다."}
-    updated_outputs = state.get("agent_outputs", []) + [block_message]
-    return {"agent_outputs": updated_outputs}
+    return {"agent_outputs": [block_message]}
 
 
 # --- 테스트용 가짜 노드들 ---
@@ -191,53 +253,71 @@ def wait_for_user_input_node(state: GraphState) -> Dict[str, Any]:
     return {}
 
 
-# --- 그래프 설정 ---
-workflow = StateGraph(GraphState)
-
-# 노드 추가 (이름을 함수와 통일하여 혼란 방지)
-workflow.add_node("router_agent", router_agent)
-workflow.add_node("guardrail_node", guardrail_node)
-workflow.add_node("kasugai_crows_node", kasugai_crows_node)
-workflow.add_node("character_agent", character_agent_node)
-workflow.add_node("parent_agent", parent_agent_node)
-workflow.add_node("wait_for_user_input", wait_for_user_input_node)
-
-# 시작점 설정
-workflow.set_entry_point("router_agent")
-
 # 라우팅 로직 함수
 def route_from_next_node(state: GraphState) -> str:
     print(f"--- 라우팅 결정: 다음 노드는 '{state['next_node']}' 입니다. ---")
     return state['next_node']
 
-# 조건부 엣지 연결
-workflow.add_conditional_edges(
-    "router_agent",
-    route_from_next_node,
-    {
-        "guardrail_node": "guardrail_node"
-    }
-)
-workflow.add_conditional_edges(
-    "guardrail_node",
-    route_from_next_node,
-    {
-        "kasugai_crows_node": "kasugai_crows_node",
-        "parent_agent": "parent_agent",
-        "character_agent": "character_agent"
-    }
-)
-
-# 일반 엣지 연결
-workflow.add_edge("kasugai_crows_node", "wait_for_user_input")
-workflow.add_edge("character_agent", END)
-workflow.add_edge("parent_agent", END)
-workflow.add_edge("wait_for_user_input", END)
-
-app = workflow.compile()
+
+# --- 그래프 설정 ---
+def build_app():
+    """라우터/가드레일 테스트용 그래프를 컴파일해서 반환 (import 시점이 아니라 호출 시점에 빌드)"""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(GraphState)
+
+    # 노드 추가 (이름을 함수와 통일하여 혼란 방지)
+    workflow.add_node("router_agent", router_agent)
+    workflow.add_node("guardrail_node", guardrail_node)
+    workflow.add_node("kasugai_crows_node", kasugai_crows_node)
+    workflow.add_node("character_agent", character_agent_node)
+    workflow.add_node("parent_agent", parent_agent_node)
+    workflow.add_node("wait_for_user_input", wait_for_user_input_node)
+
+    # 시작점 설정
+    workflow.set_entry_point("router_agent")
+
+    # 조건부 엣지 연결
+    workflow.add_conditional_edges(
+        "router_agent",
+        route_from_next_node,
+        {
+            "guardrail_node": "guardrail_node",
+            "wait_for_user_input": "wait_for_user_input"
+        }
+    )
+    workflow.add_conditional_edges(
+        "guardrail_node",
+        route_from_next_node,
+        {
+            "kasugai_crows_node": "kasugai_crows_node",
+            "parent_agent": "parent_agent",
+            "character_agent": "character_agent"
+        }
+    )
+
+    # 일반 엣지 연결
+    workflow.add_edge("kasugai_crows_node", "wait_for_user_input")
+    workflow.add_edge("character_agent", END)
+    workflow.add_edge("parent_agent", END)
+    workflow.add_edge("wait_for_user_input", END)
+
+    return workflow.compile()
+
+
+def __getattr__(name: str):
+    # 하위 호환: 예전처럼 모듈 속성으로 접근하면 그때 로드/컴파일
+    if name == "ROUTING_RULES":
+        return get_routing_rules()
+    if name == "app":
+        global app
+        app = build_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- 테스트용 ---
 if __name__ == "__main__":
+    app = build_app()
 
     print("가드레일 에이전트 최종 테스트를 시작합니다.")
     print("(종료하려면 '종료', 'exit', 'quit' 중 하나를 입력하세요)")
@@ -0,0 +1,267 @@
+# history.py
+"""
+세션 히스토리 상한 관리 + 노드 간 delta 체크포인트
+
+- user_history  : 최근 HISTORY_CAPACITY개만 GraphState에 두고, 넘친 앞부분은 HistoryArchive로 옮긴 뒤
+                  state["history_refs"]에 참조만 남긴다 (trim_history)
+- agent_outputs : LangGraph reducer(append_outputs). 노드는 이번에 만든 출력만 반환하고
+                  reducer가 뒤에 붙이면서 최근 OUTPUTS_CAPACITY개로 자른다
+- prompt_window : 라우터/가드레일/parent 프롬프트에 넣을 최근 대화 (개수·글자 수 상한)
+- DeltaCheckpointer : 턴 시작 시 직전 턴 결과 대비 바뀐 키, 그 뒤 노드별 반환 update만 기록.
+                      restore()로 임의 턴/노드 시점 상태를 재구성. 세션당 최근 keep_turns턴만 유지하고
+                      더 오래된 턴은 기준 상태(base)에 접어 넣는다. 세션은 최근 턴 순(LRU)으로 max_sessions개까지,
+                      마지막 턴에서 idle_sec가 지나면 버린다 (세션이 끝났다는 신호가 따로 오지 않으므로)
+
+세션이 길어져도 턴당 복사/직렬화 비용과 세션당 상주 메모리는 상한(capacity) 기준으로 일정하다.
+설정(환경변수): AGENT_HISTORY_CAP, AGENT_OUTPUTS_CAP, AGENT_CHECKPOINT_SESSIONS, AGENT_CHECKPOINT_IDLE_SEC
+"""
+
+from __future__ import annotations
+import contextlib, contextvars, functools, itertools, json, os, threading, time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+HISTORY_CAPACITY = int(os.getenv("AGENT_HISTORY_CAP", "32"))
+OUTPUTS_CAPACITY = int(os.getenv("AGENT_OUTPUTS_CAP", "64"))
+CHECKPOINT_SESSIONS = int(os.getenv("AGENT_CHECKPOINT_SESSIONS", "1024"))
+CHECKPOINT_IDLE_SEC = float(os.getenv("AGENT_CHECKPOINT_IDLE_SEC", "1800"))
+PROMPT_WINDOW_ITEMS = 8
+PROMPT_WINDOW_CHARS = 2000
+
+
+# ============================================
+# ring buffer reducer
+# ============================================
+def bounded_append(capacity: int) -> Callable[[Optional[List[Any]], Optional[List[Any]]], List[Any]]:
+    def _reduce(left: Optional[List[Any]], right: Optional[List[Any]]) -> List[Any]:
+        if not right:
+            return left if left is not None else []
+        merged = (left or []) + list(right)
+        return merged[-capacity:] if len(merged) > capacity else merged
+    _reduce.__name__ = f"bounded_append_{capacity}"
+    return _reduce
+
+
+append_outputs = bounded_append(OUTPUTS_CAPACITY)
+
+
+# ============================================
+# 프롬프트 창
+# ============================================
+def message_text(m: Any) -> str:
+    return m["content"] if isinstance(m, dict) and "content" in m else str(m)
+
+
+def prompt_window(history: List[Any], max_items: int = PROMPT_WINDOW_ITEMS,
+                  max_chars: int = PROMPT_WINDOW_CHARS) -> List[str]:
+    """뒤에서부터 max_items개 / max_chars자 안에 드는 메시지 (시간 순서 유지)"""
+    out: List[str] = []
+    used = 0
+    for m in reversed(history[-max_items:] if max_items else []):
+        text = message_text(m)
+        if out and used + len(text) > max_chars:
+            break
+        out.append(text if len(text) <= max_chars else text[-max_chars:])
+        used += len(text)
+    out.reverse()
+    return out
+
+
+# ============================================
+# 아카이브 (참조로 접근)
+# ============================================
+class HistoryArchive:
+    """
+    put(session_id, items) → ref, get(ref) → items
+    directory를 주면 세션별 JSONL 파일에 덧붙이고 ref는 "session_id@offset",
+    없으면 프로세스 메모리에 보관하고 ref는 "session_id#pid-seq".
+    메모리 보관분은 export()/absorb()로 다른 프로세스(샤드 워커)에 세션과 함께 옮긴다.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._mem: Dict[str, List[Any]] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)
+        return os.path.join(self.directory, f"{safe}.jsonl")  # type: ignore[arg-type]
+
+    def put(self, session_id: str, items: List[Any]) -> str:
+        if not self.directory:
+            ref = f"{session_id}#{os.getpid()}-{next(self._seq)}"
+            self._mem[ref] = list(items)
+            return ref
+        line = (json.dumps(items, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, open(self._path(session_id), "ab") as f:
+            offset = f.tell()
+            f.write(line)
+        return f"{session_id}@{offset}"
+
+    def get(self, ref: str) -> List[Any]:
+        if "#" in ref and ref in self._mem:
+            return list(self._mem[ref])
+        session_id, _, offset = ref.rpartition("@")
+        if not session_id or not self.directory:
+            raise KeyError(ref)
+        with open(self._path(session_id), "rb") as f:
+            f.seek(int(offset))
+            return json.loads(f.readline())
+
+    def export(self, refs: List[str], drop: bool = True) -> Dict[str, List[Any]]:
+        """메모리 보관분 중 refs에 해당하는 항목 (파일 보관분은 경로로 공유되므로 제외)"""
+        out = {ref: self._mem[ref] for ref in refs if ref in self._mem}
+        if drop:
+            for ref in out:
+                del self._mem[ref]
+        return out
+
+    def absorb(self, entries: Dict[str, List[Any]]) -> None:
+        self._mem.update(entries)
+
+    def load_all(self, refs: List[str]) -> List[Any]:
+        return [item for ref in refs for item in self.get(ref)]
+
+
+def trim_history(state: Dict[str, Any], archive: HistoryArchive, capacity: int = HISTORY_CAPACITY) -> Optional[str]:
+    """
+    user_history가 capacity를 넘으면 앞부분을 아카이브로 옮기고 참조를 history_refs에 추가.
+    턴마다 1건씩 옮기지 않도록 capacity의 1/4만큼 여유를 두고 묶어서 옮긴다.
+    """
+    hist = state.get("user_history") or []
+    if len(hist) <= capacity:
+        return None
+    cut = len(hist) - capacity + capacity // 4
+    ref = archive.put(str(state.get("session_id", "")), hist[:cut])
+    state["user_history"] = hist[cut:]
+    state["history_refs"] = [*(state.get("history_refs") or []), ref]
+    return ref
+
+
+# ============================================
+# delta 체크포인트
+# ============================================
+def _changed(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    # 값 객체는 참조로 공유 (노드/턴이 리스트를 새로 만들어 반환하므로 in-place 변경이 없다는 전제)
+    return {k: v for k, v in after.items() if k not in before or (before[k] is not v and before[k] != v)}
+
+
+@dataclass
+class _TurnLog:
+    input_delta: Dict[str, Any]
+    steps: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)
+
+
+@dataclass
+class _SessionLog:
+    base: Dict[str, Any]                       # turns[0] 직전 상태
+    turns: Deque[_TurnLog] = field(default_factory=deque)
+    last: Dict[str, Any] = field(default_factory=dict)   # 마지막 턴 종료 시점 (얕은 복사)
+    folded: int = 0                            # base에 접힌 턴 수
+    touched: float = 0.0                       # 마지막 턴 시작 시각 (clock 기준)
+
+
+_current_turn: contextvars.ContextVar[Optional[_TurnLog]] = contextvars.ContextVar("checkpoint_turn", default=None)
+
+
+class DeltaCheckpointer:
+    def __init__(self, keep_turns: int = 8, reducers: Optional[Dict[str, Callable]] = None,
+                 max_sessions: int = CHECKPOINT_SESSIONS, idle_sec: float = CHECKPOINT_IDLE_SEC,
+                 clock: Callable[[], float] = time.monotonic):
+        self.keep_turns = keep_turns
+        self.reducers = reducers if reducers is not None else {"agent_outputs": append_outputs}
+        self.max_sessions = max_sessions
+        self.idle_sec = idle_sec
+        self._clock = clock
+        self._sessions: "OrderedDict[str, _SessionLog]" = OrderedDict()   # 오래 쉰 순 → 최근 턴 순
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float) -> None:
+        # _lock 안에서 호출. 앞쪽이 가장 오래 쉰 세션 (방금 턴을 시작한 세션은 맨 뒤라 남는다)
+        while len(self._sessions) > 1:
+            sid, sess = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - sess.touched < self.idle_sec:
+                break
+            del self._sessions[sid]
+
+    def _apply(self, state: Dict[str, Any], update: Dict[str, Any]) -> None:
+        for k, v in update.items():
+            red = self.reducers.get(k)
+            state[k] = red(state.get(k), v) if red else v
+
+    def _replay(self, state: Dict[str, Any], log: _TurnLog, upto: Optional[str] = None) -> None:
+        state.update(log.input_delta)  # 턴 입력은 reducer 없이 통째로
+        for node, update in log.steps:
+            self._apply(state, update)
+            if node == upto:
+                break
+
+    @contextlib.contextmanager
+    def turn(self, session_id: str, state: Dict[str, Any]) -> Iterator[None]:
+        now = self._clock()
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is None:
+                sess = self._sessions[session_id] = _SessionLog(base=dict(state))
+                log = _TurnLog(input_delta={})
+            else:
+                self._sessions.move_to_end(session_id)
+                log = _TurnLog(input_delta=_changed(sess.last, state))
+            sess.touched = now
+            self._evict(now)
+            sess.turns.append(log)
+            while len(sess.turns) > self.keep_turns:
+                self._replay(sess.base, sess.turns.popleft())
+                sess.folded += 1
+        token = _current_turn.set(log)
+        try:
+            yield
+        finally:
+            _current_turn.reset(token)
+
+    def end(self, session_id: str, final_state: Dict[str, Any]) -> None:
+        sess = self._sessions.get(session_id)
+        if sess is not None:
+            sess.last = dict(final_state)
+
+    def record(self, node: str, update: Any) -> None:
+        log = _current_turn.get()
+        if log is not None and isinstance(update, dict) and update:
+            log.steps.append((node, dict(update)))
+
+    def node(self, name: str) -> Callable[[Callable], Callable]:
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(state):
+                update = fn(state)
+                self.record(name, update)
+                return update
+            return wrapper
+        return deco
+
+    def restore(self, session_id: str, turn: int = -1, node: Optional[str] = None) -> Dict[str, Any]:
+        """turn번째(음수면 뒤에서) 보관 턴의 node 직후(없으면 턴 끝) 상태"""
+        sess = self._sessions[session_id]
+        turns = list(sess.turns)
+        idx = turn if turn >= 0 else len(turns) + turn
+        if not 0 <= idx < len(turns):
+            raise IndexError(f"turn {turn} not retained (keep_turns={self.keep_turns})")
+        state = dict(sess.base)
+        for i, log in enumerate(turns[: idx + 1]):
+            self._replay(state, log, node if i == idx else None)
+        return state
+
+    def turns(self, session_id: str) -> int:
+        sess = self._sessions.get(session_id)
+        return len(sess.turns) if sess else 0
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
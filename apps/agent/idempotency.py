@@ -0,0 +1,131 @@
+# idempotency.py
+"""
+중복 턴 제출 단일 실행 (single-flight)
+
+더블클릭/클라이언트 재시도로 같은 session_id에 같은 메시지가 두 번 들어오면
+router → guardrail → parent를 두 번 돌고(LLM 3회 × 2) turn {"$inc": 1}도 두 번 적용된다.
+(session_id, 제출 기준, 메시지 해시)를 키로 한 번만 실행한다.
+
+- 제출 기준   : 클라이언트가 보낸 request_id > 클라이언트가 본 turn > 서버 상태의 turn 순으로 쓴다
+                (서버 상태 turn만으로는 원래 실행이 끝난 뒤 올라간 turn으로 들어온 재시도를 못 잡는다.
+                 그렇다고 다음 turn의 같은 문장을 재시도로 보면 제자리로 돌아오는 씬의 반복 선택이 사라진다)
+- 진행 중     : 같은 키의 후속 제출은 먼저 온 실행의 Future에 붙어 같은 결과를 받는다
+- 완료 후     : window_sec 동안 결과를 보관해 키가 정확히 같으면 그대로 돌려준다
+- 실패        : 결과를 보관하지 않는다 (진행 중에 붙은 쪽은 같은 예외를 받고, 이후 재시도는 새로 실행)
+- 메시지 해시 : 앞뒤 공백만 제거한 원문의 sha1 (정규화는 하지 않는다. "돌진"과 "돌진!"은 다른 제출)
+- 메트릭      : agent_cache_requests_total{cache="turn_dedup", result=miss|inflight|hit}
+
+설정(환경변수): AGENT_TURN_DEDUP_WINDOW(초, 0이면 끔), AGENT_TURN_DEDUP_SIZE
+"""
+
+from __future__ import annotations
+import copy, hashlib, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from metrics import CACHE_REQUESTS, CACHE_ENTRIES
+
+Key = Tuple[str, str, str]
+
+
+def message_digest(message: str) -> str:
+    return hashlib.sha1(str(message).strip().encode("utf-8")).hexdigest()
+
+
+class _Done:
+    __slots__ = ("future", "expires")
+
+    def __init__(self, future: Future, expires: float):
+        self.future = future
+        self.expires = expires
+
+
+class TurnDeduper:
+    def __init__(self, window_sec: float = 5.0, max_entries: int = 10000,
+                 clock: Callable[[], float] = time.monotonic,
+                 copier: Callable[[Any], Any] = copy.copy):
+        self.window_sec = window_sec
+        self.max_entries = max_entries
+        self._clock = clock
+        self._copy = copier                                   # 결과를 호출 측마다 얕은 복사로 (dict 키 교체가 서로 새지 않게)
+        self._inflight: Dict[Key, Future] = {}
+        self._done: "OrderedDict[Key, _Done]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---- 키 / 조회 ----
+    @staticmethod
+    def key(session_id: str, turn: int, message: str, request_id: Optional[str] = None) -> Key:
+        basis = f"req:{request_id}" if request_id else f"turn:{int(turn or 0)}"
+        return (session_id, basis, message_digest(message))
+
+    def _purge(self, now: float) -> None:
+        # _lock 안에서 호출. 삽입 순서 = 만료 순서 (window_sec가 고정이므로)
+        while self._done:
+            k, d = next(iter(self._done.items()))
+            if d.expires > now and len(self._done) <= self.max_entries:
+                break
+            del self._done[k]
+
+    def claim(self, key: Key) -> Tuple[Future, str]:
+        """(future, result). result가 "miss"면 호출 측이 실행하고 complete/fail로 알려야 한다"""
+        now = self._clock()
+        with self._lock:
+            self._purge(now)
+            d = self._done.get(key)
+            if d is not None and d.expires > now:
+                fut, result = d.future, "hit"
+            else:
+                fut = self._inflight.get(key)
+                result = "inflight"
+                if fut is None:
+                    fut = self._inflight[key] = Future()
+                    result = "miss"
+        CACHE_REQUESTS.inc(cache="turn_dedup", result=result)
+        return fut, result
+
+    def complete(self, key: Key, value: Any) -> None:
+        now = self._clock()
+        with self._lock:
+            fut = self._inflight.pop(key)
+            self._done.pop(key, None)
+            self._done[key] = _Done(fut, now + self.window_sec)
+            self._purge(now)
+            n = len(self._done)
+        fut.set_result(self._copy(value))   # 실행한 쪽이 이후 결과 dict를 고쳐도 보관본은 그대로
+        CACHE_ENTRIES.set(n, cache="turn_dedup")
+
+    def fail(self, key: Key, exc: BaseException) -> None:
+        with self._lock:
+            fut = self._inflight.pop(key)
+        fut.set_exception(exc)
+
+    # ---- 실행 ----
+    def run(self, session_id: str, turn: int, message: str, fn: Callable[[], Any],
+            request_id: Optional[str] = None) -> Any:
+        """같은 제출이면 fn을 한 번만 실행한다. turn은 제출한 쪽이 본 turn"""
+        if self.window_sec <= 0:
+            return fn()
+        key = self.key(session_id, turn, message, request_id)
+        fut, result = self.claim(key)
+        if result != "miss":
+            return self._copy(fut.result())
+        try:
+            value = fn()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        self.complete(key, value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._done.clear()
+
+
+def from_env() -> TurnDeduper:
+    return TurnDeduper(window_sec=float(os.getenv("AGENT_TURN_DEDUP_WINDOW", "5")),
+                       max_entries=int(os.getenv("AGENT_TURN_DEDUP_SIZE", "10000")))
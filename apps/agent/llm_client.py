@@ -0,0 +1,48 @@
+# llm_client.py
+"""
+OpenAI 클라이언트 공용 접근점
+
+- import 시점에는 아무 것도 하지 않는다 (.env 로드/클라이언트 생성 모두 첫 호출 때)
+- 프로세스당 클라이언트 1개를 캐시해서 재사용 (호출마다 OpenAI()를 만들지 않음)
+- 테스트/벤치마크는 set_openai_client()로 가짜 클라이언트를 주입할 수 있음
+- AGENT_CASSETTE가 있으면 기본 클라이언트를 cassette.CassetteClient로 감싼다
+  (record: 실제 호출을 녹화, replay: 녹화본만으로 응답 → API 키/네트워크 불필요)
+"""
+
+from __future__ import annotations
+import os
+from functools import lru_cache
+from typing import Any, Optional
+
+_client_override: Optional[Any] = None
+
+
+@lru_cache(maxsize=1)
+def _default_client():
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY가 없습니다.")
+    return OpenAI(api_key=api_key)
+
+
+@lru_cache(maxsize=1)
+def _env_cassette():
+    from cassette import cassette_from_env
+    return cassette_from_env(_default_client)  # replay면 _default_client는 호출되지 않음
+
+
+def get_openai_client():
+    """주입된 클라이언트가 있으면 그것을, 없으면 (최초 1회 생성한) 기본 클라이언트를 반환."""
+    if _client_override is not None:
+        return _client_override
+    return _env_cassette() or _default_client()
+
+
+def set_openai_client(client: Optional[Any]) -> None:
+    """client.chat.completions.create(...)를 제공하는 객체 주입. None이면 기본 클라이언트로 복귀."""
+    global _client_override
+    _client_override = client
@@ -1,131 +1,340 @@
-# main.py (상세 흐름 출력 버전)
+# main.py
 
-import json
 import os
 import sys
 import traceback
-from typing import Dict, Any
-
-# --- 환경 설정 및 외부 라이브러리 임포트 ---
-from dotenv import load_dotenv
-from langgraph.graph import StateGraph, END
-from openai import OpenAI
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import cached_property
+from typing import Dict, Any, Callable, MutableMapping, Optional, Tuple, Union
 
 # --- 각 모듈에서 필요한 컴포넌트 임포트 ---
+# (langgraph / openai / dotenv는 AppFactory가 실제로 필요할 때 import)
 from final_RG_test import (
     GraphState, router_agent, guardrail_node, kasugai_crows_node,
-    route_from_next_node, character_agent_node, wait_for_user_input_node
+    route_from_next_node, character_agent_node, wait_for_user_input_node,
 )
-from parent import ParentAgent, ScenesRepo, scenes_data_flow
+from parent import ParentAgent, ScenesRepo, CharactersRepo, ImagesRepo, load_json, scenes_data_flow
 from children import MockChildren, OpenAIChildren, ChildrenBase
+from llm_client import get_openai_client, set_openai_client
+from tracing import Tracer, get_tracer
+from voting import VoteHub
+from speculation import Speculator
+from assets import AssetPrefetcher, ByteLRU, scene_resource_ids
+from config_source import ConfigRegistry, active_config, get_config_registry, scenes_config
+from history import HISTORY_CAPACITY, DeltaCheckpointer, HistoryArchive, trim_history
+from session_state import game_delta, game_view, turn_view
+from cascade import cascade_policy
+from scenarios import DEFAULT_SCENARIO_ID, SCENARIOS_DIR, ScenarioRegistry, active_scenario
+from scenarios import pinned as scenario_pinned
+from idempotency import TurnDeduper
+from actors import SessionScheduler
+import actors, idempotency
+import metrics
 
-## [출력 추가] ## 딕셔너리를 예쁘게 출력하기 위한 헬퍼 함수
-def pretty_print(title: str, data: Dict[str, Any]):
-    """JSON 형식으로 보기 좋게 출력하는 함수"""
-    print(f"\n{title}")
-    print("--------------------------------------------------")
-    print(json.dumps(data, indent=2, ensure_ascii=False))
-    print("--------------------------------------------------")
-
-# --- 환경 설정 및 컴포넌트 인스턴스 생성 ---
-load_dotenv()
+# --- 환경 설정 ---
 USE_MOCK_CHILDREN = False # True: MockChildren 사용, False: OpenAIChildren 사용
 
-client = None
-if not USE_MOCK_CHILDREN:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key: raise ValueError("OPENAI_API_KEY가 없습니다.")
-    client = OpenAI(api_key=api_key)
+# --- 어댑터 역할을 할 parent_agent_node 구현 ---
+def make_parent_agent_node(parent_agent_instance: Union[ParentAgent, Callable[[], ParentAgent]],
+                           tracer: Optional[Tracer] = None,
+                           prefetcher: Optional[AssetPrefetcher] = None) -> Callable[[GraphState], dict]:
+    # callable을 넘기면 턴마다 호출해서 (그 턴에 고정된 설정 버전의) ParentAgent를 얻는다
+    tracer = tracer or get_tracer()
+    resolve_agent = parent_agent_instance if callable(parent_agent_instance) else (lambda: parent_agent_instance)
+
+    def real_parent_agent_node(state: GraphState) -> dict:
+        # === 단계 1: GraphState 위의 뷰 (GameState/ContextEnvelope로 복사·재구성하지 않음) ===
+        game_state_input = game_view(state)
+        context_envelope_input = turn_view(state).envelope()
+        # 입력 요약 (debug 레벨에서만 기록, 히스토리 전체는 직렬화하지 않음)
+        tracer.event("parent_input", scene=game_state_input["scene"]["current_scene"],
+                     turn=game_state_input.get("turn"), user_msg=context_envelope_input["user_msg_raw"],
+                     flags=game_state_input.get("flags", []))
 
-children_agent: ChildrenBase
-if USE_MOCK_CHILDREN:
-    print("[시스템 설정] MockChildren을 사용합니다. (LLM 호출 없음)")
-    children_agent = MockChildren()
-else:
-    print(f"[시스템 설정] OpenAIChildren을 사용합니다. (모델: gpt-4o)")
-    children_agent = OpenAIChildren(client=client, model="gpt-4o")
+        # === 단계 2: ParentAgent.step() 실행 -> 내부적으로 ChildrenAgent 호출 ===
+        agent = resolve_agent()
+        parent_result = agent.step(game_state_input, context_envelope_input)
 
-scenes_repo = ScenesRepo(scenes_data_flow)
-parent_agent_instance = ParentAgent(scenes=scenes_repo, llm=children_agent)
+        new_game_state = parent_result["state"]
+        render_output = parent_result["render"]
 
-# --- 어댑터 역할을 할 parent_agent_node 구현 ---
-def real_parent_agent_node(state: GraphState) -> dict:
-    ## [출력 추가] ## 3단계: Parent Agent 노드 실행 시작 알림
-    print("\n\n\n[STEP 3] 🟢 PARENT AGENT 노드 (어댑터) 실행 🟢")
-    
-    # === 단계 1: GraphState -> GameState, ContextEnvelope 변환 ===
-    current_scene_id = state.get("current_node", "scene5_fork")
-    game_state_input = {
-        "session_id": state["session_id"], "scene": {"current_scene": current_scene_id},
-        "turn": state["master_turn_count"], "total_turns_used": state["master_turn_count"],
-        "affinity": state.get("affinity", {}), "flags": state.get("flags", []),
-        "last_user_msg": state["user_history"][-1], "scene_history": state.get("scene_history", [])
-    }
-    user_msg_raw = state["user_history"][-1]
-    context_envelope_input = {
-        "session_id": state["session_id"], "turn": state["master_turn_count"],
-        "user_msg_raw": user_msg_raw,
-        "recent_messages": [{"role": "user", "content": msg} for msg in state["user_history"]],
-        "router_choice_hint": {},
-        "guardrail": {"allowed": True, "sanitized_user_msg": user_msg_raw}
-    }
-    ## [출력 추가] ## ParentAgent에 들어갈 입력 데이터를 눈으로 확인
-    pretty_print("... [ParentAgent 입력]으로 변환된 GameState:", game_state_input)
-    pretty_print("... [ParentAgent 입력]으로 변환된 ContextEnvelope:", context_envelope_input)
-
-    # === 단계 2: ParentAgent.step() 실행 -> 내부적으로 ChildrenAgent 호출 ===
-    print("\n>>> 이제 ParentAgent.step()을 호출합니다. (내부에서 ChildrenAgent 호출됨) <<<")
-    parent_result = parent_agent_instance.step(game_state_input, context_envelope_input)
-    
-    ## [출력 추가] ## ParentAgent가 반환한 결과 데이터를 눈으로 확인
-    pretty_print("... [ParentAgent 출력] 반환된 결과:", parent_result)
-
-    new_game_state = parent_result["state"]
-    render_output = parent_result["render"]
-
-    # === 단계 3: 결과 -> GraphState 업데이트 ===
-    new_agent_outputs = state.get("agent_outputs", [])
-    if render_output.get("narration"):
-        new_agent_outputs.append({"speaker": "narration", "text": render_output["narration"]})
-    if render_output.get("lines"):
-        new_agent_outputs.extend(render_output["lines"])
-
-    updates = {
-        "agent_outputs": new_agent_outputs,
-        "master_turn_count": new_game_state.get("turn", state["master_turn_count"]),
-        "affinity": new_game_state.get("affinity", state["affinity"]),
-        "flags": new_game_state.get("flags", []),
-        "current_node": new_game_state.get("scene", {}).get("current_scene", state["current_node"])
-    }
-    
-    ## [출력 추가] ## 최종적으로 GraphState에 반영될 업데이트 내용을 눈으로 확인
-    pretty_print("... [GraphState]에 반영될 최종 업데이트:", updates)
-    print("🟢 PARENT AGENT 노드 실행 완료 🟢")
-    return updates
-
-# --- 그래프 설정 및 통합 ---
-workflow = StateGraph(GraphState)
-workflow.add_node("router_agent", router_agent)
-workflow.add_node("guardrail_node", guardrail_node)
-workflow.add_node("kasugai_crows_node", kasugai_crows_node)
-workflow.add_node("character_agent", character_agent_node)
-workflow.add_node("wait_for_user_input", wait_for_user_input_node)
-workflow.add_node("parent_agent", real_parent_agent_node) # 실제 구현으로 교체
-workflow.set_entry_point("router_agent")
-workflow.add_conditional_edges("router_agent", route_from_next_node, {"guardrail_node": "guardrail_node"})
-workflow.add_conditional_edges(
-    "guardrail_node", route_from_next_node,
-    {"kasugai_crows_node": "kasugai_crows_node", "parent_agent": "parent_agent", "character_agent": "character_agent"}
-)
-workflow.add_edge("kasugai_crows_node", "wait_for_user_input")
-workflow.add_edge("character_agent", "wait_for_user_input")
-workflow.add_edge("parent_agent", "wait_for_user_input")
-workflow.add_edge("wait_for_user_input", END)
-app = workflow.compile()
+        # === 단계 3: 결과 -> GraphState 업데이트 ===
+        # 이번 턴 출력만 반환 (GraphState.agent_outputs reducer가 기존 기록 뒤에 붙인다)
+        new_agent_outputs = []
+        if render_output.get("narration"):
+            new_agent_outputs.append({"speaker": "narration", "text": render_output["narration"]})
+        if render_output.get("lines"):
+            new_agent_outputs.extend(render_output["lines"])
+
+        # 다음 1~2홉 씬의 이미지를 백그라운드로 미리 받아 둔다
+        next_scene = new_game_state["scene"]["current_scene"]
+        scene_rids = scene_resource_ids(agent.scenes.get_scene(next_scene))
+        if prefetcher is not None:
+            prefetcher.prefetch(next_scene, agent.scenes)
+
+        # 게임 상태는 apply_patch 결과에서 바뀐 필드만 그대로 옮긴다 (병합은 ParentAgent에서 한 번)
+        updates = {
+            **game_delta(state, new_game_state),
+            "agent_outputs": new_agent_outputs,
+            # /assets/<rid>가 실제로 응답할 수 있을 때만 바꾼다 (못 찾는 에셋이면 이전 URL 유지)
+            "scene_image_url": (f"/assets/{scene_rids[0]}"
+                                if scene_rids and prefetcher is not None and prefetcher.resolvable(scene_rids[0])
+                                else state.get("scene_image_url", "")),
+            "router_choice_hint": {},  # 힌트는 한 턴만 유효
+            "render": render_output,
+        }
+        # 플레이어가 읽는 동안 다음 턴 선택지의 Children 출력을 미리 생성 (speculator가 있을 때만)
+        # new_game_state가 곧 다음 턴 GameView와 같은 내용이므로 그대로 넘긴다
+        if agent.speculator is not None:
+            agent.speculate(new_game_state)
+        tracer.event("parent_output", image=render_output.get("image"),
+                     lines=len(render_output.get("lines") or []), choices=len(render_output.get("choices") or []))
+        return updates
+
+    return real_parent_agent_node
+
+# --- 앱 팩토리 ---
+class AppFactory:
+    """
+    그래프/클라이언트/Repo/룰을 처음 사용할 때 만들고 캐시한다.
+    - import 시점에는 아무 것도 만들지 않음 (load_dotenv, OpenAI 클라이언트, 그래프 컴파일 모두 지연)
+    - 테스트: AppFactory(use_mock_children=True, openai_client=가짜_클라이언트)처럼 주입해서 사용
+    - scenes/routing_rules는 configs(ConfigRegistry)가 감시. 턴은 시작 시점 버전으로 고정되고
+      config_poll_interval(초)을 주면 백그라운드 스레드가 변경을 감지해 다음 턴부터 반영
+    - user_history는 history_capacity개까지만 state에 두고 나머지는 history_archive로 (history_dir이 있으면 JSONL)
+    - checkpoints: 노드별 반환 delta를 세션당 최근 checkpoint_turns턴만큼 기록 (restore()로 중간 상태 재구성)
+    - state["scenario_id"]가 DEFAULT_SCENARIO_ID가 아니면 그 턴은 scenarios(ScenarioRegistry)의 번들 씬으로 실행
+    """
+
+    def __init__(self,
+                 use_mock_children: bool = USE_MOCK_CHILDREN,
+                 children_model: str = "gpt-4o",
+                 scenes_source: str | dict = scenes_data_flow,
+                 profiles_source: Optional[str] = None,
+                 openai_client: Any = None,
+                 tracer: Optional[Tracer] = None,
+                 config_poll_interval: Optional[float] = None,
+                 images_source: str | dict | None = None,
+                 image_cache_bytes: int = 64 * 1024 * 1024,
+                 speculate_top_k: int = 0,
+                 history_capacity: int = HISTORY_CAPACITY,
+                 history_dir: Optional[str] = None,
+                 checkpoint_turns: int = 8,
+                 scenarios_dir: Optional[str] = None):
+        self.use_mock_children = use_mock_children
+        self.children_model = children_model
+        self.scenes_source = scenes_source
+        self.profiles_source = profiles_source
+        self._openai_client = openai_client
+        self._tracer = tracer
+        self.config_poll_interval = config_poll_interval
+        self.images_source = images_source
+        self.image_cache_bytes = image_cache_bytes
+        self.speculate_top_k = speculate_top_k
+        self.history_capacity = history_capacity
+        self.history_dir = history_dir
+        self.checkpoint_turns = checkpoint_turns
+        self.scenarios_dir = scenarios_dir
+        self._agents: "OrderedDict[int, Tuple[ScenesRepo, ParentAgent]]" = OrderedDict()
+
+    @cached_property
+    def openai_client(self):
+        if self._openai_client is not None:
+            return self._openai_client
+        return get_openai_client()
+
+    @cached_property
+    def children(self) -> ChildrenBase:
+        if self.use_mock_children:
+            print("[시스템 설정] MockChildren을 사용합니다. (LLM 호출 없음)")
+            return MockChildren()
+        # children_model은 캐스케이드의 마지막(가장 큰) 단계. 앞 단계는 cascade.CASCADE_POLICIES["children"]
+        policy = cascade_policy("children").with_final(self.children_model)
+        print(f"[시스템 설정] OpenAIChildren을 사용합니다. (모델: {' → '.join(policy.models)})")
+        return OpenAIChildren(client=self.openai_client, model=self.children_model, cascade=policy)
+
+    @cached_property
+    def configs(self) -> ConfigRegistry:
+        # routing_rules 감시자는 router.py/final_RG_test.py가 쓰는 기본 레지스트리와 공유
+        registry = ConfigRegistry(
+            scenes=scenes_config(self.scenes_source),
+            routing_rules=get_config_registry().config("routing_rules"),
+        )
+        if self.config_poll_interval:
+            registry.start(self.config_poll_interval)
+        return registry
+
+    def _generation(self):
+        gen = active_config()
+        return gen if gen is not None and "scenes" in gen else self.configs.current()
+
+    @property
+    def scenes_repo(self) -> ScenesRepo:
+        bundle = active_scenario()
+        return bundle.scenes if bundle is not None else self._generation()["scenes"]
+
+    @cached_property
+    def scenarios(self) -> ScenarioRegistry:
+        return ScenarioRegistry(self.scenarios_dir or SCENARIOS_DIR,
+                                max_loaded=int(os.getenv("AGENT_SCENARIOS_LOADED", "8")))
+
+    @cached_property
+    def characters_repo(self) -> CharactersRepo:
+        return CharactersRepo.from_profiles(self.profiles_source)  # config/characters.json → mmap 프로필 스토어
+
+    @cached_property
+    def images_repo(self) -> Optional[ImagesRepo]:
+        return ImagesRepo(load_json(self.images_source)) if self.images_source is not None else None
+
+    @cached_property
+    def prefetcher(self) -> AssetPrefetcher:
+        return AssetPrefetcher(images=self.images_repo, cache=ByteLRU(self.image_cache_bytes))
+
+    @cached_property
+    def speculator(self) -> Optional[Speculator]:
+        # 0이면 끔 (선행 생성은 LLM 호출을 더 쓰므로 명시적으로 켠다)
+        return Speculator(top_k=self.speculate_top_k) if self.speculate_top_k > 0 else None
+
+    @cached_property
+    def votes(self) -> VoteHub:
+        # 다중 시청자 세션: voting.begin_vote/apply_vote_result로 결과를 router_choice_hint에 연결
+        return VoteHub()
+
+    @cached_property
+    def history_archive(self) -> HistoryArchive:
+        return HistoryArchive(self.history_dir)
+
+    @cached_property
+    def checkpoints(self) -> DeltaCheckpointer:
+        return DeltaCheckpointer(keep_turns=self.checkpoint_turns)
+
+    @cached_property
+    def turn_dedup(self) -> TurnDeduper:
+        return idempotency.from_env()
+
+    @cached_property
+    def scheduler(self) -> SessionScheduler:
+        return actors.from_env()
+
+    @cached_property
+    def tracer(self) -> Tracer:
+        return self._tracer or get_tracer()
+
+    @property
+    def routing_rules(self) -> Dict[str, Any]:
+        return self._generation()["routing_rules"]
+
+    @property
+    def parent_agent(self) -> ParentAgent:
+        # 설정 버전/시나리오(ScenesRepo)마다 하나. 최근 몇 개만 유지
+        scenes = self.scenes_repo
+        cached = self._agents.get(id(scenes))
+        if cached is None or cached[0] is not scenes:
+            bundle = active_scenario()
+            cached = self._agents[id(scenes)] = (scenes, ParentAgent(
+                scenes=scenes, llm=self.children, characters=self.characters_repo,
+                images=bundle.images if bundle is not None and self.images_repo is None else self.images_repo,
+                speculator=self.speculator))
+            while len(self._agents) > 4:
+                self._agents.popitem(last=False)
+        else:
+            self._agents.move_to_end(id(scenes))
+        return cached[1]
+
+    @cached_property
+    def graph(self):
+        from langgraph.graph import StateGraph, END
+
+        if self._openai_client is not None:
+            # 라우터/가드레일(call_llm)도 주입된 클라이언트를 쓰도록 공용 접근점에 연결
+            set_openai_client(self._openai_client)
+
+        # --- 그래프 설정 및 통합 ---
+        # 각 노드는 span(소요 시간, LLM 지연/토큰, state diff)과 노드 지연 메트릭, delta 체크포인트를 남기도록 감싼다
+        def traced(name: str):
+            return lambda fn: self.tracer.node(name)(metrics.timed_node(name)(self.checkpoints.node(name)(fn)))
+        workflow = StateGraph(GraphState)
+        workflow.add_node("router_agent", traced("router_agent")(router_agent))
+        workflow.add_node("guardrail_node", traced("guardrail_node")(guardrail_node))
+        workflow.add_node("kasugai_crows_node", traced("kasugai_crows_node")(kasugai_crows_node))
+        workflow.add_node("character_agent", traced("character_agent")(character_agent_node))
+        workflow.add_node("wait_for_user_input", wait_for_user_input_node)
+        workflow.add_node("parent_agent", traced("parent_agent")(make_parent_agent_node(lambda: self.parent_agent, self.tracer, self.prefetcher))) # 실제 구현으로 교체
+        workflow.set_entry_point("router_agent")
+        workflow.add_conditional_edges("router_agent", route_from_next_node,
+                                        {"guardrail_node": "guardrail_node", "wait_for_user_input": "wait_for_user_input"})
+        workflow.add_conditional_edges(
+            "guardrail_node", route_from_next_node,
+            {"kasugai_crows_node": "kasugai_crows_node", "parent_agent": "parent_agent", "character_agent": "character_agent"}
+        )
+        workflow.add_edge("kasugai_crows_node", "wait_for_user_input")
+        workflow.add_edge("character_agent", "wait_for_user_input")
+        workflow.add_edge("parent_agent", "wait_for_user_input")
+        workflow.add_edge("wait_for_user_input", END)
+        return workflow.compile()
+
+    def run_turn(self, state: GraphState, user_message: str,
+                 seen_turn: Optional[int] = None, request_id: Optional[str] = None) -> GraphState:
+        """유저 입력 1건으로 그래프를 한 번 실행 (턴 단위 trace 루트)
+        같은 세션·같은 제출 기준(request_id 또는 클라이언트가 본 turn, 없으면 현재 turn)·같은 메시지의
+        중복 제출(더블클릭/재시도)은 한 번만 실행하고 결과를 나눠 받는다"""
+        turn = (state.get("master_turn_count") or 0) if seen_turn is None else seen_turn
+        return self.turn_dedup.run(state.get("session_id", ""), turn, user_message,
+                                   lambda: self._run_turn(state, user_message), request_id=request_id)
+
+    def submit_turn(self, sessions: MutableMapping[str, GraphState], session_id: str, user_message: str,
+                    seen_turn: Optional[int] = None, request_id: Optional[str] = None) -> "Future[GraphState]":
+        """scheduler의 세션 mailbox에 턴을 넣는다. 실행 시점의 sessions[session_id]로 run_turn 후 결과를 다시 저장
+        (같은 세션은 제출 순서대로 하나씩, 다른 세션은 동시에). 대기가 꽉 차면 SessionBacklogFull"""
+        def turn() -> GraphState:
+            final = self.run_turn(sessions[session_id], user_message, seen_turn, request_id)
+            sessions[session_id] = final
+            return final
+        return self.scheduler.submit(session_id, turn)
+
+    def _run_turn(self, state: GraphState, user_message: str) -> GraphState:
+        # 새 리스트로 교체 (직전 턴 체크포인트가 참조하는 리스트를 건드리지 않도록)
+        state["user_history"] = [*(state.get("user_history") or []), user_message]
+        trim_history(state, self.history_archive, self.history_capacity)
+        graph = self.graph
+        session_id = state.get("session_id", "")
+        scenario_id = state.get("scenario_id")
+        bundle = self.scenarios.get(scenario_id) if scenario_id and scenario_id != DEFAULT_SCENARIO_ID else None
+        with self.configs.pinned() as gen, scenario_pinned(bundle), metrics.turn_scope(), \
+             self.tracer.trace(session_id=session_id, turn=state.get("master_turn_count")):
+            state["config_version"] = gen.version if bundle is None else f"{gen.version}+{bundle.version}"
+            with self.checkpoints.turn(session_id, state):
+                final_state = graph.invoke(state)
+        self.checkpoints.end(session_id, final_state)
+        metrics.flush_textfile_from_env()
+        return final_state
+
+
+_default_factory: Optional[AppFactory] = None
+
+def get_app_factory() -> AppFactory:
+    """프로세스 기본 팩토리 (최초 호출 시 생성)"""
+    global _default_factory
+    if _default_factory is None:
+        _default_factory = AppFactory()
+    return _default_factory
+
+
+def __getattr__(name: str):
+    # 하위 호환: `from main import app`은 그 시점에 그래프를 빌드
+    if name == "app":
+        return get_app_factory().graph
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- 실행 (대화형 루프) ---
 if __name__ == "__main__":
-    print("\n통합 에이전트 테스트를 시작합니다. (상세 흐름 출력 모드)")
+    factory = get_app_factory()
+    factory.configs.start(float(os.getenv("AGENT_CONFIG_POLL_SEC", "2")))  # scenes/routing_rules 핫 리로드
+    metrics.start_exporters_from_env()  # AGENT_METRICS_PORT가 있으면 /metrics 제공
+
+    print("\n통합 에이전트 테스트를 시작합니다.")
+    print("(노드별 상세 흐름은 AGENT_TRACE_LEVEL=info|debug, AGENT_TRACE_FILE=경로 또는 '-'(콘솔)로 확인)")
     print("(종료하려면 '종료', 'exit', 'quit' 중 하나를 입력하세요)")
 
     current_state = GraphState(
@@ -147,19 +356,9 @@ if __name__ == "__main__":
         if user_message.lower() in ["종료", "exit", "quit"]:
             print("테스트를 종료합니다."); break
 
-        ## [출력 추가] ## 턴 시작 시점의 전체 상태 확인
-        pretty_print("=========== 턴 시작: 현재 GraphState ===========", current_state)
-        
-        current_state["user_history"].append(user_message)
-        
         try:
-            ## [출력 추가] ## LangGraph 실행 시작 알림
-            print("\n\n>>> LangGraph 실행 시작: app.invoke() 호출 <<<")
-            final_state = app.invoke(current_state)
-            
-            ## [출력 추가] ## 턴 종료 시점의 전체 상태 확인
-            pretty_print("=========== 턴 종료: 최종 GraphState ===========", final_state)
-            
+            final_state = factory.run_turn(current_state, user_message)
+
             current_state = final_state
             
             if final_state.get('agent_outputs'):
@@ -0,0 +1,358 @@
+# metrics.py
+"""
+프로세스 내 메트릭 레지스트리 (Counter / Gauge / Histogram)
+
+- Prometheus 텍스트 포맷으로 노출: render(), write_textfile(path), start_http_server(port)
+- Histogram은 누적 버킷 + sum/count. quantile()로 p50/p95/p99 근사치 계산
+- 턴 스코프(turn_scope)를 열면 그 턴 동안의 LLM 호출 수를 세서 턴 종료 시 기록
+
+설정(환경변수): AGENT_METRICS_FILE(텍스트 파일 경로), AGENT_METRICS_PORT(로컬 HTTP 포트)
+"""
+
+from __future__ import annotations
+import bisect, contextlib, contextvars, functools, math, os, threading, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAST_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _child(self, labels: Dict[str, Any]):
+        key = self._key(labels)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._children.items())
+        for key, child in items:
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        child = self._child(labels)
+        with child._lock:
+            child.value += amount
+
+    def value(self, **labels: Any) -> float:
+        return self._child(labels).value
+
+    def samples(self) -> List[Tuple[Dict[str, str], float]]:
+        """[(labels, value)] — 리포트/집계용"""
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), child.value) for key, child in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._child(labels).value = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        child = self._child(labels)
+        with child._lock:
+            child.value += amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        return self._child(labels).value
+
+
+class _HistValue:
+    __slots__ = ("counts", "sum", "count", "_lock")
+
+    def __init__(self, n: int):
+        self.counts = [0] * (n + 1)  # 마지막 칸은 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistValue(len(self.buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        child = self._child(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with child._lock:
+            child.counts[i] += 1
+            child.sum += value
+            child.count += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def quantile(self, q: float, **labels: Any) -> float:
+        """버킷 경계 사이 선형 보간으로 q(0~1) 분위수를 근사"""
+        child = self._child(labels)
+        if child.count == 0:
+            return 0.0
+        rank = q * child.count
+        cum = 0
+        lower = 0.0
+        for i, c in enumerate(child.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if c and cum + c >= rank:
+                return lower + (upper - lower) * ((rank - cum) / c)
+            cum += c
+            lower = upper
+        return self.buckets[-1]
+
+    def _render_child(self, key, child) -> List[str]:
+        lines = []
+        cum = 0
+        for i, b in enumerate(list(self.buckets) + [math.inf]):
+            cum += child.counts[i]
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', _fmt_value(b)))} {cum}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(child.sum)}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"metric {metric.name} already registered with a different shape")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, doc, labelnames))
+
+    def histogram(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, doc, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """node_exporter textfile 방식: 임시 파일에 쓰고 rename"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def start_http_server(self, port: int, addr: str = "127.0.0.1"):
+        """GET /metrics 를 제공하는 로컬 HTTP 서버(데몬 스레드). 서버 객체 반환"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), _Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+# ============================================
+# 기본 레지스트리 & 에이전트 메트릭 정의
+# ============================================
+REGISTRY = MetricsRegistry()
+
+TURN_SECONDS = REGISTRY.histogram("agent_turn_seconds", "End-to-end graph turn latency")
+STEP_SECONDS = REGISTRY.histogram("agent_parent_step_seconds", "ParentAgent.step latency", ["scene"])
+STEP_MANY_SECONDS = REGISTRY.histogram("agent_parent_step_many_seconds", "ParentAgent.step_many batch latency")
+NODE_SECONDS = REGISTRY.histogram("agent_node_seconds", "Graph node latency", ["node"])
+LLM_SECONDS = REGISTRY.histogram("agent_llm_seconds", "LLM call latency", ["call_site", "model"])
+LLM_CALLS = REGISTRY.counter("agent_llm_calls_total", "LLM calls", ["call_site", "model", "outcome"])
+LLM_TOKENS = REGISTRY.counter("agent_llm_tokens_total", "LLM tokens", ["call_site", "kind"])
+LLM_CALLS_PER_TURN = REGISTRY.histogram("agent_llm_calls_per_turn", "LLM calls per graph turn", buckets=COUNT_BUCKETS)
+CHILDREN_RETRIES = REGISTRY.counter("agent_children_retries_total", "OpenAIChildren JSON repair retries")
+ROUTER_SECONDS = REGISTRY.histogram("agent_router_seconds", "run_router_agent latency")
+ROUTER_DECISIONS = REGISTRY.counter("agent_router_decisions_total", "Router classifications", ["classification"])
+GUARDRAIL_DECISIONS = REGISTRY.counter("agent_guardrail_decisions_total", "Guardrail decisions", ["severity", "destination"])
+APPLY_PATCH_SECONDS = REGISTRY.histogram("agent_apply_patch_seconds", "apply_patch latency", buckets=FAST_BUCKETS)
+CACHE_REQUESTS = REGISTRY.counter("agent_cache_requests_total", "Cache lookups", ["cache", "result"])
+CACHE_ENTRIES = REGISTRY.gauge("agent_cache_entries", "Entries held by a cache", ["cache"])
+CACHE_HIT_RATIO = REGISTRY.gauge("agent_cache_hit_ratio", "Lifetime hit ratio of a cache (exact + near hits)", ["cache"])
+CONFIG_RELOADS = REGISTRY.counter("agent_config_reloads_total", "Config reload attempts", ["config", "outcome"])
+CONFIG_GENERATION = REGISTRY.gauge("agent_config_generation", "Active config generation number")
+VOTES = REGISTRY.counter("agent_votes_total", "Votes received", ["outcome"])
+VOTE_ROUNDS = REGISTRY.counter("agent_vote_rounds_total", "Closed vote rounds", ["reason"])
+VOTE_ROUND_SECONDS = REGISTRY.histogram("agent_vote_round_seconds", "Vote round open → close duration")
+STREAM_CONNECTIONS = REGISTRY.gauge("agent_stream_connections", "Open streaming connections", ["transport"])
+STREAM_MESSAGES = REGISTRY.counter("agent_stream_messages_total", "Fan-out messages per subscriber", ["outcome"])
+CACHE_BYTES = REGISTRY.gauge("agent_cache_bytes", "Bytes held by a size-bounded cache", ["cache"])
+PREFETCH = REGISTRY.counter("agent_prefetch_total", "Asset prefetch outcomes", ["outcome"])
+ASSET_FETCH_SECONDS = REGISTRY.histogram("agent_asset_fetch_seconds", "Asset fetch latency", ["mode"])
+SPECULATIONS = REGISTRY.counter("agent_speculations_total", "Speculative Children runs", ["outcome"])
+CASCADE_CALLS = REGISTRY.counter("agent_cascade_calls_total", "Model cascade tier attempts", ["call_site", "model", "outcome"])
+LLM_RESILIENCE = REGISTRY.counter("agent_llm_resilience_total", "LLM hedge/deadline/breaker/degraded events", ["call_site", "event"])
+BREAKER_OPEN = REGISTRY.gauge("agent_llm_breaker_open", "1 while the call site circuit breaker is open", ["call_site"])
+SHARD_WORKERS = REGISTRY.gauge("agent_shard_workers", "Live shard worker processes")
+SHARD_MIGRATIONS = REGISTRY.counter("agent_shard_migrations_total", "Sessions moved between shard workers", ["reason"])
+SESSION_QUEUED = REGISTRY.gauge("agent_session_queued_turns", "Turns waiting in session mailboxes")
+SESSION_QUEUE_SECONDS = REGISTRY.histogram("agent_session_queue_seconds", "Time a turn waits in its session mailbox")
+SESSION_REJECTIONS = REGISTRY.counter("agent_session_rejections_total", "Turns rejected because the session backlog was full")
+
+
+_turn_llm_calls: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("turn_llm_calls", default=None)
+
+
+@contextlib.contextmanager
+def turn_scope() -> Iterator[None]:
+    """그래프 한 턴: 소요 시간과 턴 내 LLM 호출 수를 기록"""
+    counter = [0]
+    token = _turn_llm_calls.set(counter)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        TURN_SECONDS.observe(time.perf_counter() - t0)
+        LLM_CALLS_PER_TURN.observe(counter[0])
+        _turn_llm_calls.reset(token)
+
+
+def observe_llm_call(call_site: str, model: Optional[str], seconds: float,
+                     outcome: str = "ok", usage: Any = None) -> None:
+    model = model or "unknown"
+    LLM_CALLS.inc(call_site=call_site, model=model, outcome=outcome)
+    LLM_SECONDS.observe(seconds, call_site=call_site, model=model)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, call_site=call_site, kind="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, call_site=call_site, kind="completion")
+    counter = _turn_llm_calls.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def timed_node(name: str) -> Callable[[Callable], Callable]:
+    """그래프 노드 데코레이터: agent_node_seconds{node=name}"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(state):
+            t0 = time.perf_counter()
+            try:
+                return fn(state)
+            finally:
+                NODE_SECONDS.observe(time.perf_counter() - t0, node=name)
+        return wrapper
+    return deco
+
+
+def start_exporters_from_env(registry: MetricsRegistry = REGISTRY):
+    """AGENT_METRICS_PORT가 있으면 HTTP 서버 시작. 서버(또는 None) 반환"""
+    port = os.getenv("AGENT_METRICS_PORT")
+    if port:
+        return registry.start_http_server(int(port))
+    return None
+
+
+def flush_textfile_from_env(registry: MetricsRegistry = REGISTRY) -> None:
+    path = os.getenv("AGENT_METRICS_FILE")
+    if path:
+        registry.write_textfile(path)
@@ -0,0 +1,113 @@
+# packstore.py
+"""
+정적 데이터용 읽기 전용 key → bytes 팩 파일 (mmap 기반)
+
+레이아웃 (little-endian)
+- header : magic(4s) | version(u16) | count(u32) | reserved(u16)
+- index  : count × (key_off u32, key_len u16, val_off u32, val_len u32), key 바이트 기준 정렬
+- keys   : 키 바이트 연속 영역
+- values : 값 바이트 연속 영역
+
+PackReader는 파일을 mmap으로 열고 인덱스를 이진 탐색한다.
+인덱스/값을 미리 디코딩하지 않으므로, 항목 수가 늘어도 상주 메모리는 거의 늘지 않는다.
+"""
+
+from __future__ import annotations
+import mmap, os, struct
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional
+
+MAGIC = b"PKST"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHIH")
+_ENTRY = struct.Struct("<IHII")
+
+
+def write_pack(path: str, records: Dict[str, bytes]) -> str:
+    """records를 팩 파일로 기록한다. 임시 파일에 쓴 뒤 rename 하므로 교체는 원자적이다."""
+    items = sorted((k.encode("utf-8"), bytes(v)) for k, v in records.items())
+    count = len(items)
+
+    keys_start = _HEADER.size + _ENTRY.size * count
+    key_off = keys_start
+    entries, key_blob = [], bytearray()
+    for k, _ in items:
+        entries.append([key_off, len(k)])
+        key_blob += k
+        key_off += len(k)
+
+    val_off = key_off
+    val_blob = bytearray()
+    for entry, (_, v) in zip(entries, items):
+        entry += [val_off, len(v)]
+        val_blob += v
+        val_off += len(v)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, count, 0))
+        for key_off, key_len, v_off, v_len in entries:
+            f.write(_ENTRY.pack(key_off, key_len, v_off, v_len))
+        f.write(key_blob)
+        f.write(val_blob)
+    os.replace(tmp, path)
+    return path
+
+
+class PackReader(Mapping):
+    """mmap 위의 읽기 전용 Mapping[str, bytes]. 조회마다 O(log n) 이진 탐색."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"not a pack file: {path}")
+        if version != VERSION:
+            self._mm.close()
+            raise ValueError(f"unsupported pack version {version}: {path}")
+        self._count = count
+
+    def _entry(self, i: int):
+        return _ENTRY.unpack_from(self._mm, _HEADER.size + _ENTRY.size * i)
+
+    def _key_at(self, i: int) -> bytes:
+        key_off, key_len, _, _ = self._entry(i)
+        return self._mm[key_off:key_off + key_len]
+
+    def _find(self, key: bytes) -> Optional[int]:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._key_at(mid)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def __getitem__(self, key: str) -> bytes:
+        i = self._find(key.encode("utf-8"))
+        if i is None:
+            raise KeyError(key)
+        _, _, val_off, val_len = self._entry(i)
+        return self._mm[val_off:val_off + val_len]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._find(key.encode("utf-8")) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield self._key_at(i).decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        self._mm.close()
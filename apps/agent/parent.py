@@ -21,11 +21,15 @@ Contract
 """
 
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import TypedDict, Dict, Any, Optional, List
-import json, datetime, os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TypedDict, Dict, Any, Optional, List, Mapping, Iterable, Sequence, Tuple
+import contextvars, json, datetime, os, time
 from pydantic import BaseModel, Field, ConfigDict
 
+from metrics import STEP_SECONDS, STEP_MANY_SECONDS, APPLY_PATCH_SECONDS
+from rules import CompiledScene, compile_scene, compiled_condition, compiled_scene
+
 # ============================================
 # 0) GameState 타입
 #    - "한 턴 직전/직후"의 게임 진행 스냅샷
@@ -62,6 +66,7 @@ class GameState(TypedDict, total=False):
     # 7) 히스토리/메타
     scene_history: List[str]
     updated_at: str
+    config_version: str               # 이 상태를 만든 설정(scenes/routing_rules) 버전
 
 
 # ============================================
@@ -85,21 +90,8 @@ class ContextEnvelope(TypedDict, total=False):
 # speaker_rules 해석기: 허용 화자 동적 계산
 # ============================================
 def _resolve_allowed_speakers(scene_def: dict, state: Dict[str, Any]) -> List[str]:
-    base = scene_def.get("allowed_speakers", []) or []
-    rules = scene_def.get("speaker_rules", []) or []
-    flags = set(state.get("flags", []))
-
-    for rule in rules:
-        req = set(rule.get("require_flags", []))
-        forbid = set(rule.get("forbid_flags", []))
-        if not req.issubset(flags):
-            continue
-        if forbid & flags:
-            continue
-        if "override" in rule:
-            # override가 있으면 그걸 최종 허용 화자로 사용
-            return list(dict.fromkeys(rule["override"]))
-    return list(dict.fromkeys(base))
+    # 조건 평가는 rules.py의 컴파일된 predicate로 (scene_def 단위 캐시)
+    return compiled_scene(scene_def).speakers(state)
 
 
 # ============================================
@@ -122,25 +114,95 @@ def load_json(source: str | dict) -> dict:
 class ScenesRepo:
     def __init__(self, data: dict):
         self._d = data
+        self._compiled: Dict[str, CompiledScene] = {}
+        self._hidden_rule: Optional[dict] = None
+        self._hidden_rule_found = False
+        self._symbols = None
 
     def get_scene(self, scene_id: str) -> dict:
         return self._d.get(scene_id, {})
 
+    def compiled(self, scene_id: str) -> CompiledScene:
+        """씬 조건 규칙을 처음 조회할 때 한 번만 컴파일"""
+        c = self._compiled.get(scene_id)
+        if c is None:
+            c = self._compiled[scene_id] = compile_scene(self.get_scene(scene_id))
+        return c
+
+    def compile_all(self) -> "ScenesRepo":
+        """모든 씬을 미리 컴파일 (설정 리로드 시 요청 경로 밖에서 호출)"""
+        for scene_id in self._d:
+            self.compiled(scene_id)
+        self.hidden_rule()
+        return self
+
+    def hidden_rule(self) -> Optional[dict]:
+        """
+        히든 엔딩 자격 조건: limits를 선언한 split_rule 중 ending이 "hidden:"인 첫 규칙.
+        시나리오에 없으면 None → apply_patch는 DEFAULT_HIDDEN_RULE을 사용.
+        """
+        if not self._hidden_rule_found:
+            self._hidden_rule_found = True
+            for scene in self._d.values():
+                for rule in scene.get("split_rules", []) or []:
+                    ending = str((rule.get("set") or {}).get("ending", ""))
+                    if rule.get("limits") and ending.startswith("hidden"):
+                        self._hidden_rule = rule
+                        break
+                if self._hidden_rule is not None:
+                    break
+        return self._hidden_rule
+
+    def symbols(self):
+        """씬/캐릭터/플래그 이름 ↔ 정수 id (compact_state.ScenarioSymbols). 처음 조회할 때 한 번 만든다"""
+        if self._symbols is None:
+            from compact_state import scenario_symbols
+            self._symbols = scenario_symbols(self._d)
+        return self._symbols
+
     def has_choice_id(self, scene_id: str, choice_id: str) -> bool:
         scene = self.get_scene(scene_id)
         return any(c.get("id") == choice_id for c in scene.get("choices", []))
 
 
 class CharactersRepo:
-    def __init__(self, data: dict):
+    """
+    캐릭터 프로필 접근. data는 일반 dict 또는 profiles.ProfileStore(mmap 지연 로딩)
+    프로필 형태: {"display_name", "persona", "speech_style": [...], "tone": {"low","medium","high"}}
+    """
+    def __init__(self, data: Mapping[str, dict]):
         self._d = data
 
+    @classmethod
+    def from_profiles(cls, source: Optional[str] = None) -> "CharactersRepo":
+        from profiles import open_profile_store, DEFAULT_PROFILES_SOURCE
+        return cls(open_profile_store(source or DEFAULT_PROFILES_SOURCE))
+
     def get(self, char_id: str) -> dict:
         return self._d.get(char_id, {})
 
     def all_ids(self) -> List[str]:
         return list(self._d.keys())
 
+    def tone_hint(self, char_id: str, affinity_val: int) -> Optional[Dict[str, Any]]:
+        prof = self.get(char_id)
+        if not prof:
+            return None
+        return {
+            "tone": (prof.get("tone") or {}).get(select_tone_level(affinity_val)),
+            "speech_style": prof.get("speech_style", []),
+            "persona": prof.get("persona", ""),
+        }
+
+    def tone_hints(self, speakers: Iterable[str], affinity: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+        # 프로필이 있는 화자만 포함 (친밀도 미기록 캐릭터는 중간값 500)
+        hints: Dict[str, Dict[str, Any]] = {}
+        for spk in speakers:
+            hint = self.tone_hint(spk, affinity.get(spk, 500))
+            if hint:
+                hints[spk] = hint
+        return hints
+
 
 class ImagesRepo:
     def __init__(self, data: dict):
@@ -203,12 +265,25 @@ def parse_user_choice_alias(user_msg: str, scene_def: dict) -> Optional[str]:
 # ============================================
 # ParentAgent
 # ============================================
+@dataclass
+class _SceneBatch:
+    """한 씬에 대해 step/step_many가 한 번만 준비하는 것들"""
+    scene_id: str
+    scene_def: dict
+    rules: CompiledScene
+    allowed_values: set
+    valid_choice_ids: set
+    hidden_rule: Optional[dict]
+    systems: Dict[Any, str] = field(default_factory=dict)   # (화자, 호감도) → 직렬화된 system 블록
+
+
 @dataclass
 class ParentAgent:
     scenes: ScenesRepo
     llm: Any  # Callable[[str], str] 형태여야 함
     characters: Optional[CharactersRepo] = None
     images: Optional[ImagesRepo] = None
+    speculator: Optional[Any] = None  # speculation.Speculator (다음 턴 Children 출력 선행 생성)
 
     # Router의 힌트를 Parent가 받아들이는 최소 확신도
     INTENT_CONF_THRESHOLD: float = 0.75
@@ -218,41 +293,28 @@ class ParentAgent:
         return (envelope.get("guardrail") or {}).get("sanitized_user_msg") \
                or envelope.get("user_msg_raw","")
 
-    def build_prompt(self, state: Dict[str, Any], envelope: ContextEnvelope) -> str:
+    def build_prompt(self, state: Mapping[str, Any], envelope: ContextEnvelope,
+                     batch: Optional["_SceneBatch"] = None) -> str:
         """
         Children LLM에게 넘길 '문제지' 생성:
         - 어떤 화자만 말할 수 있는지, 이번 씬의 비트(beats)와 선택지 스펙은 무엇인지
         - Parent가 분기를 결정하므로, Children은 분기 결정을 하지 말라는 규칙 포함
+        batch(step_many)가 있으면 같은 씬·같은 화자/호감도 조합의 system 부분 직렬화를 재사용한다.
         """
         current_scene = (state.get("scene") or {}).get("current_scene", "scene5_fork")
-        scene_def = self.scenes.get_scene(current_scene) # ✅ Repo 사용
-
-        tone_hint = None
-        if self.characters:
-            tanjiro = self.characters.get("tanjiro")
-            tone_map = tanjiro.get("tone", {}) if tanjiro else {}
-            aff = state.get("affinity", {}).get("tanjiro", 500)
-            tone_hint = tone_map.get(select_tone_level(aff))
-
-        prompt = {
-            "system": {
-                "allowed_speakers": scene_def.get("allowed_speakers", []),
-                "beats": scene_def.get("beats", {}),
-                "choice_spec": scene_def.get("choices", []),
-                "tone_hint": tone_hint,
-                "output_schema": {
-                    "narration": "str",
-                    "lines": [{"speaker":"str","text":"str"}],
-                    "choices": [{"id":"str","text":"str","value?":"str"}],
-                    "state_patch": "object (subset of GameState)",
-                    "image_resource_id?": "str"
-                },
-                "rules": [
-                    "No meta talk about internal state (turns/affinity/etc).",
-                    "Follow allowed_speakers and choice_spec.",
-                    "Do not decide a branch; the parent decides based on router hints."
-                ]
-            },
+        scene_def = batch.scene_def if batch is not None else self.scenes.get_scene(current_scene) # ✅ Repo 사용
+        affinity = state.get("affinity", {}) or {}
+
+        # speaker_rules까지 반영한 허용 화자 전원에 대해 톤 힌트 계산
+        speakers = _resolve_allowed_speakers(scene_def, state)
+        memo_key = (tuple(speakers), tuple(sorted(affinity.items())))
+        system = batch.systems.get(memo_key) if batch is not None else None
+        if system is None:
+            system = json.dumps(self._system_block(scene_def, speakers, affinity), ensure_ascii=False)
+            if batch is not None:
+                batch.systems[memo_key] = system
+
+        rest = {
             "state_view": {
                 "current_scene": current_scene,
                 "affinity": state.get("affinity", {}),
@@ -264,55 +326,170 @@ class ParentAgent:
             "rolling_summary": envelope.get("rolling_summary", ""),
             "user_msg": self._sanitize_user_msg(envelope),
         }
-        return json.dumps(prompt, ensure_ascii=False)
+        # json.dumps({"system": ..., **rest})와 같은 문자열 (system 부분만 미리 직렬화)
+        return '{"system": ' + system + ", " + json.dumps(rest, ensure_ascii=False)[1:]
 
-    def step(self, state: Dict[str, Any], envelope: ContextEnvelope) -> Dict[str, Any]:
+    def _system_block(self, scene_def: dict, speakers: List[str], affinity: Mapping[str, Any]) -> Dict[str, Any]:
+        tone_hints = {}
+        if self.characters:
+            tone_hints = self.characters.tone_hints(speakers, affinity)
+        return {
+            "allowed_speakers": speakers,
+            "beats": scene_def.get("beats", {}),
+            "choice_spec": scene_def.get("choices", []),
+            "tone_hints": tone_hints,
+            "output_schema": {
+                "narration": "str",
+                "lines": [{"speaker":"str","text":"str"}],
+                "choices": [{"id":"str","text":"str","value?":"str"}],
+                "state_patch": "object (subset of GameState)",
+                "image_resource_id?": "str"
+            },
+            "rules": [
+                "No meta talk about internal state (turns/affinity/etc).",
+                "Follow allowed_speakers and choice_spec.",
+                "Do not decide a branch; the parent decides based on router hints."
+            ]
+        }
+
+    def step(self, state: Mapping[str, Any], envelope: ContextEnvelope) -> Dict[str, Any]:
+        """
+        한 턴 처리 (state는 GameState dict 또는 session_state.GameView — 읽기만 하고 결과는 새 dict):
+        0) Router 힌트(+자연어 alias 백업)로 선택값 결정
+        1) Children 호출(speculator에 맞는 선행 결과가 있으면 재사용) → 2) 결과 스키마·화자·선택 검증
+        3) split_rules 분기 → 4) state_patch 병합 → 5) 렌더 페이로드 반환
         """
-        한 턴 처리:
-        1) Children 호출 → 2) 결과 스키마·화자·선택 검증
-        3) Router 힌트(+자연어 alias 백업)로 분기 결정 → 4) state_patch 병합 → 5) 렌더 페이로드 반환
+        scene_id = (state.get("scene") or {}).get("current_scene", "scene5_fork")
+        with STEP_SECONDS.time(scene=scene_id):
+            return self._step(state, envelope)
+
+    def _step(self, state: Mapping[str, Any], envelope: ContextEnvelope) -> Dict[str, Any]:
+        batch = self._scene_batch((state.get("scene") or {}).get("current_scene", "scene5_fork"))
+        user_msg, choice_value = self._choose(batch, envelope)
+
+        # 1) Children 호출 (선행 생성 결과가 맞으면 그대로 사용)
+        raw = self.speculator.take(state, choice_value) if self.speculator else None
+        if raw is None:
+            prompt = self.build_prompt(state, envelope)
+            raw = self.llm(prompt)  # 반드시 JSON 문자열 반환
+        return self._finish(batch, state, user_msg, choice_value, raw)
+
+    def step_many(self, states: Sequence[Mapping[str, Any]], envelopes: Sequence[ContextEnvelope],
+                  max_workers: int = 16, return_exceptions: bool = False) -> List[Any]:
         """
+        여러 세션을 한 번에 진행 (투표 마감·타이머 이벤트처럼 같은 시점에 몰리는 턴)
+        - 현재 씬별로 묶어 scene_def / 컴파일된 규칙 / 프롬프트 system 부분을 한 번만 준비
+        - Children 호출은 최대 max_workers개 동시 실행 → 걸리는 시간이 세션 수 × 지연이 아니라 ≈ 지연
+        - 검증·분기·apply_patch는 응답이 모두 모인 뒤 씬 묶음 순서로 한 번에
+        결과는 입력 순서대로 step()과 같은 dict. 세션별 예외는 return_exceptions=True면 그 자리에 예외 객체,
+        아니면 전부 끝난 뒤 첫 예외를 다시 던진다 (asyncio.gather와 같은 규칙).
+        """
+        if len(states) != len(envelopes):
+            raise ValueError("states and envelopes must have the same length")
+        t0 = time.perf_counter()
+        n = len(states)
+        results: List[Any] = [None] * n
+        preps: List[Any] = [None] * n
+        groups: Dict[str, List[int]] = {}
+        for i, st in enumerate(states):
+            groups.setdefault((st.get("scene") or {}).get("current_scene", "scene5_fork"), []).append(i)
+
+        # 1) 씬별 준비 + 선행 생성 결과 회수
+        pending: List[Any] = []
+        batches = {scene_id: self._scene_batch(scene_id) for scene_id in groups}
+        for scene_id, idxs in groups.items():
+            batch = batches[scene_id]
+            for i in idxs:
+                try:
+                    user_msg, choice_value = self._choose(batch, envelopes[i])
+                    raw = self.speculator.take(states[i], choice_value) if self.speculator else None
+                    preps[i] = [user_msg, choice_value, raw]
+                    if raw is None:
+                        pending.append((i, self.build_prompt(states[i], envelopes[i], batch)))
+                except Exception as e:
+                    results[i] = e
+
+        # 2) Children 동시 호출 (tracing/metrics contextvar가 보이도록 호출마다 컨텍스트 복사)
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending))),
+                                    thread_name_prefix="step-many") as pool:
+                futs = [(i, pool.submit(contextvars.copy_context().run, self.llm, prompt)) for i, prompt in pending]
+                for i, fut in futs:
+                    try:
+                        preps[i][2] = fut.result()
+                    except Exception as e:
+                        results[i] = e
+
+        # 3) 검증 · 분기 · 병합 (씬 묶음 단위)
+        for scene_id, idxs in groups.items():
+            batch = batches[scene_id]
+            for i in idxs:
+                if results[i] is not None:
+                    continue
+                user_msg, choice_value, raw = preps[i]
+                try:
+                    results[i] = self._finish(batch, states[i], user_msg, choice_value, raw)
+                except Exception as e:
+                    results[i] = e
+        STEP_MANY_SECONDS.observe(time.perf_counter() - t0)
+        if not return_exceptions:
+            for r in results:
+                if isinstance(r, Exception):
+                    raise r
+        return results
+
+    # ---- step / step_many 공용 단계 ----
+    def _scene_batch(self, scene_id: str) -> "_SceneBatch":
+        scene_def = self.scenes.get_scene(scene_id)
+        choices = scene_def.get("choices", []) or []
+        return _SceneBatch(
+            scene_id=scene_id, scene_def=scene_def, rules=self.scenes.compiled(scene_id),
+            allowed_values={c.get("value") for c in choices if c.get("value")},
+            valid_choice_ids={c["id"] for c in choices},
+            hidden_rule=self.scenes.hidden_rule(),
+        )
+
+    def _choose(self, batch: "_SceneBatch", envelope: ContextEnvelope) -> Tuple[str, Optional[str]]:
+        # 0) 최종 선택값 결정: Router 힌트 우선 → alias 백업
+        #    (Children 출력과 무관하므로 먼저 계산해서 선행 생성 결과 조회 키로 쓴다)
         user_msg = self._sanitize_user_msg(envelope)
+        choice_value: Optional[str] = None
+        rh = (envelope.get("router_choice_hint") or {})
+        if rh.get("value") in batch.allowed_values and float(rh.get("confidence", 0)) >= self.INTENT_CONF_THRESHOLD:
+            choice_value = rh["value"]
+        if not choice_value:
+            choice_value = parse_user_choice_alias(user_msg, batch.scene_def)
+        return user_msg, choice_value
 
-        # 1) Children 호출
-        prompt = self.build_prompt(state, envelope)
-        raw = self.llm(prompt)  # 반드시 JSON 문자열 반환
+    def _finish(self, batch: "_SceneBatch", state: Mapping[str, Any], user_msg: str,
+                choice_value: Optional[str], raw: str) -> Dict[str, Any]:
         parsed = ParentLLMResult(**json.loads(raw))
+        rules = batch.rules
+        flags = set(state.get("flags", []))
 
         # 2) 검증
-        current_scene = (state.get("scene") or {}).get("current_scene", "scene5_fork")
-        scene_def = self.scenes.get_scene(current_scene)
 
-        allowed = set(_resolve_allowed_speakers(scene_def, state))
+        allowed = set(rules.speakers(state, flags))
         if allowed:
             for ln in parsed.lines:
                 if ln.speaker not in allowed:
                     raise ValueError(f"speaker not allowed in this scene: {ln.speaker}")
 
-        valid_choice_ids = {c["id"] for c in scene_def.get("choices", [])}
-        if valid_choice_ids:
+        if batch.valid_choice_ids:
             for ch in parsed.choices:
-                if ch.id not in valid_choice_ids:
+                if ch.id not in batch.valid_choice_ids:
                     raise ValueError(f"invalid choice id: {ch.id}")
 
         if parsed.image_resource_id and self.images and not self.images.has(parsed.image_resource_id):
             raise ValueError(f"image not found: {parsed.image_resource_id}")
 
-        # 3) 최종 선택값 결정: Router 힌트 우선 → alias 백업
-        allowed_values = {c.get("value") for c in scene_def.get("choices", []) if c.get("value")}
-        choice_value: Optional[str] = None
-
-        rh = (envelope.get("router_choice_hint") or {})
-        if rh.get("value") in allowed_values and float(rh.get("confidence", 0)) >= self.INTENT_CONF_THRESHOLD:
-            choice_value = rh["value"]
-        if not choice_value:
-            choice_value = parse_user_choice_alias(user_msg, scene_def)
-
-        # 4) split_rules로 분기 계산
+        # 3) split_rules로 분기 계산
         patch_from_choice: Dict[str, Any] = {}
         if choice_value:
-            sr = eval_split_rules(scene_def, state, choice_value)
+            sr = rules.branch(state, choice_value, flags)
             if sr:
+                if self.speculator:
+                    self.speculator.record(batch.scene_id, choice_value)
                 patch_from_choice = {
                     "user_choice": choice_value,
                     "scene": {"current_scene": sr["goto"]},
@@ -320,13 +497,13 @@ class ParentAgent:
                 if sr.get("set"):
                     patch_from_choice.update(sr["set"])  # 필요시 추가 패치(set)
 
-        # 5) 상태 병합 (Children patch → choice patch 순서로 override)
+        # 4) 상태 병합 (Children patch → choice patch 순서로 override)
         base = {**state, "last_user_msg": user_msg}
         merged_patch: Dict[str, Any] = {}
         merged_patch.update(parsed.state_patch or {})
         merged_patch.update(patch_from_choice)
 
-        new_state = apply_patch(base, merged_patch)
+        new_state = apply_patch(base, merged_patch, hidden_rule=batch.hidden_rule)
 
         return {
             "render": {
@@ -338,6 +515,12 @@ class ParentAgent:
             "state": new_state,
         }
 
+    def speculate(self, next_state: Dict[str, Any], hint: Optional[Dict[str, float]] = None) -> List[Any]:
+        """next_state(다음 step의 입력 상태)에서 고를 법한 선택지의 Children 출력을 미리 생성"""
+        if self.speculator is None:
+            return []
+        return self.speculator.schedule(self, next_state, hint)
+
 
 # ============================================
 # apply_patch 및 규칙들
@@ -352,26 +535,31 @@ FLAG_ORDER_FIRST_INOSUKE = "order_first_inosuke"
 FLAG_ORDER_INOSUKE_THEN_ZENITSU = "order_inosuke_then_zenitsu"
 FLAG_HIDDEN_ELIGIBLE = "hidden_ending_eligible"
 
+# scenes.json에 limits 규칙이 없을 때 쓰는 기본 히든 조건 (rules.compile_condition 형식)
+DEFAULT_HIDDEN_RULE: Dict[str, Any] = {
+    "require_flags": [FLAG_ORDER_INOSUKE_THEN_ZENITSU],
+    "limits": {
+        "total_turns_used_max": MISSION_TURNS_LIMIT,
+        "char_turns_max": {"inosuke": CHAR_TURNS_LIMIT, "zenitsu": CHAR_TURNS_LIMIT},
+    },
+}
+
 def _iso_now() -> str:
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
 def _clamp(v: int, lo: int, hi: int) -> int:
     return max(lo, min(hi, v))
 
-def _hidden_eligible(s: Dict[str, Any], flags: set[str]) -> bool:
-    # 히든 조건: 이노스케→젠이츠 순서 + 각 3회 이하 + 총 8턴 이하
-    if FLAG_ORDER_INOSUKE_THEN_ZENITSU not in flags:
-        return False
-    ct = s.get("character_turns_used", {}) or {}
-    ino = int(ct.get("inosuke", 0))
-    zen = int(ct.get("zenitsu", 0))
-    total = int(s.get("total_turns_used", 0))
-    return (ino <= CHAR_TURNS_LIMIT) and (zen <= CHAR_TURNS_LIMIT) and (total <= MISSION_TURNS_LIMIT)
-
-def apply_patch(state: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+def _hidden_eligible(s: Dict[str, Any], flags: set[str], rule: Optional[dict] = None) -> bool:
+    # 히든 조건은 데이터(rule)로: 기본값은 이노스케→젠이츠 순서 + 각 3회 이하 + 총 8턴 이하
+    return compiled_condition(rule or DEFAULT_HIDDEN_RULE)(s, flags)
+
+def apply_patch(state: Dict[str, Any], patch: Dict[str, Any], hidden_rule: Optional[dict] = None) -> Dict[str, Any]:
     """
     룰 엔진(병합 정책): 숫자 증감 {$inc}, 얕은 병합, flags/allies 파생 규칙 동기화
+    hidden_rule: 히든 자격 조건(scenes.json의 limits 규칙). None이면 DEFAULT_HIDDEN_RULE
     """
+    t0 = time.perf_counter()
     s: Dict[str, Any] = {**state}
 
     def _inc_key(key: str, dv: int, lo: Optional[int] = None, hi: Optional[int] = None):
@@ -503,10 +691,11 @@ def apply_patch(state: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
        (FLAG_RECRUIT_INOSUKE in flags) and (FLAG_RECRUIT_ZENITSU in flags):
         flags.add(FLAG_ORDER_INOSUKE_THEN_ZENITSU)
 
-    if _hidden_eligible(s, flags):
+    if _hidden_eligible(s, flags, hidden_rule):
         flags.add(FLAG_HIDDEN_ELIGIBLE)
 
     s["flags"] = sorted(flags)
+    APPLY_PATCH_SECONDS.observe(time.perf_counter() - t0)
     return s
 
 
@@ -582,31 +771,20 @@ scenes_data_flow = {
 # 분기 규칙 평가 (간단판)
 # ============================================
 def eval_split_rules(scene_def: dict, state: dict, choice_value: str) -> Optional[dict]:
-    rules = scene_def.get("split_rules", [])
-    flags = set(state.get("flags", []))
-    for r in rules:
-        if r.get("when") != choice_value:
-            continue
-        req = set(r.get("require_flags", []))
-        forb = set(r.get("forbid_flags", []))
-        if not req.issubset(flags):
-            continue
-        if forb & flags:
-            continue
-        return {"goto": r.get("goto"), "set": r.get("set", {})}
-    return None
+    # when 값으로 인덱싱된 컴파일 규칙에서 첫 매치 (limits/affinity 조건 포함)
+    return compiled_scene(scene_def).branch(state, choice_value)
 
 
 # ============================================
 # 엔딩 판정 (finish 트리거 이후)
 # ============================================
-def evaluate_mission_end(state: Dict[str, Any]) -> Dict[str, Any]:
+def evaluate_mission_end(state: Dict[str, Any], hidden_rule: Optional[dict] = None) -> Dict[str, Any]:
     cur = (state.get("scene") or {}).get("current_scene")
     if cur != SCN_MISSION_GATHER:
         return state
 
     flags = set(state.get("flags", []))
-    if _hidden_eligible(state, flags):
+    if _hidden_eligible(state, flags, hidden_rule):
         patch = {
             "route": "hidden_branch",
             "ending": "hidden:miracle_coordination",
@@ -622,7 +800,7 @@ def evaluate_mission_end(state: Dict[str, Any]) -> Dict[str, Any]:
             "scene": {"current_scene": SCN_END_ORIGINAL},
             "scene_history": {"$push": cur},
         }
-    return apply_patch(state, patch)
+    return apply_patch(state, patch, hidden_rule=hidden_rule)
 
 
 # ============================================
@@ -0,0 +1,113 @@
+# profiles.py
+"""
+캐릭터 프로필 스토어
+
+- 원본: config/characters.json  ({char_id: {display_name, persona, speech_style, tone{low,medium,high}}})
+- 빌드: compile_profiles()가 캐릭터별 JSON을 packstore 팩 파일로 사전 컴파일
+- 조회: ProfileStore가 팩 파일을 mmap으로 열고, 요청된 캐릭터만 디코딩(작은 LRU 캐시)
+
+로스터가 커져도 워커 시작 시 읽는 것은 헤더뿐이고,
+상주 메모리는 LRU 크기(최근 사용 캐릭터 수)로 상한이 정해진다.
+"""
+
+from __future__ import annotations
+import json, os
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional
+
+from packstore import PackReader, write_pack
+from metrics import CACHE_REQUESTS, CACHE_ENTRIES
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "config")
+DEFAULT_PROFILES_SOURCE = os.path.join(CONFIG_DIR, "characters.json")
+BUILD_DIR = os.path.join(CONFIG_DIR, "build")
+
+TONE_BANDS = ("low", "medium", "high")
+
+
+def _normalize_profile(char_id: str, raw: Dict[str, Any]) -> Dict[str, Any]:
+    tone = raw.get("tone", {}) or {}
+    unknown = set(tone) - set(TONE_BANDS)
+    if unknown:
+        raise ValueError(f"{char_id}: unknown tone band(s): {sorted(unknown)}")
+    style = raw.get("speech_style", []) or []
+    if isinstance(style, str):
+        style = [style]
+    return {
+        "display_name": raw.get("display_name", char_id),
+        "persona": raw.get("persona", ""),
+        "speech_style": list(style),
+        "tone": {band: tone[band] for band in TONE_BANDS if band in tone},
+    }
+
+
+def compile_profiles(source: str = DEFAULT_PROFILES_SOURCE, dst: Optional[str] = None) -> str:
+    """characters.json → 팩 파일. 캐릭터 하나당 레코드 하나(압축 JSON)."""
+    with open(source, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    records = {
+        char_id: json.dumps(_normalize_profile(char_id, prof), ensure_ascii=False,
+                            separators=(",", ":")).encode("utf-8")
+        for char_id, prof in raw.items()
+    }
+    if dst is None:
+        dst = _default_pack_path(source)
+    return write_pack(dst, records)
+
+
+def _default_pack_path(source: str) -> str:
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(BUILD_DIR, f"{name}.pack")
+
+
+class ProfileStore(Mapping):
+    """char_id → 프로필 dict. 팩 파일에서 지연 디코딩하며 최근 cache_size개만 메모리에 유지."""
+
+    def __init__(self, path: str, cache_size: int = 32):
+        self._pack = PackReader(path)
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def __getitem__(self, char_id: str) -> Dict[str, Any]:
+        prof = self._cache.get(char_id)
+        if prof is not None:
+            self._cache.move_to_end(char_id)
+            CACHE_REQUESTS.inc(cache="profiles", result="hit")
+            return prof
+        CACHE_REQUESTS.inc(cache="profiles", result="miss")
+        prof = json.loads(bytes(self._pack[char_id]))
+        self._cache[char_id] = prof
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        CACHE_ENTRIES.set(len(self._cache), cache="profiles")
+        return prof
+
+    def __contains__(self, char_id: object) -> bool:
+        return char_id in self._pack
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._pack)
+
+    def __len__(self) -> int:
+        return len(self._pack)
+
+    def close(self) -> None:
+        self._cache.clear()
+        self._pack.close()
+
+
+def open_profile_store(source: str = DEFAULT_PROFILES_SOURCE, cache_size: int = 32) -> ProfileStore:
+    """원본보다 오래된(또는 없는) 팩 파일만 다시 컴파일한 뒤 연다."""
+    pack_path = _default_pack_path(source)
+    if not os.path.exists(pack_path) or os.path.getmtime(pack_path) < os.path.getmtime(source):
+        compile_profiles(source, pack_path)
+    return ProfileStore(pack_path, cache_size=cache_size)
+
+
+if __name__ == "__main__":
+    out = compile_profiles()
+    store = ProfileStore(out)
+    print(f"✅ compiled {len(store)} profiles → {out}")
+    for cid in store:
+        print(f"  - {cid}: {store[cid]['display_name']}")
@@ -0,0 +1,268 @@
+# resilience.py
+"""
+LLM 호출 데드라인 / 헤지(hedged request) / 서킷 브레이커
+
+guarded(call_site, fn, deadline_at=None)
+- 데드라인 : 호출 종류별 상한(deadline_sec). 넘기면 DeadlineExceeded (원래 요청은 버림)
+             캐스케이드처럼 한 번의 호출 지점 안에서 여러 번 부를 때는 deadline_for()로 한 번 잡은 시각을
+             deadline_at으로 넘겨 단계들이 남은 예산만 쓴다 (단계마다 deadline_sec를 새로 받지 않게)
+- 헤지     : 최근 성공 지연의 hedge_percentile 분위수(표본이 모자라면 hedge_after_sec)까지 답이 없으면
+             같은 요청을 한 번 더 보내고 먼저 온 답을 쓴다
+- 브레이커 : 최근 window건 중 오류(예외·데드라인) 비율이 error_rate 이상이면 open → cooldown_sec 동안
+             호출하지 않고 CircuitOpen. cooldown 뒤 half-open에서 1건 성공하면 close, 실패하면 다시 open.
+             allow()가 준 토큰으로 결과를 알린다. 상태가 바뀌기 전에 들어간 호출의 늦은 결과는 무시하고
+             (open 중 늦게 온 성공이 바로 close시키거나, 늦은 실패가 시험 호출 자리를 풀어 여러 건이 동시에 나가지 않게)
+             half-open에서는 시험 호출의 결과만 상태를 바꾼다
+
+호출 측 처리
+- call_llm(라우터/가드레일): 실패하면 기존처럼 {} (노드별 기본값으로 진행)
+- OpenAIChildren: 실패하면 MockChildren과 같은 규칙으로 씬 beats/choices에서 만든 출력으로 대체 (턴은 계속 진행)
+
+설정: CALL_POLICIES, 환경변수 AGENT_DEADLINE_<CALL_SITE>=초
+"""
+
+from __future__ import annotations
+import contextvars, os, threading, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, TypeVar
+
+from metrics import LLM_RESILIENCE, BREAKER_OPEN
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    deadline_sec: float = 20.0
+    hedge_percentile: float = 0.95
+    hedge_after_sec: float = 5.0          # 표본이 min_samples 미만일 때의 헤지 대기
+    min_samples: int = 20
+    breaker_window: int = 20
+    breaker_error_rate: float = 0.5
+    breaker_min_calls: int = 10
+    cooldown_sec: float = 30.0
+
+
+def _deadline(call_site: str, default: float) -> float:
+    return float(os.getenv(f"AGENT_DEADLINE_{call_site.upper()}", default))
+
+
+CALL_POLICIES: Dict[str, CallPolicy] = {
+    "router": CallPolicy(deadline_sec=_deadline("router", 4.0), hedge_after_sec=1.5),
+    "guardrail": CallPolicy(deadline_sec=_deadline("guardrail", 4.0), hedge_after_sec=1.5),
+    "children": CallPolicy(deadline_sec=_deadline("children", 20.0), hedge_after_sec=8.0),
+}
+
+
+# ============================================
+# 지연 분포 / 브레이커
+# ============================================
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        self._xs: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._xs.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            xs = sorted(self._xs)
+        if not xs:
+            return None
+        return xs[min(len(xs) - 1, int(len(xs) * p))]
+
+    def __len__(self) -> int:
+        return len(self._xs)
+
+
+class CircuitBreaker:
+    def __init__(self, call_site: str, policy: CallPolicy, clock: Callable[[], float] = time.monotonic):
+        self.call_site = call_site
+        self.policy = policy
+        self._clock = clock
+        self._results: Deque[bool] = deque(maxlen=policy.breaker_window)
+        self._opened_at: Optional[float] = None
+        self._epoch = 1                          # 상태가 바뀔 때마다 증가 (토큰이 이보다 오래되면 늦은 결과)
+        self._probe: Optional[int] = None        # 나가 있는 half-open 시험 호출의 토큰
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self._clock() - self._opened_at >= self.policy.cooldown_sec else "open"
+
+    def allow(self) -> Optional[int]:
+        """호출해도 되면 record()에 넘길 토큰, 아니면 None"""
+        with self._lock:
+            st = self.state
+            if st == "closed":
+                return self._epoch
+            if st == "half_open" and self._probe is None:
+                self._epoch += 1
+                self._probe = self._epoch   # 시험 호출은 한 번에 1건
+                return self._probe
+            return None
+
+    def record(self, ok: bool, token: int) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                if token != self._probe:
+                    return           # trip 전에 들어간 호출의 늦은 결과
+                self._probe = None
+                self._epoch += 1
+                if ok:
+                    self._opened_at = None
+                    self._results.clear()
+                    BREAKER_OPEN.set(0, call_site=self.call_site)
+                else:
+                    self._opened_at = self._clock()
+                return
+            if token != self._epoch:
+                return               # 지난 open 이전에 들어간 호출 (지금 창에 섞지 않는다)
+            self._results.append(ok)
+            n = len(self._results)
+            errors = n - sum(self._results)
+            if n >= self.policy.breaker_min_calls and errors / n >= self.policy.breaker_error_rate:
+                self._opened_at = self._clock()
+                self._epoch += 1
+                BREAKER_OPEN.set(1, call_site=self.call_site)
+                LLM_RESILIENCE.inc(call_site=self.call_site, event="breaker_tripped")
+
+
+# ============================================
+# 실행기
+# ============================================
+class Guard:
+    def __init__(self, policies: Optional[Dict[str, CallPolicy]] = None, max_workers: int = 32):
+        self.policies = policies if policies is not None else CALL_POLICIES
+        self._max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._latency: Dict[str, LatencyWindow] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="llm-call")
+        return self._pool
+
+    def policy(self, call_site: str) -> CallPolicy:
+        return self.policies.get(call_site) or CallPolicy()
+
+    def breaker(self, call_site: str) -> CircuitBreaker:
+        br = self._breakers.get(call_site)
+        if br is None:
+            with self._lock:
+                br = self._breakers.setdefault(call_site, CircuitBreaker(call_site, self.policy(call_site)))
+        return br
+
+    def latency(self, call_site: str) -> LatencyWindow:
+        win = self._latency.get(call_site)
+        if win is None:
+            with self._lock:
+                win = self._latency.setdefault(call_site, LatencyWindow())
+        return win
+
+    def hedge_delay(self, call_site: str) -> float:
+        pol, win = self.policy(call_site), self.latency(call_site)
+        if len(win) >= pol.min_samples:
+            return win.percentile(pol.hedge_percentile) or pol.hedge_after_sec
+        return pol.hedge_after_sec
+
+    def _submit(self, fn: Callable[[], T]) -> Future:
+        # tracing/metrics 턴 카운터(contextvar)가 작업 스레드에서도 보이도록 컨텍스트 복사
+        ctx = contextvars.copy_context()
+        return self._executor().submit(ctx.run, fn)
+
+    def deadline_for(self, call_site: str) -> float:
+        """지금부터 call_site 데드라인까지의 절대 시각 (time.monotonic 기준)"""
+        return time.monotonic() + self.policy(call_site).deadline_sec
+
+    def call(self, call_site: str, fn: Callable[[], T], deadline_at: Optional[float] = None) -> T:
+        pol = self.policy(call_site)
+        t0 = time.monotonic()
+        deadline = t0 + pol.deadline_sec if deadline_at is None else min(t0 + pol.deadline_sec, deadline_at)
+        if deadline <= t0:
+            LLM_RESILIENCE.inc(call_site=call_site, event="deadline")
+            raise DeadlineExceeded(f"{call_site} has no deadline budget left")
+        br = self.breaker(call_site)
+        token = br.allow()
+        if token is None:
+            LLM_RESILIENCE.inc(call_site=call_site, event="breaker_rejected")
+            raise CircuitOpen(f"circuit open for {call_site}")
+        primary = self._submit(fn)
+        pending = {primary}
+        hedge_at = t0 + self.hedge_delay(call_site)
+        hedged = False
+        error: Optional[BaseException] = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            until = min(deadline, hedge_at) if not hedged else deadline
+            done, pending = wait(pending, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    self.latency(call_site).add(time.monotonic() - t0)
+                    br.record(True, token)
+                    if hedged:
+                        LLM_RESILIENCE.inc(call_site=call_site, event="hedge_won" if fut is not primary else "primary_won")
+                    for other in pending:
+                        other.cancel()
+                    return fut.result()
+                error = fut.exception()
+            if not hedged and time.monotonic() >= hedge_at and time.monotonic() < deadline:
+                hedged = True
+                pending.add(self._submit(fn))
+                LLM_RESILIENCE.inc(call_site=call_site, event="hedge_sent")
+        br.record(False, token)
+        for other in pending:
+            other.cancel()
+        if error is not None and not pending:
+            LLM_RESILIENCE.inc(call_site=call_site, event="error")
+            raise error
+        LLM_RESILIENCE.inc(call_site=call_site, event="deadline")
+        raise DeadlineExceeded(f"{call_site} exceeded {deadline - t0:.1f}s")
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_default_guard: Optional[Guard] = None
+
+
+def get_guard() -> Guard:
+    global _default_guard
+    if _default_guard is None:
+        _default_guard = Guard()
+    return _default_guard
+
+
+def set_guard(guard: Optional[Guard]) -> None:
+    global _default_guard
+    _default_guard = guard
+
+
+def guarded(call_site: str, fn: Callable[[], T], deadline_at: Optional[float] = None) -> T:
+    return get_guard().call(call_site, fn, deadline_at)
+
+
+def deadline_for(call_site: str) -> float:
+    return get_guard().deadline_for(call_site)
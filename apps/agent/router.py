@@ -1,19 +1,25 @@
-import os
 import json
+import time
 from typing import Dict, Any
-from dotenv import load_dotenv
-import openai
 
-# 1) .env 로드
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from llm_client import get_openai_client
+from metrics import observe_llm_call, ROUTER_SECONDS, ROUTER_DECISIONS
+from config_source import current_value
 
-# 2) 룰 파일 로드
-CONFIG_DIR = os.path.join(os.path.dirname(__file__), "config")
-with open(os.path.join(CONFIG_DIR, "routing_rules.json"), "r", encoding="utf-8") as f:
-    ROUTING_RULES = json.load(f)
+# .env/API 키는 llm_client가 첫 호출 때, 룰 파일은 config_source가 감시하며 로드
+# (파일이 바뀌면 재시작 없이 다음 턴부터 반영)
+
+def __getattr__(name: str):
+    # 하위 호환: router.ROUTING_RULES는 현재 버전을 돌려준다
+    if name == "ROUTING_RULES":
+        return current_value("routing_rules")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def run_router_agent(state: Dict[str, Any], content: str) -> Dict[str, Any]:
+    with ROUTER_SECONDS.time():
+        return _run_router_agent(state, content)
+
+def _run_router_agent(state: Dict[str, Any], content: str) -> Dict[str, Any]:
     # 1) 기록 초기화
     state.setdefault("user_inputs", []).append(content)
     state.setdefault("agent_outputs", [])
@@ -21,13 +27,14 @@ def run_router_agent(state: Dict[str, Any], content: str) -> Dict[str, Any]:
     # 2) OpenAI 분류 프롬프트 구성
     prompt = (
         f"Game mode: {state.get('game_mode')}\n"
-        f"Routing rules: {ROUTING_RULES.get(state.get('game_mode'), {})}\n"
+        f"Routing rules: {current_value('routing_rules').get(state.get('game_mode'), {})}\n"
         f"Classify the following user input as 'on_topic' or 'off_topic'.\n"
         f"User input: \"{content}\"\n"
         "Answer format JSON:\n"
         "{ \"classification\": <on_topic|off_topic>, \"keywords\": [ ... ] }\n"
     )
-    response = openai.chat.completions.create(
+    t0 = time.perf_counter()
+    response = get_openai_client().chat.completions.create(
         model="gpt-3.5-turbo",
         messages=[
             {"role":"system","content":"You are a router agent."},
@@ -35,10 +42,13 @@ def run_router_agent(state: Dict[str, Any], content: str) -> Dict[str, Any]:
         ],
         temperature=0
     )
+    observe_llm_call("run_router_agent", "gpt-3.5-turbo", time.perf_counter() - t0,
+                     usage=getattr(response, "usage", None))
     result = json.loads(response.choices[0].message.content)
 
     # 3) 분류 결과 적용
     classification = result["classification"]
+    ROUTER_DECISIONS.inc(classification=classification)
     matched = result.get("keywords", [])
     next_node = "guardrail" if classification=="on_topic" else "guardrail"
 
@@ -0,0 +1,178 @@
+# rules.py
+"""
+scenes.json 조건 규칙 컴파일러
+
+split_rules / speaker_rules의 조건 부분을 미리 predicate 클로저로 바꿔 둔다.
+- require_flags : 모두 있어야 함
+- forbid_flags  : 하나라도 있으면 안 됨
+- limits        : {"total_turns_used_max": N, "char_turns_max": {char: N}}
+- affinity_min / affinity_max : {char: N}  (없는 캐릭터는 0으로 간주, apply_patch와 동일)
+
+predicate 시그니처는 pred(state, flags) -> bool.
+flags는 호출 측에서 한 번만 만든 set을 넘겨, 규칙마다 set(state["flags"])를 다시 만들지 않는다.
+
+CompiledScene
+- split_index: when 값 → [(pred, outcome)] (선언 순서 유지, 첫 매치 채택)
+- speaker_rules: [(pred, override)] (첫 매치 채택, 없으면 allowed_speakers)
+
+rule_table(scene_def)는 위 색인을 JSON 정규형으로 만들고(시나리오 번들에 저장),
+compile_rule_table(table)이 조건만 predicate로 바꾼다. compile_scene = 두 단계를 이어 붙인 것.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Predicate = Callable[[Dict[str, Any], "set[str]"], bool]
+
+LIMIT_KEYS = ("total_turns_used_max", "char_turns_max")
+CONDITION_KEYS = ("require_flags", "forbid_flags", "limits", "affinity_min", "affinity_max")
+
+
+def _always(state: Dict[str, Any], flags: "set[str]") -> bool:
+    return True
+
+
+# ============================================
+# 조건 → predicate
+# ============================================
+def compile_condition(rule: Dict[str, Any]) -> Predicate:
+    """규칙 dict의 조건 키들을 하나의 클로저로 합친다. 조건이 없으면 항상 참."""
+    checks: List[Predicate] = []
+
+    req = frozenset(rule.get("require_flags", []) or [])
+    if req:
+        checks.append(lambda s, f: req <= f)
+
+    forbid = frozenset(rule.get("forbid_flags", []) or [])
+    if forbid:
+        checks.append(lambda s, f: not (forbid & f))
+
+    limits = rule.get("limits") or {}
+    unknown = set(limits) - set(LIMIT_KEYS)
+    if unknown:
+        raise ValueError(f"unknown limits key(s): {sorted(unknown)}")
+    if "total_turns_used_max" in limits:
+        total_max = int(limits["total_turns_used_max"])
+        checks.append(lambda s, f: int(s.get("total_turns_used", 0)) <= total_max)
+    char_max = tuple((ch, int(n)) for ch, n in (limits.get("char_turns_max") or {}).items())
+    if char_max:
+        def _char_turns_ok(s: Dict[str, Any], f: "set[str]") -> bool:
+            ct = s.get("character_turns_used", {}) or {}
+            return all(int(ct.get(ch, 0)) <= n for ch, n in char_max)
+        checks.append(_char_turns_ok)
+
+    aff_min = tuple((ch, int(n)) for ch, n in (rule.get("affinity_min") or {}).items())
+    aff_max = tuple((ch, int(n)) for ch, n in (rule.get("affinity_max") or {}).items())
+    if aff_min or aff_max:
+        def _affinity_ok(s: Dict[str, Any], f: "set[str]") -> bool:
+            aff = s.get("affinity", {}) or {}
+            return all(int(aff.get(ch, 0)) >= n for ch, n in aff_min) and \
+                   all(int(aff.get(ch, 0)) <= n for ch, n in aff_max)
+        checks.append(_affinity_ok)
+
+    if not checks:
+        return _always
+    if len(checks) == 1:
+        return checks[0]
+    checks_t = tuple(checks)
+    return lambda s, f: all(c(s, f) for c in checks_t)
+
+
+# ============================================
+# 씬 단위 컴파일 결과
+# ============================================
+@dataclass
+class CompiledScene:
+    allowed_speakers: List[str]
+    speaker_rules: List[Tuple[Predicate, List[str]]] = field(default_factory=list)
+    split_index: Dict[str, List[Tuple[Predicate, Dict[str, Any]]]] = field(default_factory=dict)
+
+    def targets(self) -> List[str]:
+        """split_rules의 goto 대상 (선언 순서, 중복 제거)"""
+        return list(dict.fromkeys(o["goto"] for cands in self.split_index.values() for _, o in cands if o["goto"]))
+
+    def speakers(self, state: Dict[str, Any], flags: Optional["set[str]"] = None) -> List[str]:
+        if self.speaker_rules:
+            f = set(state.get("flags", [])) if flags is None else flags
+            for pred, override in self.speaker_rules:
+                if pred(state, f):
+                    return list(override)
+        return list(self.allowed_speakers)
+
+    def branch(self, state: Dict[str, Any], choice_value: Optional[str],
+               flags: Optional["set[str]"] = None) -> Optional[Dict[str, Any]]:
+        candidates = self.split_index.get(choice_value or "")
+        if not candidates:
+            return None
+        f = set(state.get("flags", [])) if flags is None else flags
+        for pred, outcome in candidates:
+            if pred(state, f):
+                return {"goto": outcome["goto"], "set": dict(outcome["set"])}
+        return None
+
+
+def rule_table(scene_def: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    씬 규칙을 JSON으로 직렬화할 수 있는 정규형으로 (시나리오 번들에 그대로 저장)
+    화자 중복 제거, override 없는 speaker_rule 제거, split_rules를 when 값으로 색인, 조건 키만 남김
+    """
+    def _cond(rule: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: rule[k] for k in CONDITION_KEYS if rule.get(k)}
+
+    table: Dict[str, Any] = {
+        "allowed_speakers": list(dict.fromkeys(scene_def.get("allowed_speakers", []) or [])),
+        "speaker_rules": [],
+        "split_index": {},
+    }
+    for rule in scene_def.get("speaker_rules", []) or []:
+        # override 없는 speaker_rule은 결과에 영향이 없으므로 버린다
+        if "override" in rule:
+            table["speaker_rules"].append([_cond(rule), list(dict.fromkeys(rule["override"]))])
+    for rule in scene_def.get("split_rules", []) or []:
+        outcome = {"goto": rule.get("goto"), "set": rule.get("set", {}) or {}}
+        # JSON 키는 문자열이어야 하므로 when이 없는 규칙은 ""로 (조회 시 None → "")
+        table["split_index"].setdefault(rule.get("when") or "", []).append([_cond(rule), outcome])
+    return table
+
+
+def compile_rule_table(table: Dict[str, Any]) -> CompiledScene:
+    compiled = CompiledScene(allowed_speakers=list(table["allowed_speakers"]))
+    for cond, override in table["speaker_rules"]:
+        compiled.speaker_rules.append((compile_condition(cond), list(override)))
+    for when, cands in table["split_index"].items():
+        compiled.split_index[when] = [(compile_condition(cond), outcome) for cond, outcome in cands]
+    return compiled
+
+
+def compile_scene(scene_def: Dict[str, Any]) -> CompiledScene:
+    return compile_rule_table(rule_table(scene_def))
+
+
+# ============================================
+# scene_def dict 단위 캐시
+#   - ScenesRepo를 거치지 않는 호출(eval_split_rules 등)도 한 번만 컴파일
+#   - 원본 dict 참조를 같이 들고 있어 id 재사용으로 인한 오염이 없음
+# ============================================
+_SCENE_CACHE: Dict[int, Tuple[Dict[str, Any], CompiledScene]] = {}
+_COND_CACHE: Dict[int, Tuple[Dict[str, Any], Predicate]] = {}
+_CACHE_MAX = 1024
+
+
+def _cached(cache: Dict[int, Tuple[Dict[str, Any], Any]], obj: Dict[str, Any], build: Callable[[Dict[str, Any]], Any]) -> Any:
+    hit = cache.get(id(obj))
+    if hit is not None and hit[0] is obj:
+        return hit[1]
+    value = build(obj)
+    if len(cache) >= _CACHE_MAX:
+        cache.clear()
+    cache[id(obj)] = (obj, value)
+    return value
+
+
+def compiled_scene(scene_def: Dict[str, Any]) -> CompiledScene:
+    return _cached(_SCENE_CACHE, scene_def, compile_scene)
+
+
+def compiled_condition(rule: Dict[str, Any]) -> Predicate:
+    return _cached(_COND_CACHE, rule, compile_condition)
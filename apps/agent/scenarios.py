@@ -0,0 +1,273 @@
+# scenarios.py
+"""
+시나리오 번들 컴파일러 / 지연 로딩 레지스트리
+
+GameState.scenario_id로 에피소드를 고른다. 에피소드가 늘어도 워커 시작 시간과 상주 메모리가
+카탈로그 크기에 비례하지 않도록, 시나리오마다 packstore 팩 파일 하나로 미리 컴파일해 두고
+처음 쓰일 때 mmap으로 연다.
+
+- 원본  : config/scenarios/<scenario_id>.json
+          {"scenes": {...}, "images": {resource_id: meta}, "start_scene": "..."} 또는 scenes dict 그대로
+          DEFAULT_SCENARIO_ID는 config/scenes.json (AppFactory의 핫 리로드 경로가 그대로 담당)
+- 번들  : config/build/scenarios/<scenario_id>.pack (packstore)
+          meta          → format, scenario_id, version(원본 내용 해시), start_scene, scene_ids,
+                          characters(캐릭터 참조), flags, hidden_rule
+          scene:<id>    → 씬 정의 JSON
+          rules:<id>    → rules.rule_table() 정규형 (조회 시 predicate 클로저로만 바꾼다)
+          images        → 이미지 매니페스트 (원본 images + 씬 default_images의 resource_id)
+- 레지스트리: ScenarioRegistry.get(scenario_id)
+          원본보다 오래된(또는 없는) 팩만 다시 컴파일 → 열기. 프로세스당 시나리오 하나에 번들 하나를 공유
+          최근 max_loaded개 + idle_ttl_sec 안에 쓰인 것만 강한 참조로 유지, 나머지는 놓는다
+          (놓은 번들도 아직 쓰는 세션/에이전트가 있으면 같은 인스턴스를 다시 돌려준다)
+- pinned(bundle): 턴 동안 AppFactory.scenes_repo가 이 번들의 씬을 보게 한다 (config_source.pinned와 같은 방식)
+
+빌드: python scenarios.py [scenario_id ...]   (인자가 없으면 config/scenarios/ 전체)
+"""
+
+from __future__ import annotations
+import contextlib, contextvars, hashlib, json, os, threading, time, weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional
+
+from packstore import PackReader, write_pack
+from metrics import CACHE_REQUESTS, CACHE_ENTRIES
+from parent import ImagesRepo, ScenesRepo
+from rules import CompiledScene, compile_rule_table, rule_table
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "config")
+SCENARIOS_DIR = os.path.join(CONFIG_DIR, "scenarios")
+BUILD_DIR = os.path.join(CONFIG_DIR, "build", "scenarios")
+DEFAULT_SCENARIO_ID = os.getenv("AGENT_DEFAULT_SCENARIO", "default")
+BUNDLE_FORMAT = 1
+
+
+# ============================================
+# 컴파일
+# ============================================
+def _split_source(raw: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(raw.get("scenes"), dict):
+        return raw
+    return {"scenes": raw}
+
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def compile_bundle(scenario_id: str, source: str, dst: Optional[str] = None) -> str:
+    """원본 JSON → 번들 팩 파일. validate_scenes와 같은 검증을 통과해야 기록한다."""
+    from compact_state import scenario_symbols
+    from config_source import validate_scenes
+    from assets import scene_resource_ids
+
+    with open(source, "rb") as f:
+        raw_bytes = f.read()
+    src = _split_source(json.loads(raw_bytes))
+    scenes: Dict[str, Any] = src["scenes"]
+    validate_scenes(scenes)
+
+    repo = ScenesRepo(scenes)
+    symbols = scenario_symbols(scenes)
+    images: Dict[str, Any] = {rid: {} for scene in scenes.values() for rid in scene_resource_ids(scene)}
+    images.update(src.get("images") or {})
+    meta = {
+        "format": BUNDLE_FORMAT,
+        "scenario_id": scenario_id,
+        "version": hashlib.sha1(raw_bytes).hexdigest()[:12],
+        "start_scene": src.get("start_scene") or next(iter(scenes), None),
+        "scene_ids": list(scenes),
+        "characters": symbols.chars.names,
+        "flags": symbols.flags.names,
+        "hidden_rule": repo.hidden_rule(),
+    }
+    records: Dict[str, bytes] = {"meta": _dumps(meta), "images": _dumps(images)}
+    for scene_id, scene in scenes.items():
+        records[f"scene:{scene_id}"] = _dumps(scene)
+        records[f"rules:{scene_id}"] = _dumps(rule_table(scene))
+    return write_pack(dst or bundle_path(scenario_id), records)
+
+
+def bundle_path(scenario_id: str, build_dir: str = BUILD_DIR) -> str:
+    return os.path.join(build_dir, f"{scenario_id}.pack")
+
+
+# ============================================
+# 번들 (불변, 세션 간 공유)
+# ============================================
+class BundleScenes(Mapping):
+    """scene_id → 씬 dict. 팩에서 처음 조회할 때 디코딩하고 번들이 살아 있는 동안 유지 (호출 측은 읽기만)"""
+
+    def __init__(self, pack: PackReader, scene_ids: List[str]):
+        self._pack = pack
+        self._ids = scene_ids
+        self._decoded: Dict[str, Dict[str, Any]] = {}
+
+    def __getitem__(self, scene_id: str) -> Dict[str, Any]:
+        scene = self._decoded.get(scene_id)
+        if scene is None:
+            scene = self._decoded[scene_id] = json.loads(bytes(self._pack[f"scene:{scene_id}"]))
+        return scene
+
+    def __contains__(self, scene_id: object) -> bool:
+        return isinstance(scene_id, str) and f"scene:{scene_id}" in self._pack
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class BundleScenesRepo(ScenesRepo):
+    """번들의 rules:<id> 정규형에서 CompiledScene을 만들고, hidden_rule/심볼은 meta 값을 쓴다"""
+
+    def __init__(self, pack: PackReader, meta: Dict[str, Any]):
+        super().__init__(BundleScenes(pack, meta["scene_ids"]))
+        self._pack = pack
+        self._hidden_rule = meta.get("hidden_rule")
+        self._hidden_rule_found = True
+        self._meta = meta
+
+    def compiled(self, scene_id: str) -> CompiledScene:
+        c = self._compiled.get(scene_id)
+        if c is None:
+            key = f"rules:{scene_id}"
+            table = json.loads(bytes(self._pack[key])) if key in self._pack else rule_table({})
+            c = self._compiled[scene_id] = compile_rule_table(table)
+        return c
+
+    def symbols(self):
+        if self._symbols is None:
+            from compact_state import ScenarioSymbols
+            m = self._meta
+            self._symbols = ScenarioSymbols(m["scene_ids"], m["characters"], m["flags"])
+        return self._symbols
+
+
+class ScenarioBundle:
+    def __init__(self, path: str):
+        self.path = path
+        self._pack = PackReader(path)
+        meta = json.loads(bytes(self._pack["meta"]))
+        if meta.get("format") != BUNDLE_FORMAT:
+            self._pack.close()
+            raise ValueError(f"unsupported scenario bundle format {meta.get('format')}: {path}")
+        self.meta = meta
+        self.scenario_id: str = meta["scenario_id"]
+        self.version: str = meta["version"]
+        self.start_scene: Optional[str] = meta.get("start_scene")
+        self.characters: List[str] = list(meta["characters"])
+        self.scenes = BundleScenesRepo(self._pack, meta)
+        self._images: Optional[ImagesRepo] = None
+
+    @property
+    def images(self) -> ImagesRepo:
+        if self._images is None:
+            self._images = ImagesRepo(json.loads(bytes(self._pack["images"])))
+        return self._images
+
+    def __repr__(self) -> str:
+        return f"ScenarioBundle({self.scenario_id!r}, version={self.version!r})"
+
+
+# ============================================
+# 레지스트리
+# ============================================
+class ScenarioRegistry:
+    def __init__(self, source_dir: str = SCENARIOS_DIR, build_dir: str = BUILD_DIR,
+                 max_loaded: int = 8, idle_ttl_sec: float = 600.0,
+                 sources: Optional[Dict[str, str]] = None):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        self.max_loaded = max_loaded
+        self.idle_ttl_sec = idle_ttl_sec
+        self._sources = dict(sources or {})      # scenario_id → 원본 경로 (source_dir 규칙보다 우선)
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()   # scenario_id → (bundle, 마지막 사용 시각)
+        self._live: "weakref.WeakValueDictionary[str, ScenarioBundle]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def source(self, scenario_id: str) -> str:
+        path = self._sources.get(scenario_id) or os.path.join(self.source_dir, f"{scenario_id}.json")
+        if os.path.basename(scenario_id) != scenario_id or not os.path.exists(path):
+            raise KeyError(f"unknown scenario: {scenario_id!r}")
+        return path
+
+    def _open(self, scenario_id: str) -> ScenarioBundle:
+        source = self.source(scenario_id)
+        pack = bundle_path(scenario_id, self.build_dir)
+        if not os.path.exists(pack) or os.path.getmtime(pack) < os.path.getmtime(source):
+            compile_bundle(scenario_id, source, pack)
+        return ScenarioBundle(pack)
+
+    def get(self, scenario_id: str) -> ScenarioBundle:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._lru.get(scenario_id)
+            if hit is not None:
+                bundle = hit[0]
+                self._lru.move_to_end(scenario_id)
+                result = "hit"
+            else:
+                bundle = self._live.get(scenario_id)
+                result = "hit" if bundle is not None else "miss"
+                if bundle is None:
+                    bundle = self._live[scenario_id] = self._open(scenario_id)
+            self._lru[scenario_id] = (bundle, now)
+            self._evict(now)
+            n = len(self._lru)
+        CACHE_REQUESTS.inc(cache="scenarios", result=result)
+        CACHE_ENTRIES.set(n, cache="scenarios")
+        return bundle
+
+    def _evict(self, now: float) -> None:
+        # _lock 안에서 호출. 강한 참조만 놓는다 (쓰는 쪽이 남아 있으면 mmap은 그쪽 참조로 유지)
+        while len(self._lru) > self.max_loaded:
+            self._lru.popitem(last=False)
+        for sid, (_, used) in list(self._lru.items()):
+            if now - used < self.idle_ttl_sec:
+                break
+            del self._lru[sid]
+
+    def loaded(self) -> List[str]:
+        return list(self._lru)
+
+
+# ============================================
+# 턴 단위 고정
+# ============================================
+_active: contextvars.ContextVar[Optional[ScenarioBundle]] = contextvars.ContextVar("active_scenario", default=None)
+
+
+@contextlib.contextmanager
+def pinned(bundle: Optional[ScenarioBundle]) -> Iterator[Optional[ScenarioBundle]]:
+    token = _active.set(bundle)
+    try:
+        yield bundle
+    finally:
+        _active.reset(token)
+
+
+def active_scenario() -> Optional[ScenarioBundle]:
+    return _active.get()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="compile scenario bundles")
+    ap.add_argument("scenario_ids", nargs="*")
+    ap.add_argument("--source-dir", default=SCENARIOS_DIR)
+    ap.add_argument("--build-dir", default=BUILD_DIR)
+    args = ap.parse_args(argv)
+    ids = args.scenario_ids or sorted(os.path.splitext(n)[0] for n in os.listdir(args.source_dir)
+                                      if n.endswith(".json")) if os.path.isdir(args.source_dir) else args.scenario_ids
+    for sid in ids:
+        out = compile_bundle(sid, os.path.join(args.source_dir, f"{sid}.json"), bundle_path(sid, args.build_dir))
+        bundle = ScenarioBundle(out)
+        print(f"✅ {sid} v{bundle.version}: {len(bundle.meta['scene_ids'])} scenes, "
+              f"{len(bundle.characters)} characters → {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,652 @@
+# server.py
+"""
+로컬 asyncio 스트리밍 서버 (WebSocket / SSE) — 외부 라이브러리 없이 asyncio 스트림만 사용
+
+엔드포인트
+- GET  /sessions/{sid}/events   : SSE 구독 (text/event-stream)
+- GET  /sessions/{sid}/ws       : WebSocket 구독. 클라이언트 메시지도 받음
+                                  {"type":"input","text":"...","turn":..,"request_id":".."} / {"type":"vote","user_id":"..","value":".."}
+                                  입력 턴이 실패하면(세션 대기 초과 429 등) 그 연결에만 {"type":"error","status":..,"error":".."}
+- POST /sessions/{sid}/turns    : {"message":"..", "turn":마지막으로 본 turn, "request_id":".."} → 턴 실행,
+                                  render를 구독자 전원에게 팬아웃. turn/request_id는 선택이며 재시도 중복 판별에 쓴다
+- POST /sessions/{sid}/votes    : {"user_id":"..","value":".."}
+- GET  /assets/{resource_id}     : 프리패치 캐시에서 이미지 바이트 (없으면 그 자리에서 받아 옴)
+- GET  /healthz
+
+팬아웃
+- 구독자(연결)마다 크기 제한 큐(queue_size) 하나 + writer 태스크 하나
+- 느린 소비자 정책: drop_oldest(가장 오래된 메시지를 버리고 넣기) / disconnect(연결 종료)
+- 하트비트는 연결별 타이머가 아니라 서버 전체에 티커 태스크 하나
+  → 유휴 연결은 대기 중인 reader/writer 코루틴 두 개 + 빈 큐 정도의 비용
+
+턴 실행(그래프)은 동기 코드이므로 AppFactory.scheduler(actors.SessionScheduler)의 세션 mailbox에 넣어
+워커 스레드에서 돌린다 (같은 세션은 순서대로, 다른 세션은 동시에). 세션 대기가 꽉 차면 429.
+투표: 턴 결과에 선택지가 있으면 라운드를 열고(vote_open), 마감되면 vote_result 후 승자 선택지로 턴을 실행 (VoteRelay).
+창 길이는 AGENT_VOTE_WINDOW_SEC (기본 30초).
+사용: python server.py [--port 8765] [--scenes config/scenes.json] [--mock] [--fake-llm-ms 0]
+"""
+
+from __future__ import annotations
+import argparse, asyncio, base64, hashlib, json, mimetypes, os, struct
+from typing import Any, Dict, Optional, Set, Tuple
+
+from actors import SessionBacklogFull
+from compact_state import CompactSessions
+from metrics import STREAM_CONNECTIONS, STREAM_MESSAGES
+from voting import VoteHub, VoteResult, apply_vote_result
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_WS_FRAME = 64 * 1024
+
+DROP_POLICIES = ("drop_oldest", "disconnect")
+
+_HEARTBEAT = object()   # 큐에 들어가는 하트비트 표식
+_CLOSE = object()       # writer 종료 표식
+
+
+# ============================================
+# 구독자 / 브로드캐스터
+# ============================================
+class Subscriber:
+    __slots__ = ("session_id", "transport", "queue", "dropped", "closed")
+
+    def __init__(self, session_id: str, transport: str, queue_size: int):
+        self.session_id = session_id
+        self.transport = transport
+        self.queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+
+
+class Broadcaster:
+    def __init__(self, queue_size: int = 32, drop_policy: str = "drop_oldest"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"unknown drop policy: {drop_policy}")
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self._subs: Dict[str, Set[Subscriber]] = {}
+
+    def subscribe(self, session_id: str, transport: str) -> Subscriber:
+        sub = Subscriber(session_id, transport, self.queue_size)
+        self._subs.setdefault(session_id, set()).add(sub)
+        STREAM_CONNECTIONS.inc(transport=transport)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        subs = self._subs.get(sub.session_id)
+        if subs is not None and sub in subs:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.session_id]
+            STREAM_CONNECTIONS.dec(transport=sub.transport)
+
+    def _offer(self, sub: Subscriber, item: Any) -> bool:
+        try:
+            sub.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.drop_policy == "disconnect":
+            self.kick(sub)
+            return False
+        # drop_oldest: 가장 오래된 것 하나를 버리고 최신 메시지를 넣는다
+        try:
+            sub.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        sub.dropped += 1
+        sub.queue.put_nowait(item)
+        STREAM_MESSAGES.inc(outcome="dropped")
+        return True
+
+    def kick(self, sub: Subscriber) -> None:
+        if sub.closed:
+            return
+        sub.closed = True
+        STREAM_MESSAGES.inc(outcome="disconnected")
+        # 남은 메시지는 버리고 종료 표식만 남긴다 (writer가 연결을 닫음)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(_CLOSE)
+
+    def publish(self, session_id: str, message: Dict[str, Any]) -> int:
+        """세션 구독자 전원에게 전달. 직렬화는 한 번만 하고 같은 문자열을 공유한다."""
+        subs = self._subs.get(session_id)
+        if not subs:
+            return 0
+        data = json.dumps(message, ensure_ascii=False)
+        n = 0
+        for sub in list(subs):
+            if not sub.closed and self._offer(sub, data):
+                n += 1
+        STREAM_MESSAGES.inc(n, outcome="queued")
+        return n
+
+    def send(self, sub: Subscriber, message: Dict[str, Any]) -> bool:
+        """구독자 한 명에게만 (오류 응답 등)"""
+        return not sub.closed and self._offer(sub, json.dumps(message, ensure_ascii=False))
+
+    def heartbeat(self) -> None:
+        # 보낼 게 쌓여 있는 연결은 그 메시지가 곧 생존 신호이므로 건너뛴다
+        for subs in list(self._subs.values()):
+            for sub in list(subs):
+                if not sub.closed and sub.queue.empty():
+                    sub.queue.put_nowait(_HEARTBEAT)
+
+    def close_all(self) -> None:
+        for subs in list(self._subs.values()):
+            for sub in list(subs):
+                self.kick(sub)
+
+    def count(self, session_id: Optional[str] = None) -> int:
+        if session_id is not None:
+            return len(self._subs.get(session_id, ()))
+        return sum(len(s) for s in self._subs.values())
+
+
+# ============================================
+# 세션 상태 / 턴 실행
+# ============================================
+def new_graph_state(session_id: str, start_scene: str, game_mode: str = "story") -> Dict[str, Any]:
+    return dict(
+        session_id=session_id, current_node=start_scene, game_mode=game_mode,
+        user_history=[], history_refs=[], agent_outputs=[], master_turn_count=0, sub_turn_count=0, turn_limit=100,
+        is_voting_active=False, affinity={}, vote_options=[], user_votes={},
+        scene_image_url="", next_node="", classification="", severity="",
+        flags=[], scene_history=[], render={}, router_choice_hint={}, config_version="",
+    )
+
+
+class VoteRelay:
+    """
+    다중 시청자 투표 연결 (TurnRunner / sharding.ShardedTurnRunner 공용)
+    - 턴이 끝나 render에 value가 있는 선택지가 있으면 그 선택지로 라운드를 연다 (이전 라운드는 버림)
+    - 표가 들어올 때마다 tally를 팬아웃. 조기 종료(decided)되거나 StreamServer의 sweep에서 창이 끝나면
+      vote_result를 팬아웃하고, 승자가 있으면 그 선택지 문장으로 턴을 실행한다
+      (턴 안에서 apply_vote_result로 승자를 router_choice_hint에 넣는다 → ParentAgent가 그대로 선택)
+    하위 클래스는 self.votes(VoteHub), self.broadcaster, run(..., vote=)을 제공한다
+    """
+
+    vote_window_sec = float(os.getenv("AGENT_VOTE_WINDOW_SEC", "30"))
+    votes: VoteHub
+    broadcaster: Broadcaster
+
+    def _init_votes(self) -> None:
+        self._vote_texts: Dict[str, Dict[str, str]] = {}   # session_id → 열린 라운드의 value → 선택지 문장
+        self._vote_turns: Set[asyncio.Task] = set()
+
+    def _open_vote(self, session_id: str, render: Dict[str, Any]) -> None:
+        self.votes.close(session_id, "superseded")         # 새 턴이 나왔으면 이전 선택지 투표는 무효
+        self._vote_texts.pop(session_id, None)
+        choices = [c for c in render.get("choices") or [] if c.get("value")]
+        if not choices:
+            return
+        rnd = self.votes.open(session_id, [c["value"] for c in choices], window_sec=self.vote_window_sec)
+        self._vote_texts[session_id] = {c["value"]: c.get("text") or c["value"] for c in choices}
+        self.broadcaster.publish(session_id, {"type": "vote_open", "session_id": session_id,
+                                              "round_id": rnd.round_id, "options": rnd.options,
+                                              "window_sec": rnd.window_sec})
+
+    def vote(self, session_id: str, user_id: str, value: str) -> str:
+        outcome = self.votes.vote(session_id, user_id, value)
+        rnd = self.votes.get(session_id)
+        if rnd is not None:
+            self.broadcaster.publish(session_id, {"type": "tally", "session_id": session_id,
+                                                  "counts": rnd.tally(), "closed": rnd.closed})
+            if rnd.closed:
+                self._vote_closed(session_id, self.votes.close(session_id, "decided"))
+        return outcome
+
+    def sweep_votes(self) -> None:
+        for session_id, result in self.votes.sweep().items():
+            self._vote_closed(session_id, result)
+
+    def _vote_closed(self, session_id: str, result: Optional[VoteResult]) -> None:
+        texts = self._vote_texts.pop(session_id, {})
+        if result is None:
+            return
+        self.broadcaster.publish(session_id, {"type": "vote_result", "session_id": session_id,
+                                              "round_id": result.round_id, "winner": result.winner,
+                                              "counts": result.counts, "reason": result.reason})
+        if result.winner is None:
+            return
+        # request_id를 라운드로 고정 → 같은 라운드 결과로 턴이 두 번 돌지 않는다
+        task = asyncio.ensure_future(self.run(session_id, texts.get(result.winner, result.winner),
+                                              request_id=f"vote:{result.round_id}", vote=result))
+        self._vote_turns.add(task)
+        task.add_done_callback(lambda t, sid=session_id: self._vote_turn_done(sid, t))
+
+    def _vote_turn_done(self, session_id: str, task: asyncio.Task) -> None:
+        self._vote_turns.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            e = task.exception()
+            self.broadcaster.publish(session_id, {"type": "error", "session_id": session_id, "status": 500,
+                                                  "error": f"{type(e).__name__}: {e}"})
+
+    async def run(self, session_id: str, message: str, seen_turn: Optional[int] = None,
+                  request_id: Optional[str] = None, vote: Optional[VoteResult] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class TurnRunner(VoteRelay):
+    """세션 상태 보관 + 세션별 직렬 실행. 턴은 factory.scheduler의 세션 mailbox로 (다른 세션끼리는 동시에)"""
+
+    def __init__(self, factory: Any, broadcaster: Broadcaster, start_scene: str):
+        self.factory = factory
+        self.broadcaster = broadcaster
+        self.start_scene = start_scene
+        self.votes = factory.votes
+        self._states = CompactSessions(factory.scenes_repo.symbols())   # 유휴 세션은 압축 보관
+        self._init_votes()
+
+    def state(self, session_id: str) -> Dict[str, Any]:
+        st = self._states.get(session_id)
+        if st is None:
+            st = self._states[session_id] = new_graph_state(session_id, self.start_scene)
+        return st
+
+    def asset(self, resource_id: str) -> Optional[bytes]:
+        return self.factory.prefetcher.get(resource_id)
+
+    def _turn(self, session_id: str, message: str, seen_turn: Optional[int], request_id: Optional[str],
+              vote: Optional[VoteResult]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        # scheduler 워커 스레드에서 실행. 같은 세션의 이전 턴이 저장한 상태에서 시작한다
+        state = self.state(session_id)
+        state["render"] = {}
+        if vote is not None:
+            apply_vote_result(state, vote)
+        final = self.factory.run_turn(state, message, seen_turn, request_id)
+        render = final.get("render") or {"narration": "", "lines": list(final.get("agent_outputs") or []),
+                                         "choices": [], "image": None}
+        final["agent_outputs"] = []   # main.py 루프와 같이 전달한 출력은 비운다
+        self._states[session_id] = final
+        return final, render
+
+    async def run(self, session_id: str, message: str, seen_turn: Optional[int] = None,
+                  request_id: Optional[str] = None, vote: Optional[VoteResult] = None) -> Dict[str, Any]:
+        if seen_turn is None and request_id is None:
+            # 클라이언트가 기준을 안 보냈으면 제출 시점(실행 시점이 아니라)의 turn을 본 것으로 친다
+            # → mailbox에 같이 쌓인 더블클릭은 같은 키, 결과를 보고 다시 보낸 같은 선택은 다른 키
+            cur = self._states.session(session_id)
+            seen_turn = cur["master_turn_count"] if cur is not None else 0
+        final, render = await asyncio.wrap_future(self.factory.scheduler.submit(
+            session_id, self._turn, session_id, message, seen_turn, request_id, vote))
+        payload = {
+            "type": "render", "session_id": session_id,
+            "turn": final.get("master_turn_count"), "scene": final.get("current_node"),
+            "config_version": final.get("config_version", ""), "render": render,
+        }
+        self.broadcaster.publish(session_id, payload)
+        self._open_vote(session_id, render)
+        return payload
+
+
+# ============================================
+# HTTP / WebSocket 프로토콜 (최소 구현)
+# ============================================
+class HttpError(Exception):
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request Header Fields Too Large")
+    if len(head) > MAX_HEADER_BYTES:
+        raise HttpError(431, "Request Header Fields Too Large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Bad Request")
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    body = b""
+    try:
+        length = int(headers.get("content-length", "0") or 0)
+    except ValueError:
+        raise HttpError(400, "invalid Content-Length")
+    if length < 0:
+        raise HttpError(400, "invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "Payload Too Large")
+    if length:
+        body = await reader.readexactly(length)
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+
+def _response(status: int, reason: str, body: bytes = b"", content_type: str = "application/json") -> bytes:
+    return (f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("latin-1") + body
+
+
+def _submission(req: Dict[str, Any]) -> Tuple[Optional[int], Optional[str]]:
+    """클라이언트가 보낸 제출 기준 (본 turn, request_id). 중복 제출 판별(idempotency)에 쓴다"""
+    turn = req.get("turn")
+    rid = req.get("request_id")
+    return (turn if isinstance(turn, int) and not isinstance(turn, bool) else None,
+            str(rid) if rid not in (None, "") else None)
+
+
+def _json_response(status: int, obj: Any) -> bytes:
+    return _response(status, "OK" if status < 400 else "Error", json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+
+def ws_accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode("latin-1")).digest()).decode("latin-1")
+
+
+def ws_frame(opcode: int, payload: bytes = b"") -> bytes:
+    """서버 → 클라이언트 프레임 (마스킹 없음, FIN=1)"""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+async def ws_read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """클라이언트 → 서버 프레임 하나 (opcode, payload). 조각난 메시지는 이어 붙여 반환."""
+    message = bytearray()
+    first_opcode = None
+    while True:
+        b1, b2 = await reader.readexactly(2)
+        fin, opcode = b1 & 0x80, b1 & 0x0F
+        masked, n = b2 & 0x80, b2 & 0x7F
+        if n == 126:
+            (n,) = struct.unpack("!H", await reader.readexactly(2))
+        elif n == 127:
+            (n,) = struct.unpack("!Q", await reader.readexactly(8))
+        if n > MAX_WS_FRAME or len(message) + n > MAX_WS_FRAME:
+            raise HttpError(1009, "message too big")
+        mask = await reader.readexactly(4) if masked else b""
+        data = await reader.readexactly(n)
+        if mask:
+            data = bytes(c ^ mask[i & 3] for i, c in enumerate(data))
+        if opcode >= 0x8:          # 제어 프레임은 조각 사이에도 올 수 있음 → 바로 반환
+            return opcode, data
+        if first_opcode is None:
+            first_opcode = opcode
+        message += data
+        if fin:
+            return first_opcode, bytes(message)
+
+
+# ============================================
+# 서버
+# ============================================
+class StreamServer:
+    def __init__(self, runner: TurnRunner, broadcaster: Broadcaster, heartbeat_sec: float = 15.0):
+        self.runner = runner
+        self.broadcaster = broadcaster
+        self.heartbeat_sec = heartbeat_sec
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._ticker: Optional[asyncio.Task] = None
+        self._vote_ticker: Optional[asyncio.Task] = None
+        self._turns: Set[asyncio.Task] = set()   # WebSocket 입력으로 시작한 턴 (끝날 때까지 참조 유지)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> "StreamServer":
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES)
+        self._ticker = asyncio.create_task(self._heartbeat_loop())
+        self._vote_ticker = asyncio.create_task(self._vote_loop())
+        return self
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+
+    async def close(self) -> None:
+        if self._ticker:
+            self._ticker.cancel()
+        if self._vote_ticker:
+            self._vote_ticker.cancel()
+        self.broadcaster.close_all()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        assert self._server is not None
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_sec)
+            self.broadcaster.heartbeat()
+
+    async def _vote_loop(self, interval: float = 1.0) -> None:
+        # 창이 끝난 투표 라운드 마감 → 승자로 턴 실행 (VoteRelay)
+        while True:
+            await asyncio.sleep(interval)
+            self.runner.sweep_votes()
+
+    # ---- 라우팅 ----
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        streaming = False   # SSE/WebSocket 응답 헤더를 보낸 뒤에는 HTTP 오류 응답을 쓸 수 없다
+        try:
+            method, path, headers, body = await _read_request(reader)
+            parts = [p for p in path.split("/") if p]
+            if method == "GET" and parts == ["healthz"]:
+                writer.write(_json_response(200, {"ok": True, "subscribers": self.broadcaster.count()}))
+            elif method == "GET" and len(parts) == 2 and parts[0] == "assets":
+                writer.write(await self._asset(parts[1]))
+            elif len(parts) == 3 and parts[0] == "sessions":
+                sid, action = parts[1], parts[2]
+                if method == "GET" and action == "events":
+                    streaming = True
+                    await self._serve_sse(sid, reader, writer)
+                    return
+                if method == "GET" and action == "ws":
+                    streaming = True
+                    await self._serve_ws(sid, headers, reader, writer)
+                    return
+                if method == "POST" and action in ("turns", "votes"):
+                    writer.write(await self._post(sid, action, body))
+                else:
+                    raise HttpError(404, "Not Found")
+            else:
+                raise HttpError(404, "Not Found")
+            await writer.drain()
+        except HttpError as e:
+            if e.status < 1000:
+                writer.write(_json_response(e.status, {"error": e.reason}))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            # 처리 중 예상 못 한 오류도 연결만 끊지 않고 500으로 알린다
+            if not streaming:
+                writer.write(_json_response(500, {"error": f"{type(e).__name__}: {e}"}))
+        finally:
+            writer.close()
+
+    async def _post(self, sid: str, action: str, body: bytes) -> bytes:
+        try:
+            req = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "invalid JSON")
+        if not isinstance(req, dict):
+            raise HttpError(400, "JSON object required")
+        if action == "turns":
+            if not isinstance(req.get("message"), str):
+                raise HttpError(400, "message is required")
+            try:
+                return _json_response(200, await self.runner.run(sid, req["message"], *_submission(req)))
+            except SessionBacklogFull as e:
+                raise HttpError(429, str(e))
+        if not req.get("user_id") or not req.get("value"):
+            raise HttpError(400, "user_id and value are required")
+        return _json_response(200, {"outcome": self.runner.vote(sid, str(req["user_id"]), str(req["value"]))})
+
+    async def _asset(self, rid: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.runner.asset, rid)
+        if data is None:
+            raise HttpError(404, "asset not found")
+        return _response(200, "OK", data, mimetypes.guess_type(rid)[0] or "application/octet-stream")
+
+    # ---- SSE ----
+    async def _serve_sse(self, sid: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+        sub = self.broadcaster.subscribe(sid, "sse")
+        # 클라이언트가 끊으면 reader가 EOF → writer 루프 종료
+        watcher = asyncio.create_task(reader.read())
+        watcher.add_done_callback(lambda _t: sub.closed or self.broadcaster.kick(sub))
+        try:
+            while True:
+                item = await sub.queue.get()
+                if item is _CLOSE:
+                    break
+                if item is _HEARTBEAT:
+                    writer.write(b": ping\n\n")
+                else:
+                    writer.write(b"event: message\ndata: " + item.encode("utf-8") + b"\n\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            watcher.cancel()
+            self.broadcaster.unsubscribe(sub)
+
+    # ---- WebSocket ----
+    async def _serve_ws(self, sid: str, headers: Dict[str, str], reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter) -> None:
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            raise HttpError(400, "WebSocket upgrade required")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {ws_accept_key(key)}\r\n\r\n").encode("latin-1"))
+        sub = self.broadcaster.subscribe(sid, "ws")
+        recv = asyncio.create_task(self._ws_recv(sid, sub, reader, writer))
+        try:
+            while True:
+                item = await sub.queue.get()
+                if item is _CLOSE:
+                    writer.write(ws_frame(0x8, struct.pack("!H", 1000)))
+                    break
+                writer.write(ws_frame(0x9) if item is _HEARTBEAT else ws_frame(0x1, item.encode("utf-8")))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            recv.cancel()
+            self.broadcaster.unsubscribe(sub)
+
+    async def _ws_recv(self, sid: str, sub: Subscriber, reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                opcode, data = await ws_read_frame(reader)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    writer.write(ws_frame(0xA, data))
+                    continue
+                if opcode != 0x1:
+                    continue
+                try:
+                    msg = json.loads(data)
+                except ValueError:
+                    continue
+                if not isinstance(msg, dict):
+                    continue
+                if msg.get("type") == "input" and isinstance(msg.get("text"), str):
+                    # 결과는 publish로 이 연결을 포함한 구독자 전원에게 간다. 실패는 이 연결에만 error로
+                    task = asyncio.create_task(self.runner.run(sid, msg["text"], *_submission(msg)))
+                    self._turns.add(task)
+                    task.add_done_callback(lambda t, sub=sub: self._ws_turn_done(sub, t))
+                elif msg.get("type") == "vote" and msg.get("user_id") and msg.get("value"):
+                    self.runner.vote(sid, str(msg["user_id"]), str(msg["value"]))
+        except (asyncio.IncompleteReadError, ConnectionError, HttpError):
+            pass
+        finally:
+            if not sub.closed:
+                self.broadcaster.kick(sub)
+
+
+    def _ws_turn_done(self, sub: Subscriber, task: asyncio.Task) -> None:
+        self._turns.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        e = task.exception()
+        status = 429 if isinstance(e, SessionBacklogFull) else 500
+        self.broadcaster.send(sub, {"type": "error", "session_id": sub.session_id, "status": status,
+                                    "error": str(e) if status == 429 else f"{type(e).__name__}: {e}"})
+
+
+# ============================================
+# 실행
+# ============================================
+def build_server(factory: Any, start_scene: str, queue_size: int = 32, drop_policy: str = "drop_oldest",
+                 heartbeat_sec: float = 15.0) -> StreamServer:
+    broadcaster = Broadcaster(queue_size=queue_size, drop_policy=drop_policy)
+    return StreamServer(TurnRunner(factory, broadcaster, start_scene), broadcaster, heartbeat_sec)
+
+
+def main(argv=None) -> None:
+    from main import AppFactory
+    from parent import load_json
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description="agent streaming server (WebSocket/SSE)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--scenes", default=os.path.join(here, "config", "scenes.json"))
+    ap.add_argument("--start-scene", default=None)
+    ap.add_argument("--images", default=None, help="ImagesRepo JSON (resource_id → url/path). 없으면 assets/ 디렉터리만")
+    ap.add_argument("--mock", action="store_true", help="MockChildren 사용")
+    ap.add_argument("--fake-llm-ms", type=float, default=None, help="FakeOpenAIClient(지연 ms) 사용")
+    ap.add_argument("--queue-size", type=int, default=32)
+    ap.add_argument("--drop-policy", choices=DROP_POLICIES, default="drop_oldest")
+    ap.add_argument("--heartbeat", type=float, default=15.0)
+    ap.add_argument("--workers", type=int, default=0, help="N>0이면 세션 샤딩 워커 프로세스 N개 (sharding.py)")
+    args = ap.parse_args(argv)
+
+    start = args.start_scene or next(iter(load_json(args.scenes)))
+    if args.workers > 0:
+        from sharding import ShardedRuntime, ShardedTurnRunner, WorkerConfig
+        runtime = ShardedRuntime(WorkerConfig(args.scenes, start, use_mock_children=args.mock,
+                                              fake_llm_ms=args.fake_llm_ms, images_source=args.images),
+                               workers=args.workers)
+        broadcaster = Broadcaster(queue_size=args.queue_size, drop_policy=args.drop_policy)
+        make_server = lambda: StreamServer(ShardedTurnRunner(runtime, broadcaster), broadcaster, args.heartbeat)
+    else:
+        runtime = None
+        client = None
+        if args.fake_llm_ms is not None:
+            from fake_llm import FakeOpenAIClient
+            client = FakeOpenAIClient(latency_ms=args.fake_llm_ms)
+        factory = AppFactory(use_mock_children=args.mock, scenes_source=args.scenes, openai_client=client,
+                             images_source=args.images,
+                             config_poll_interval=float(os.getenv("AGENT_CONFIG_POLL_SEC", "2")))
+        make_server = lambda: build_server(factory, start, args.queue_size, args.drop_policy, args.heartbeat)
+
+    async def _run():
+        server = await make_server().start(args.host, args.port)
+        print(f"listening on http://{args.host}:{server.port}  (start scene: {start})")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if runtime is not None:
+            runtime.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# session_state.py
+"""
+세션 상태 단일 모델
+
+GraphState(LangGraph 채널 dict)를 세션 상태의 유일한 원본으로 두고,
+각 노드는 복사본이 아니라 그 위의 뷰로 읽는다.
+
+- GameView  : ParentAgent가 기대하는 GameState 키로 GraphState를 읽는 읽기 전용 Mapping
+              (turn ↔ master_turn_count, scene ↔ current_node, last_user_msg ← user_history[-1],
+               나머지 GameState 필드는 같은 이름으로 GraphState에 저장)
+- TurnView  : 라우터/가드레일/parent가 읽는 이번 턴 입력 (마지막 발화, 최근 대화 창, ContextEnvelope)
+- game_delta: ParentAgent.step()이 apply_patch로 만든 새 GameState → GraphState update (바뀐 키만)
+
+state_patch 병합은 ParentAgent(apply_patch) 한 곳에서만 하고, 여기서는 키 이름만 옮긴다.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+from history import message_text, prompt_window
+
+# GameState 키 → GraphState 키 (계산 키 scene / last_user_msg 제외)
+GAME_FIELDS: Dict[str, str] = {
+    "user_id": "user_id",
+    "session_id": "session_id",
+    "scenario_id": "scenario_id",
+    "route": "route",
+    "turn": "master_turn_count",
+    "total_turns_used": "total_turns_used",
+    "character_turns_used": "character_turns_used",
+    "allies": "allies",
+    "affinity": "affinity",
+    "flags": "flags",
+    "ending": "ending",
+    "end_reason": "end_reason",
+    "user_choice": "user_choice",
+    "scene_history": "scene_history",
+    "dialogue_rules": "dialogue_rules",
+    "updated_at": "updated_at",
+    "config_version": "config_version",
+}
+DEFAULT_SCENE = "scene5_fork"
+
+
+class GameView(Mapping[str, Any]):
+    """GraphState를 GameState처럼 읽는 뷰. 값은 원본 객체를 그대로 돌려준다 (apply_patch가 복사 후 수정)"""
+    __slots__ = ("_s",)
+
+    def __init__(self, state: Mapping[str, Any]):
+        self._s = state
+
+    def __getitem__(self, key: str) -> Any:
+        s = self._s
+        if key == "scene":
+            return {"current_scene": s.get("current_node") or DEFAULT_SCENE}
+        if key == "last_user_msg":
+            hist = s.get("user_history") or []
+            if not hist:
+                raise KeyError(key)
+            return message_text(hist[-1])
+        gk = GAME_FIELDS.get(key)
+        if gk is None or gk not in s:
+            raise KeyError(key)
+        return s[gk]
+
+    def __iter__(self) -> Iterator[str]:
+        s = self._s
+        yield "scene"
+        if s.get("user_history"):
+            yield "last_user_msg"
+        for key, gk in GAME_FIELDS.items():
+            if gk in s:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"GameView({dict(self)!r})"
+
+
+class TurnView:
+    """이번 턴 입력 뷰 (라우터/가드레일/parent 공용)"""
+    __slots__ = ("_s",)
+
+    def __init__(self, state: Mapping[str, Any]):
+        self._s = state
+
+    @property
+    def history(self) -> List[Any]:
+        return self._s.get("user_history") or []
+
+    @property
+    def last_message(self) -> str:
+        hist = self.history
+        return message_text(hist[-1]) if hist else ""
+
+    def context(self, **window: int) -> List[str]:
+        """마지막 발화를 뺀 최근 대화 창 (history.prompt_window)"""
+        return prompt_window(self.history[:-1], **window)
+
+    @property
+    def game_mode(self) -> Optional[str]:
+        return self._s.get("game_mode")
+
+    @property
+    def classification(self) -> Optional[str]:
+        return self._s.get("classification")
+
+    def envelope(self) -> Dict[str, Any]:
+        msg = self.last_message
+        return {
+            "session_id": self._s.get("session_id", ""), "turn": self._s.get("master_turn_count", 0),
+            "user_msg_raw": msg,
+            "recent_messages": [{"role": "user", "content": m} for m in prompt_window(self.history)],
+            "router_choice_hint": self._s.get("router_choice_hint") or {},  # 투표 결과 등
+            "guardrail": {"allowed": True, "sanitized_user_msg": msg},
+        }
+
+
+def game_view(state: Mapping[str, Any]) -> GameView:
+    return GameView(state)
+
+
+def turn_view(state: Mapping[str, Any]) -> TurnView:
+    return TurnView(state)
+
+
+def game_delta(state: Mapping[str, Any], new_game: Mapping[str, Any]) -> Dict[str, Any]:
+    """새 GameState에서 GraphState와 달라진 필드만 GraphState 키로 (last_user_msg는 user_history가 원본)"""
+    delta: Dict[str, Any] = {}
+    scene = (new_game.get("scene") or {}).get("current_scene")
+    if scene and scene != state.get("current_node"):
+        delta["current_node"] = scene
+    for key, gk in GAME_FIELDS.items():
+        if key not in new_game:
+            continue
+        v = new_game[key]
+        if gk not in state or (state[gk] is not v and state[gk] != v):
+            delta[gk] = v
+    return delta
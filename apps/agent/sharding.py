@@ -0,0 +1,456 @@
+# sharding.py
+"""
+세션 고정(session affinity) 멀티 프로세스 런타임
+
+GIL 때문에 한 프로세스에서는 apply_patch / pydantic 검증 / JSON 생성 같은 CPU 구간이 코어 하나에 묶인다.
+앞단 디스패처가 session_id를 일관 해시(HashRing)로 N개 워커 프로세스 중 하나에 보내고,
+각 워커는 자기 세션의 GraphState를 메모리에 들고 턴을 순서대로 처리한다.
+
+- 통신     : multiprocessing Pipe (유닉스 로컬 소켓 쌍). 요청 (op, req_id, args) → 응답 (ok|err, req_id, value)
+             op: turn / state / export / import / drain / stats / stop
+- 순서     : 같은 세션은 항상 같은 워커로 가고, 워커 안에서는 AppFactory.scheduler(actors.SessionScheduler)의
+             세션 mailbox로 실행된다 → 같은 세션은 순서대로, 다른 세션의 턴은 LLM 대기 동안 겹쳐 돈다
+             (워커 하나가 한 번에 한 턴만 돌면 --workers N이 동시 턴 N개로 묶인다)
+- drain    : 워커를 링에서 빼고, 처리 중인 요청(스케줄러에 들어간 턴 포함)이 끝나길 기다린 뒤 그 워커의 세션을 새 담당 워커로 옮기고 종료
+- resize   : 워커 수 변경. 링이 바뀌어 담당이 달라진 세션만 옮긴다 (일관 해시라 대략 1/N만 이동)
+             세션과 함께 메모리 히스토리 아카이브(history.HistoryArchive) 항목도 옮긴다
+- 워커 구성: WorkerConfig (pickle 가능한 설정값만) → 워커 안에서 AppFactory 생성
+- 에셋     : /assets/{rid}에는 세션이 없어 담당 워커를 고를 수 없으므로, 앞단이 같은 WorkerConfig로 만든
+             자기 AssetPrefetcher에서 준다 (워커가 scene_image_url을 바꿀 때 쓰는 해석 규칙과 같다)
+
+ShardedTurnRunner는 server.TurnRunner와 같은 인터페이스라 server.py --workers N으로 붙는다.
+벤치: python sharding.py --workers 1,2,4 --sessions 64 --turns 10 [--fake-llm-ms 50] [--mock-children]
+"""
+
+from __future__ import annotations
+import argparse, asyncio, bisect, contextlib, hashlib, itertools, multiprocessing, os, sys, threading, time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from compact_state import CompactSessions
+from server import VoteRelay
+from metrics import SHARD_WORKERS, SHARD_MIGRATIONS
+
+
+# ============================================
+# 일관 해시 링
+# ============================================
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self.nodes: List[str] = []
+        for n in nodes:
+            self.add(n)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            p = _hash(f"{node}#{i}")
+            self._owners[p] = node
+            bisect.insort(self._points, p)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: o for p, o in self._owners.items() if o != node}
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("hash ring is empty")
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+
+# ============================================
+# 워커 프로세스
+# ============================================
+@dataclass(frozen=True)
+class WorkerConfig:
+    scenes_source: str
+    start_scene: str
+    use_mock_children: bool = True
+    fake_llm_ms: Optional[float] = None     # FakeOpenAIClient 지연 (None이면 llm_client 기본 = 실제/카세트)
+    history_dir: Optional[str] = None
+    images_source: Optional[str] = None
+    image_cache_bytes: int = 64 * 1024 * 1024
+    quiet: bool = True                      # 노드 디버그 print를 버림
+
+    def build_factory(self) -> Any:
+        from main import AppFactory
+        client = None
+        if self.fake_llm_ms is not None:
+            from fake_llm import FakeOpenAIClient
+            client = FakeOpenAIClient(latency_ms=self.fake_llm_ms)
+        return AppFactory(use_mock_children=self.use_mock_children, scenes_source=self.scenes_source,
+                          openai_client=client, history_dir=self.history_dir,
+                          images_source=self.images_source, image_cache_bytes=self.image_cache_bytes)
+
+    def build_prefetcher(self) -> Any:
+        """앞단 프로세스용 (AppFactory.prefetcher와 같은 구성)"""
+        from assets import AssetPrefetcher, ByteLRU
+        from parent import ImagesRepo, load_json
+        images = ImagesRepo(load_json(self.images_source)) if self.images_source is not None else None
+        return AssetPrefetcher(images=images, cache=ByteLRU(self.image_cache_bytes))
+
+
+def render_payload(session_id: str, final: Dict[str, Any]) -> Dict[str, Any]:
+    render = final.get("render") or {"narration": "", "lines": list(final.get("agent_outputs") or []),
+                                     "choices": [], "image": None}
+    return {"type": "render", "session_id": session_id, "turn": final.get("master_turn_count"),
+            "scene": final.get("current_node"), "config_version": final.get("config_version", ""),
+            "render": render}
+
+
+def worker_main(conn: Any, name: str, cfg: WorkerConfig) -> None:
+    from server import new_graph_state
+    from voting import apply_vote_result
+
+    if cfg.quiet:
+        sys.stdout = open(os.devnull, "w")   # 턴이 여러 스레드에서 돌므로 redirect_stdout 대신 프로세스 전체로
+    factory = cfg.build_factory()
+    sessions = CompactSessions(factory.scenes_repo.symbols())
+    send_lock = threading.Lock()
+
+    def reply(status: str, rid: int, value: Any) -> None:
+        with send_lock:
+            with contextlib.suppress(OSError):
+                conn.send((status, rid, value))
+
+    def turn(sid: str, message: str, seen_turn: Optional[int], request_id: Optional[str], vote: Any) -> Dict[str, Any]:
+        # factory.scheduler 워커 스레드에서 실행. 같은 세션은 mailbox 순서대로 하나씩
+        state = sessions.get(sid) or new_graph_state(sid, cfg.start_scene)
+        state["render"] = {}
+        if vote is not None:
+            apply_vote_result(state, vote)
+        final = factory.run_turn(state, message, seen_turn, request_id)
+        value = render_payload(sid, final)
+        final["agent_outputs"] = []   # 전달한 출력은 비운다 (server.TurnRunner와 동일)
+        sessions[sid] = final
+        return value
+
+    def turn_done(rid: int, fut: Future) -> None:
+        e = fut.exception()
+        if e is None:
+            reply("ok", rid, fut.result())
+        else:
+            reply("err", rid, f"{type(e).__name__}: {e}")
+
+    def export(sids: Iterable[str]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for sid in sids:
+            st = sessions.pop(sid, None)
+            if st is None:
+                continue
+            factory.checkpoints.drop(sid)
+            out[sid] = {"state": st, "archive": factory.history_archive.export(st.get("history_refs") or [])}
+        return out
+
+    while True:
+        try:
+            op, rid, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            if op == "turn":
+                # 턴은 기다리지 않고 scheduler에 넣는다 (LLM 대기 동안 다른 세션의 턴이 돈다). 응답은 완료 콜백에서
+                sid, message, seen_turn, request_id, vote = args
+                if seen_turn is None and request_id is None:
+                    cur = sessions.session(sid)          # 제출 시점 turn (server.TurnRunner.run과 같은 규칙)
+                    seen_turn = cur["master_turn_count"] if cur is not None else 0
+                fut = factory.scheduler.submit(sid, turn, sid, message, seen_turn, request_id, vote)
+                fut.add_done_callback(lambda f, rid=rid: turn_done(rid, f))
+                continue
+            elif op == "state":
+                value = sessions.get(args)
+            elif op == "export":
+                value = export(args)
+            elif op == "import":
+                for sid, item in args.items():
+                    factory.history_archive.absorb(item.get("archive") or {})
+                    sessions[sid] = item["state"]
+                value = len(args)
+            elif op == "drain":
+                value = export(list(sessions))
+            elif op == "stats":
+                value = {"name": name, "pid": os.getpid(), "sessions": len(sessions),
+                         "scheduler": factory.scheduler.stats()}
+            elif op == "stop":
+                factory.scheduler.shutdown(wait=True)
+                reply("ok", rid, None)
+                break
+            else:
+                raise ValueError(f"unknown op: {op}")
+            reply("ok", rid, value)
+        except Exception as e:
+            reply("err", rid, f"{type(e).__name__}: {e}")
+    conn.close()
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+class _WorkerHandle:
+    def __init__(self, ctx: Any, name: str, cfg: WorkerConfig):
+        self.name = name
+        parent, child = ctx.Pipe()
+        self.conn = parent
+        self.process = ctx.Process(target=worker_main, args=(child, name, cfg), name=f"shard-{name}", daemon=True)
+        self.process.start()
+        child.close()
+        self._ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name=f"shard-{name}-reader", daemon=True)
+        self._reader.start()
+
+    def _read_loop(self) -> None:
+        while True:
+            try:
+                status, rid, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            fut = self._pending.pop(rid, None)
+            if fut is None:
+                continue
+            if status == "ok":
+                fut.set_result(value)
+            else:
+                fut.set_exception(WorkerError(f"[{self.name}] {value}"))
+        for fut in list(self._pending.values()):
+            fut.set_exception(WorkerError(f"[{self.name}] worker exited"))
+        self._pending.clear()
+
+    def call(self, op: str, args: Any = None) -> Future:
+        fut: Future = Future()
+        with self._send_lock:
+            rid = next(self._ids)
+            self._pending[rid] = fut
+            self.conn.send((op, rid, args))
+        return fut
+
+    def stop(self, timeout: float = 10.0) -> None:
+        with contextlib.suppress(Exception):
+            self.call("stop").result(timeout)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+# ============================================
+# 디스패처
+# ============================================
+class ShardedRuntime:
+    def __init__(self, config: WorkerConfig, workers: int = 2, vnodes: int = 64, start_method: str = "spawn"):
+        self.config = config
+        self.vnodes = vnodes
+        self._ctx = multiprocessing.get_context(start_method)
+        self._workers: Dict[str, _WorkerHandle] = {}
+        self._names = itertools.count()
+        self._owner: Dict[str, str] = {}          # session_id → 담당 워커 (디스패처를 거친 세션 전부)
+        self._gate = threading.Condition()
+        self._inflight = 0
+        self._paused = False
+        self.ring = HashRing(vnodes=vnodes)
+        for _ in range(workers):
+            self._spawn(self.ring)
+        SHARD_WORKERS.set(len(self._workers))
+
+    def _spawn(self, ring: HashRing) -> str:
+        name = f"w{next(self._names)}"
+        self._workers[name] = _WorkerHandle(self._ctx, name, self.config)
+        ring.add(name)
+        return name
+
+    @property
+    def workers(self) -> List[str]:
+        return list(self.ring.nodes)
+
+    # ---- 요청 ----
+    def submit(self, session_id: str, message: str, seen_turn: Optional[int] = None,
+               request_id: Optional[str] = None, vote: Any = None) -> Future:
+        with self._gate:
+            while self._paused:
+                self._gate.wait()
+            owner = self._owner[session_id] = self.ring.node_for(session_id)
+            self._inflight += 1
+        fut = self._workers[owner].call("turn", (session_id, message, seen_turn, request_id, vote))
+        fut.add_done_callback(self._done)
+        return fut
+
+    def _done(self, _fut: Future) -> None:
+        with self._gate:
+            self._inflight -= 1
+            self._gate.notify_all()
+
+    def run_turn(self, session_id: str, message: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self.submit(session_id, message).result(timeout)
+
+    def state(self, session_id: str, timeout: Optional[float] = 10.0) -> Optional[Dict[str, Any]]:
+        owner = self._owner.get(session_id)
+        return self._workers[owner].call("state", session_id).result(timeout) if owner else None
+
+    def stats(self, timeout: float = 10.0) -> List[Dict[str, Any]]:
+        return [self._workers[n].call("stats").result(timeout) for n in self.workers]
+
+    # ---- 재배치 ----
+    @contextlib.contextmanager
+    def _quiesced(self):
+        """새 요청을 막고 처리 중인 요청이 모두 끝날 때까지 대기"""
+        with self._gate:
+            self._paused = True
+            while self._inflight:
+                self._gate.wait()
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._paused = False
+                self._gate.notify_all()
+
+    def _migrate(self, new_ring: HashRing, reason: str, timeout: float) -> int:
+        moves: Dict[Tuple[str, str], List[str]] = {}
+        for sid, old in self._owner.items():
+            new = new_ring.node_for(sid)
+            if new != old:
+                moves.setdefault((old, new), []).append(sid)
+        moved = 0
+        for (old, new), sids in moves.items():
+            items = self._workers[old].call("export", sids).result(timeout)
+            if items:
+                self._workers[new].call("import", items).result(timeout)
+            for sid in sids:
+                self._owner[sid] = new
+            moved += len(items)
+        if moved:
+            SHARD_MIGRATIONS.inc(moved, reason=reason)
+        return moved
+
+    def resize(self, workers: int, timeout: float = 60.0) -> int:
+        """워커 수를 workers로. 옮긴 세션 수 반환"""
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        with self._quiesced():
+            new_ring = HashRing(self.ring.nodes, self.vnodes)
+            while len(new_ring.nodes) < workers:
+                self._spawn(new_ring)
+            retired = new_ring.nodes[workers:]
+            for name in retired:
+                new_ring.remove(name)
+            moved = self._migrate(new_ring, "resize", timeout)
+            self.ring = new_ring
+            for name in retired:
+                self._workers.pop(name).stop()
+        SHARD_WORKERS.set(len(self._workers))
+        return moved
+
+    def drain(self, name: str, timeout: float = 60.0) -> int:
+        """워커 하나를 비우고 종료 (세션은 링의 다음 담당에게)"""
+        if name not in self.ring.nodes:
+            raise KeyError(name)
+        if len(self.ring.nodes) == 1:
+            raise ValueError("cannot drain the last worker")
+        with self._quiesced():
+            new_ring = HashRing([n for n in self.ring.nodes if n != name], self.vnodes)
+            moved = self._migrate(new_ring, "drain", timeout)
+            self.ring = new_ring
+            self._workers.pop(name).stop()
+        SHARD_WORKERS.set(len(self._workers))
+        return moved
+
+    def close(self) -> None:
+        with self._quiesced():
+            for handle in self._workers.values():
+                handle.stop()
+            self._workers.clear()
+            self.ring = HashRing(vnodes=self.vnodes)
+        SHARD_WORKERS.set(0)
+
+
+# ============================================
+# server.TurnRunner 호환 어댑터
+# ============================================
+class ShardedTurnRunner(VoteRelay):
+    def __init__(self, runtime: ShardedRuntime, broadcaster: Any):
+        from voting import VoteHub
+        self.runtime = runtime
+        self.broadcaster = broadcaster
+        self.votes = VoteHub()
+        self.prefetcher = runtime.config.build_prefetcher()
+        self._init_votes()
+
+    def state(self, session_id: str) -> Dict[str, Any]:
+        return self.runtime.state(session_id) or {}
+
+    def asset(self, resource_id: str) -> Optional[bytes]:
+        return self.prefetcher.get(resource_id)
+
+    async def run(self, session_id: str, message: str, seen_turn: Optional[int] = None,
+                  request_id: Optional[str] = None, vote: Any = None) -> Dict[str, Any]:
+        payload = await asyncio.wrap_future(self.runtime.submit(session_id, message, seen_turn, request_id, vote))
+        self.broadcaster.publish(session_id, payload)
+        self._open_vote(session_id, payload["render"])
+        return payload
+
+
+# ============================================
+# 처리량 측정
+# ============================================
+def bench(cfg: WorkerConfig, workers: int, sessions: int, turns: int, messages: List[str]) -> Dict[str, Any]:
+    rt = ShardedRuntime(cfg, workers=workers)
+    try:
+        # 워커 준비(그래프 컴파일)는 측정에서 제외
+        for f in [rt.submit(f"warm-{i}", messages[0]) for i in range(workers * 4)]:
+            f.result()
+        t0 = time.perf_counter()
+        futs = [rt.submit(f"s{s}", messages[t % len(messages)]) for t in range(turns) for s in range(sessions)]
+        for f in futs:
+            f.result()
+        elapsed = time.perf_counter() - t0
+        return {"workers": workers, "turns": len(futs), "seconds": elapsed, "turns_per_sec": len(futs) / elapsed}
+    finally:
+        rt.close()
+
+
+def main(argv=None) -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description="session-sharded multi-process runtime benchmark")
+    ap.add_argument("--workers", default="1,2,4", help="쉼표로 구분한 워커 수 목록")
+    ap.add_argument("--sessions", type=int, default=64)
+    ap.add_argument("--turns", type=int, default=10)
+    ap.add_argument("--scenes", default=os.path.join(here, "config", "scenes.json"))
+    ap.add_argument("--start-scene", default="scene5_fork_decision")
+    ap.add_argument("--fake-llm-ms", type=float, default=50.0, help="FakeOpenAIClient 호출당 지연 (턴당 LLM 3회)")
+    ap.add_argument("--mock-children", action="store_true", help="Children을 LLM 없이 MockChildren으로")
+    ap.add_argument("--decision-cache", action="store_true",
+                    help="라우터/가드레일 판정 캐시를 켠다 (기본은 꺼서 세션마다 같은 입력이 캐시로 흡수되지 않게)")
+    args = ap.parse_args(argv)
+
+    if not args.decision_cache:
+        os.environ["AGENT_DECISION_CACHE_TTL"] = "0"   # spawn된 워커가 물려받는다
+    cfg = WorkerConfig(args.scenes, args.start_scene, use_mock_children=args.mock_children,
+                       fake_llm_ms=args.fake_llm_ms)
+    msgs = ["젠이츠와 이노스케를 찾아 합류시킨다", "이노스케 설득 시도", "젠이츠 설득 시도", "판정으로 이동한다"]
+    base = None
+    print(f"cpu={os.cpu_count()} sessions={args.sessions} turns/session={args.turns} "
+          f"llm={args.fake_llm_ms}ms children={'mock' if args.mock_children else 'llm'}")
+    for n in (int(x) for x in args.workers.split(",")):
+        r = bench(cfg, n, args.sessions, args.turns, msgs)
+        base = base or r["turns_per_sec"]
+        print(f"workers={n:2d}  {r['turns_per_sec']:8.1f} turns/s  x{r['turns_per_sec'] / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# simulator.py
+"""
+씬 그래프 세션 시뮬레이터 / 부하 생성기
+
+config/scenes.json 위에서 ParentAgent(+MockChildren 또는 지연 주입 가짜 LLM)로
+합성 세션 수천 개를 끝까지 진행시키고 다음을 보고한다.
+- 처리량(세션/s, 턴/s), 턴·세션 지연 분포
+- 엔딩 분포(hidden / original / ...)
+- 정적으로 도달 불가능한 씬, 시뮬레이션에서 한 번도 방문되지 않은 씬
+- 세션이 갇히는 씬(stuck: 선택이 분기로 이어지지 않아 진행이 멈춘 씬)
+
+선택 정책: random / weighted / exhaustive(상태 공간을 BFS로 전부 열거해 경로별 1세션)
+실행기   : sync / asyncio(스레드 풀 위에서 동시 진행) / process(코어 수만큼 프로세스)
+
+사용: python simulator.py --sessions 2000 --policy random --runner process --llm mock
+"""
+
+from __future__ import annotations
+import argparse, asyncio, json, os, random, time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from benchlib import percentile, summarize, write_results
+from children import ChildrenBase, MockChildren, OpenAIChildren
+from parent import ParentAgent, ScenesRepo, load_json, _iso_now, eval_split_rules
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENES_PATH = os.path.join(HERE, "config", "scenes.json")
+DEFAULT_START = "scene5_intro_post_enmu"
+
+# 미션 씬에서 선택값 → (설득 대상 캐릭터)
+MISSION_ACTIONS = {"try_inosuke": "inosuke", "try_zenitsu": "zenitsu"}
+
+
+# ============================================
+# Children 래퍼: 미션 선택의 효과(state_patch)를 흉내
+# ============================================
+class SimChildren(ChildrenBase):
+    """
+    inner(MockChildren 또는 OpenAIChildren+FakeOpenAIClient)의 출력에
+    미션 설득 선택의 효과를 덧붙인다: 턴 소모 + recruit_prob 확률로 동료 합류.
+    실제 Children LLM이 돌려줄 state_patch를 대신하는 용도.
+    """
+    def __init__(self, inner: ChildrenBase, rng: random.Random, recruit_prob: float = 0.6):
+        self.inner = inner
+        self.rng = rng
+        self.recruit_prob = recruit_prob
+
+    def __call__(self, prompt_json_str: str) -> str:
+        out = json.loads(self.inner(prompt_json_str))
+        req = json.loads(prompt_json_str)
+        target = MISSION_ACTIONS.get((req.get("router_hint") or {}).get("value"))
+        if target:
+            patch = out.setdefault("state_patch", {})
+            patch["total_turns_used"] = {"$inc": 1}
+            patch["character_turns_used"] = {target: {"$inc": 1}}
+            if self.rng.random() < self.recruit_prob:
+                patch["allies"] = {target: True}
+        return json.dumps(out, ensure_ascii=False)
+
+
+def make_children(llm: str, rng: random.Random, latency_ms: float, recruit_prob: float) -> ChildrenBase:
+    if llm == "fake":
+        from fake_llm import FakeOpenAIClient
+        inner: ChildrenBase = OpenAIChildren(client=FakeOpenAIClient(latency_ms=latency_ms,
+                                                                     jitter_ms=latency_ms * 0.3,
+                                                                     seed=rng.randrange(1 << 30)),
+                                             model="fake")
+    else:
+        inner = MockChildren()
+    return SimChildren(inner, rng, recruit_prob)
+
+
+# ============================================
+# 선택 정책
+# ============================================
+def _choice_values(scene_def: dict) -> List[str]:
+    vals = [c.get("value") for c in scene_def.get("choices", []) if c.get("value")]
+    if not vals:
+        # 선택지가 없는 씬: split_rules의 when 값으로 자동 진행을 시도 ("" 포함)
+        vals = list(dict.fromkeys(r.get("when", "") for r in scene_def.get("split_rules", [])))
+    return vals
+
+
+class RandomPolicy:
+    name = "random"
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def choose(self, scene_id: str, scene_def: dict, state: dict) -> Optional[str]:
+        vals = _choice_values(scene_def)
+        return self.rng.choice(vals) if vals else None
+
+
+class WeightedPolicy:
+    """weights: {value: w} 또는 {"scene_id:value": w}. 없으면 1.0"""
+    name = "weighted"
+
+    def __init__(self, rng: random.Random, weights: Dict[str, float]):
+        self.rng = rng
+        self.weights = weights
+
+    def choose(self, scene_id: str, scene_def: dict, state: dict) -> Optional[str]:
+        vals = _choice_values(scene_def)
+        if not vals:
+            return None
+        ws = [self.weights.get(f"{scene_id}:{v}", self.weights.get(v, 1.0)) for v in vals]
+        if sum(ws) <= 0:
+            return self.rng.choice(vals)
+        return self.rng.choices(vals, weights=ws, k=1)[0]
+
+
+class ScriptedPolicy:
+    """exhaustive 열거 결과(선택값 시퀀스)를 그대로 재생"""
+    name = "exhaustive"
+
+    def __init__(self, script: Sequence[str]):
+        self.script = deque(script)
+
+    def choose(self, scene_id: str, scene_def: dict, state: dict) -> Optional[str]:
+        return self.script.popleft() if self.script else None
+
+
+# ============================================
+# 세션 실행
+# ============================================
+@dataclass
+class SessionResult:
+    index: int
+    ending: str
+    final_scene: str
+    turns: int
+    stuck_scene: Optional[str] = None
+    stuck_reason: Optional[str] = None
+    error: Optional[str] = None
+    step_latencies: List[float] = field(default_factory=list)
+    duration: float = 0.0
+    visited: List[str] = field(default_factory=list)
+
+
+def initial_state(start: str, index: int) -> Dict[str, Any]:
+    return {
+        "scene": {"current_scene": start},
+        "turn": 0, "total_turns_used": 0, "character_turns_used": {},
+        "allies": {"inosuke": False, "zenitsu": False},
+        "affinity": {"tanjiro": 500}, "flags": [],
+        "ending": "", "end_reason": "", "user_choice": None,
+        "last_user_msg": "", "scene_history": [], "updated_at": _iso_now(),
+        "user_id": f"sim{index}", "session_id": f"sim-{index}", "scenario_id": "cutscene5_akaza",
+    }
+
+
+def is_terminal(scene_def: dict) -> bool:
+    return not scene_def.get("choices") and not scene_def.get("split_rules")
+
+
+def classify_ending(state: dict, scene_id: str) -> str:
+    ending = state.get("ending") or ""
+    if ending:
+        return ending.split(":", 1)[0]
+    for kind in ("hidden", "original"):
+        if kind in scene_id:
+            return kind
+    return "none"
+
+
+def _envelope(state: dict, value: Optional[str], scene_def: dict) -> Dict[str, Any]:
+    text = next((c.get("text", "") for c in scene_def.get("choices", []) if c.get("value") == value), value or "")
+    env: Dict[str, Any] = {
+        "session_id": state["session_id"], "turn": state.get("turn", 0),
+        "user_msg_raw": text,
+        "guardrail": {"allowed": True, "sanitized_user_msg": text},
+    }
+    if value is not None:
+        env["router_choice_hint"] = {"value": value, "confidence": 1.0}
+    return env
+
+
+def run_session(index: int, parent: ParentAgent, policy: Any, start: str,
+                max_turns: int, stuck_patience: int) -> SessionResult:
+    """
+    세션 하나를 종료 씬까지 진행. 종료 못 하면 stuck_reason 기록:
+    - no_progress : stuck_patience 턴 연속으로 선택이 분기로 이어지지 않음
+    - max_turns   : 턴 한도(또는 exhaustive 스크립트 길이) 소진
+    - error       : ParentAgent.step 예외 (검증 실패 등)
+    """
+    state = initial_state(start, index)
+    res = SessionResult(index=index, ending="none", final_scene=start, turns=0)
+    idle = 0
+    t_session = time.perf_counter()
+    while True:
+        scene_id = state["scene"]["current_scene"]
+        scene_def = parent.scenes.get_scene(scene_id)
+        res.visited.append(scene_id)
+        if is_terminal(scene_def):
+            break
+        value = policy.choose(scene_id, scene_def, state) if res.turns < max_turns else None
+        if value is None and (res.turns >= max_turns or isinstance(policy, ScriptedPolicy)):
+            res.stuck_scene, res.stuck_reason = scene_id, "max_turns"
+            break
+        state["user_choice"] = None
+        t0 = time.perf_counter()
+        try:
+            out = parent.step(state, _envelope(state, value, scene_def))
+        except Exception as e:
+            res.error = f"{scene_id}: {type(e).__name__}: {e}"
+            res.stuck_scene, res.stuck_reason = scene_id, "error"
+            break
+        res.step_latencies.append(time.perf_counter() - t0)
+        res.turns += 1
+        state = out["state"]
+        # 선택이 split_rules로 이어졌는지(user_choice가 세팅됐는지)로 진행 여부 판단
+        idle = 0 if state.get("user_choice") is not None else idle + 1
+        if idle >= stuck_patience:
+            res.stuck_scene, res.stuck_reason = scene_id, "no_progress"
+            break
+    res.final_scene = state["scene"]["current_scene"]
+    res.ending = classify_ending(state, res.final_scene) if is_terminal(parent.scenes.get_scene(res.final_scene)) else "none"
+    res.duration = time.perf_counter() - t_session
+    return res
+
+
+# ============================================
+# exhaustive: 상태 공간 BFS
+# ============================================
+def _fingerprint(state: dict) -> Tuple:
+    return (state["scene"]["current_scene"], tuple(sorted(state.get("flags", []))),
+            tuple(sorted((state.get("character_turns_used") or {}).items())),
+            int(state.get("total_turns_used", 0)))
+
+
+def enumerate_paths(scenes: ScenesRepo, start: str, max_turns: int, limit: int = 100_000) -> List[List[str]]:
+    """
+    결정적 Children(항상 합류)으로 가능한 모든 선택 시퀀스를 BFS.
+    같은 상태(fingerprint)는 한 번만 확장하고, 종료/정지 상태마다 대표 경로 1개를 반환.
+    """
+    parent = ParentAgent(scenes=scenes, llm=SimChildren(MockChildren(), random.Random(0), recruit_prob=1.0))
+    seen = set()
+    q = deque([(initial_state(start, 0), [])])
+    paths: List[List[str]] = []
+    while q and len(paths) < limit:
+        state, path = q.popleft()
+        fp = _fingerprint(state)
+        if fp in seen:
+            continue
+        seen.add(fp)
+        scene_id = state["scene"]["current_scene"]
+        scene_def = scenes.get_scene(scene_id)
+        if is_terminal(scene_def) or len(path) >= max_turns:
+            paths.append(path)
+            continue
+        progressed = False
+        for value in _choice_values(scene_def):
+            st = {**state, "user_choice": None}
+            if eval_split_rules(scene_def, st, value) is None:
+                continue
+            try:
+                out = parent.step(st, _envelope(st, value, scene_def))
+            except Exception:
+                continue
+            if out["state"].get("user_choice") is None:
+                continue
+            progressed = True
+            q.append((out["state"], path + [value]))
+        if not progressed:
+            paths.append(path + [_choice_values(scene_def)[0]] if _choice_values(scene_def) else path)
+    return paths
+
+
+def static_reachable(scenes_data: dict, start: str) -> set:
+    seen, q = {start}, deque([start])
+    while q:
+        sid = q.popleft()
+        for r in scenes_data.get(sid, {}).get("split_rules", []):
+            g = r.get("goto")
+            if g and g not in seen:
+                seen.add(g)
+                q.append(g)
+    return seen
+
+
+# ============================================
+# 러너
+# ============================================
+@dataclass
+class SimConfig:
+    sessions: int = 1000
+    policy: str = "random"
+    weights: Dict[str, float] = field(default_factory=dict)
+    llm: str = "mock"
+    latency_ms: float = 0.0
+    recruit_prob: float = 0.6
+    start: str = DEFAULT_START
+    max_turns: int = 40
+    stuck_patience: int = 3
+    seed: int = 0
+    scenes_path: str = SCENES_PATH
+
+
+def _make_policy(cfg: SimConfig, rng: random.Random, script: Optional[Sequence[str]]):
+    if script is not None:
+        return ScriptedPolicy(script)
+    if cfg.policy == "weighted":
+        return WeightedPolicy(rng, cfg.weights)
+    return RandomPolicy(rng)
+
+
+def _run_one(cfg: SimConfig, scenes: ScenesRepo, index: int, script: Optional[Sequence[str]]) -> SessionResult:
+    rng = random.Random(cfg.seed * 1_000_003 + index)
+    parent = ParentAgent(scenes=scenes, llm=make_children(cfg.llm, rng, cfg.latency_ms, cfg.recruit_prob))
+    return run_session(index, parent, _make_policy(cfg, rng, script), cfg.start, cfg.max_turns, cfg.stuck_patience)
+
+
+def _run_chunk(cfg: SimConfig, indices: List[int], scripts: Optional[List[List[str]]]) -> List[SessionResult]:
+    # 프로세스 워커: Repo는 워커마다 1번만 로드
+    scenes = ScenesRepo(load_json(cfg.scenes_path))
+    return [_run_one(cfg, scenes, i, scripts[i] if scripts else None) for i in indices]
+
+
+def run_sync(cfg: SimConfig, scripts=None) -> List[SessionResult]:
+    return _run_chunk(cfg, list(range(cfg.sessions)), scripts)
+
+
+def run_asyncio(cfg: SimConfig, concurrency: int, scripts=None) -> List[SessionResult]:
+    """LLM 지연(I/O 대기)이 지배적인 경우: 세션들을 스레드 풀 위에서 동시에 진행"""
+    scenes = ScenesRepo(load_json(cfg.scenes_path))
+
+    async def _main():
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            async def one(i):
+                async with sem:
+                    return await loop.run_in_executor(pool, _run_one, cfg, scenes, i, scripts[i] if scripts else None)
+            return await asyncio.gather(*(one(i) for i in range(cfg.sessions)))
+
+    return list(asyncio.run(_main()))
+
+
+def run_processes(cfg: SimConfig, workers: int, scripts=None) -> List[SessionResult]:
+    """CPU 바운드(MockChildren)인 경우: 세션을 코어 수만큼 프로세스에 나눠 실행"""
+    idx = list(range(cfg.sessions))
+    chunk = max(1, (len(idx) + workers * 4 - 1) // (workers * 4))
+    chunks = [idx[i:i + chunk] for i in range(0, len(idx), chunk)]
+    out: List[SessionResult] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for res in pool.map(_run_chunk, [cfg] * len(chunks), chunks, [scripts] * len(chunks)):
+            out.extend(res)
+    return out
+
+
+# ============================================
+# 리포트
+# ============================================
+def _count_stats(vals: List[int]) -> Dict[str, float]:
+    vals = sorted(vals)
+    if not vals:
+        return {"n": 0}
+    return {"n": len(vals), "mean": sum(vals) / len(vals), "p50": percentile(vals, 50),
+            "p95": percentile(vals, 95), "max": vals[-1]}
+
+
+def build_report(cfg: SimConfig, results: List[SessionResult], wall: float) -> Dict[str, Any]:
+    data = load_json(cfg.scenes_path)
+    reachable = static_reachable(data, cfg.start)
+    visited = set()
+    for r in results:
+        visited.update(r.visited)
+    step_lat = [x for r in results for x in r.step_latencies]
+    turns = sum(r.turns for r in results)
+    return {
+        "config": {k: v for k, v in cfg.__dict__.items() if k != "weights"} | {"weights": cfg.weights},
+        "sessions": len(results),
+        "wall_sec": wall,
+        "throughput": {"sessions_per_sec": len(results) / wall if wall else 0.0,
+                       "turns_per_sec": turns / wall if wall else 0.0},
+        "step_latency": summarize(step_lat),
+        "session_latency": summarize([r.duration for r in results]),
+        "turns_per_session": _count_stats([r.turns for r in results]),
+        "endings": dict(Counter(r.ending for r in results)),
+        "final_scenes": dict(Counter(r.final_scene for r in results)),
+        "stuck_scenes": {reason: dict(Counter(r.stuck_scene for r in results if r.stuck_reason == reason))
+                         for reason in sorted({r.stuck_reason for r in results if r.stuck_reason})},
+        "errors": dict(Counter(r.error for r in results if r.error).most_common(10)),
+        "unreachable_scenes": sorted(set(data) - reachable),
+        "never_visited_scenes": sorted(reachable - visited),
+    }
+
+
+def simulate(cfg: SimConfig, runner: str = "sync", workers: int = 0) -> Dict[str, Any]:
+    scripts = None
+    if cfg.policy == "exhaustive":
+        scripts = enumerate_paths(ScenesRepo(load_json(cfg.scenes_path)), cfg.start, cfg.max_turns)
+        cfg.sessions = len(scripts)
+        cfg.recruit_prob = 1.0
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    if runner == "process":
+        results = run_processes(cfg, workers, scripts)
+    elif runner == "asyncio":
+        results = run_asyncio(cfg, max(workers, 32), scripts)
+    else:
+        results = run_sync(cfg, scripts)
+    return build_report(cfg, results, time.perf_counter() - t0)
+
+
+def main(argv=None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description="scene-graph session simulator")
+    ap.add_argument("--sessions", type=int, default=1000)
+    ap.add_argument("--policy", choices=["random", "weighted", "exhaustive"], default="random")
+    ap.add_argument("--weights", default="{}", help='JSON, 예: {"gather_allies": 3, "scene5_mission_gather:finish": 0.2}')
+    ap.add_argument("--runner", choices=["sync", "asyncio", "process"], default="sync")
+    ap.add_argument("--workers", type=int, default=0, help="process: 프로세스 수 / asyncio: 동시 세션 수 (기본 CPU 수)")
+    ap.add_argument("--llm", choices=["mock", "fake"], default="mock")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="--llm fake의 호출당 지연")
+    ap.add_argument("--recruit-prob", type=float, default=0.6)
+    ap.add_argument("--start", default=DEFAULT_START)
+    ap.add_argument("--max-turns", type=int, default=40)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=None, help="결과 JSON 경로 (기본: bench_results/simulator-<commit>.json)")
+    args = ap.parse_args(argv)
+
+    cfg = SimConfig(sessions=args.sessions, policy=args.policy, weights=json.loads(args.weights),
+                    llm=args.llm, latency_ms=args.latency_ms, recruit_prob=args.recruit_prob,
+                    start=args.start, max_turns=args.max_turns, seed=args.seed)
+    report = simulate(cfg, args.runner, args.workers)
+    path = write_results("simulator", report, args.out)
+
+    print(f"sessions={report['sessions']} wall={report['wall_sec']:.2f}s "
+          f"→ {report['throughput']['sessions_per_sec']:.0f} sessions/s, {report['throughput']['turns_per_sec']:.0f} turns/s")
+    print(f"step p50={report['step_latency'].get('p50_ms', 0):.3f}ms p99={report['step_latency'].get('p99_ms', 0):.3f}ms")
+    print(f"endings: {report['endings']}")
+    if report["stuck_scenes"]:
+        print(f"⚠ stuck scenes: {report['stuck_scenes']}")
+    if report["unreachable_scenes"]:
+        print(f"⚠ unreachable scenes: {report['unreachable_scenes']}")
+    if report["never_visited_scenes"]:
+        print(f"· never visited: {report['never_visited_scenes']}")
+    print(f"→ {path}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# speculation.py
+"""
+다음 턴 Children 출력 선행 생성(speculation)
+
+플레이어가 현재 씬을 읽는 동안, 다음 턴에 고를 법한 선택지 top-k에 대해
+build_prompt + Children 호출을 미리 돌려 둔다.
+
+- 후보  : 다음 턴 씬의 choices 중 split_rules 분기가 실제로 성립하는 값
+- 순위  : hint(예: 진행 중 투표 집계) 가중치 → 씬별 과거 선택 빈도 → 선언 순서
+- 예산  : 세션당 top_k개, 전체 동시 실행은 스레드 풀 크기(max_workers)로 제한
+- 키    : (session_id, turn, scene, choice, state_digest)
+          state_digest는 build_prompt가 읽는 필드(affinity/allies/flags)의 해시 → 상태가 달라졌으면 미스
+- take(): 키가 맞으면 그 결과를 돌려주고 같은 세션의 나머지는 취소.
+          아직 실행 중이면 기다린다(새로 호출하는 것보다 먼저 시작했으므로).
+
+선행 프롬프트의 user_msg/router_hint는 "그 선택지를 골랐다"는 정규형으로 채운다.
+실제 문장과는 다를 수 있지만, 결과는 일반 경로와 똑같이 ParentAgent 검증을 거친다.
+"""
+
+from __future__ import annotations
+import hashlib, json, threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import SPECULATIONS
+
+SpecKey = Tuple[str, int, str, str, str]
+
+
+def state_digest(state: Dict[str, Any]) -> str:
+    view = {
+        "affinity": state.get("affinity", {}) or {},
+        "allies": state.get("allies", {}) or {},
+        "flags": sorted(state.get("flags", []) or []),
+    }
+    return hashlib.sha1(json.dumps(view, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def spec_key(state: Dict[str, Any], choice: str) -> SpecKey:
+    return (str(state.get("session_id", "")), int(state.get("turn", 0) or 0),
+            (state.get("scene") or {}).get("current_scene", ""), choice, state_digest(state))
+
+
+def speculative_envelope(state: Dict[str, Any], choice_def: Dict[str, Any]) -> Dict[str, Any]:
+    text = choice_def.get("text") or choice_def.get("value", "")
+    return {
+        "session_id": state.get("session_id", ""), "turn": state.get("turn", 0),
+        "user_msg_raw": text,
+        "recent_messages": [{"role": "user", "content": text}],
+        "router_choice_hint": {"value": choice_def.get("value"), "confidence": 1.0, "source": "speculation"},
+        "guardrail": {"allowed": True, "sanitized_user_msg": text},
+    }
+
+
+class Speculator:
+    def __init__(self, top_k: int = 2, max_workers: int = 4, wait_timeout: float = 30.0):
+        self.top_k = top_k
+        self.wait_timeout = wait_timeout
+        self._max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[SpecKey, Future]] = {}   # session_id → {key: future}
+        self._freq: Dict[str, Counter] = {}                     # scene_id → Counter(choice)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="speculate")
+        return self._pool
+
+    # ---- 순위 ----
+    def record(self, scene_id: str, choice: str) -> None:
+        with self._lock:
+            self._freq.setdefault(scene_id, Counter())[choice] += 1
+
+    def rank(self, agent: Any, state: Dict[str, Any], hint: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        scene_id = (state.get("scene") or {}).get("current_scene", "")
+        rules = agent.scenes.compiled(scene_id)
+        flags = set(state.get("flags", []))
+        choices = [c for c in agent.scenes.get_scene(scene_id).get("choices", []) or []
+                   if c.get("value") and rules.branch(state, c["value"], flags) is not None]
+        freq = self._freq.get(scene_id, Counter())
+        hint = hint or {}
+        order = {c["value"]: i for i, c in enumerate(choices)}
+        return sorted(choices, key=lambda c: (-hint.get(c["value"], 0.0), -freq[c["value"]], order[c["value"]]))
+
+    # ---- 예약 / 취소 ----
+    def schedule(self, agent: Any, state: Dict[str, Any], hint: Optional[Dict[str, float]] = None) -> List[SpecKey]:
+        """state(다음 step의 입력이 될 상태) 기준으로 top-k 선택지를 미리 생성"""
+        sid = str(state.get("session_id", ""))
+        self.cancel_session(sid)
+        keys: List[SpecKey] = []
+        pool = self._executor()
+        jobs: Dict[SpecKey, Future] = {}
+        for choice_def in self.rank(agent, state, hint)[: self.top_k]:
+            key = spec_key(state, choice_def["value"])
+            prompt = agent.build_prompt(state, speculative_envelope(state, choice_def))
+            jobs[key] = pool.submit(agent.llm, prompt)
+            keys.append(key)
+        if jobs:
+            with self._lock:
+                self._pending[sid] = jobs
+            SPECULATIONS.inc(len(jobs), outcome="scheduled")
+        return keys
+
+    def cancel_session(self, session_id: str, keep: Optional[Future] = None) -> None:
+        with self._lock:
+            jobs = self._pending.pop(session_id, None)
+        for fut in (jobs or {}).values():
+            if fut is keep:
+                continue
+            # 이미 실행 중이면 취소되지 않는다 → 결과는 버려짐
+            SPECULATIONS.inc(outcome="cancelled" if fut.cancel() else "wasted")
+
+    # ---- 사용 ----
+    def take(self, state: Dict[str, Any], choice: Optional[str]) -> Optional[str]:
+        """맞는 선행 결과가 있으면 Children 원문(JSON 문자열)을, 없으면 None"""
+        sid = str(state.get("session_id", ""))
+        with self._lock:
+            jobs = self._pending.get(sid)
+        if not jobs:
+            return None
+        fut = jobs.get(spec_key(state, choice)) if choice else None
+        self.cancel_session(sid, keep=fut)
+        if fut is None:
+            SPECULATIONS.inc(outcome="miss")
+            return None
+        try:
+            raw = fut.result(self.wait_timeout)
+        except Exception:  # 취소(CancelledError)·타임아웃·Children 예외
+            SPECULATIONS.inc(outcome="error")
+            return None
+        SPECULATIONS.inc(outcome="hit")
+        return raw
+
+    def close(self) -> None:
+        with self._lock:
+            sessions = list(self._pending)
+        for sid in sessions:
+            self.cancel_session(sid)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,284 @@
+# tracing.py
+"""
+턴/노드 단위 구조화 트레이싱
+
+- trace : 한 턴(app.invoke 1회). 시작 시 샘플링 여부를 한 번 결정
+- span  : 그래프 노드 1회 실행. duration, LLM 지연/토큰, 작은 state diff 기록
+- event : debug 레벨에서만 남기는 보조 기록 (예전 pretty_print 자리)
+
+레벨: off < info(span만) < debug(span + event)
+설정(환경변수): AGENT_TRACE_LEVEL, AGENT_TRACE_SAMPLE(0~1), AGENT_TRACE_FILE(JSONL 경로)
+
+state diff는 바뀐 키만, 리스트는 길이와 마지막 원소만 남기므로
+user_history가 길어져도 턴당 직렬화 비용은 일정하다.
+"""
+
+from __future__ import annotations
+import contextlib, contextvars, functools, json, os, random, threading, time, uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+LEVELS = {"off": 0, "info": 1, "debug": 2}
+
+DEFAULT_TRACE_FILE = os.path.join(os.path.dirname(__file__), "traces", "trace.jsonl")
+
+_MAX_REPR = 120
+
+
+def _short(v: Any) -> Any:
+    """diff/event에 넣을 값 축약: 긴 문자열 자르기, 컨테이너는 크기 위주로."""
+    if isinstance(v, str):
+        return v if len(v) <= _MAX_REPR else v[:_MAX_REPR] + "…"
+    if isinstance(v, (int, float, bool)) or v is None:
+        return v
+    if isinstance(v, (list, tuple)):
+        return {"len": len(v), "last": _short(v[-1]) if v else None}
+    if isinstance(v, dict):
+        if len(v) <= 8 and all(isinstance(x, (int, float, bool, str)) or x is None for x in v.values()):
+            return {k: _short(x) for k, x in v.items()}
+        return {"keys": len(v)}
+    return _short(repr(v))
+
+
+@dataclass(frozen=True)
+class _ListSnap:
+    length: int
+    last: Any
+
+
+def snapshot(state: Dict[str, Any]) -> Dict[str, Any]:
+    """diff 기준점: 최상위 키만 복사하고 리스트는 (길이, 마지막 원소)로 대체 — O(키 개수)"""
+    return {k: _ListSnap(len(v), v[-1] if v else None) if isinstance(v, list) else v
+            for k, v in state.items()}
+
+
+def state_diff(before: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """노드가 반환한 update 중 실제로 바뀐 키만 축약해서 반환. before는 snapshot() 결과."""
+    diff: Dict[str, Any] = {}
+    if not isinstance(update, dict):
+        return diff
+    for k, new in update.items():
+        old = before.get(k) if isinstance(before, dict) else None
+        if isinstance(old, _ListSnap) and isinstance(new, list):
+            if old.length != len(new) or (new and old.last is not new[-1]):
+                diff[k] = _short(new)
+            continue
+        if old is new:
+            continue
+        if isinstance(old, dict) and isinstance(new, dict):
+            changed = {kk: _short(vv) for kk, vv in new.items() if old.get(kk) != vv}
+            if changed:
+                diff[k] = changed if len(changed) <= 8 else {"changed_keys": len(changed)}
+            continue
+        if old != new:
+            diff[k] = _short(new)
+    return diff
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    duration_ms: float = 0.0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    llm_calls: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_record(self) -> Dict[str, Any]:
+        rec = {
+            "kind": "span", "name": self.name, "trace_id": self.trace_id,
+            "span_id": self.span_id, "parent_id": self.parent_id,
+            "ts": self.start, "duration_ms": round(self.duration_ms, 3),
+        }
+        if self.llm_calls:
+            rec["llm"] = {
+                "calls": len(self.llm_calls),
+                "latency_ms": round(sum(c["latency_ms"] for c in self.llm_calls), 3),
+                "prompt_tokens": sum(c.get("prompt_tokens") or 0 for c in self.llm_calls),
+                "completion_tokens": sum(c.get("completion_tokens") or 0 for c in self.llm_calls),
+                "models": sorted({c.get("model") or "?" for c in self.llm_calls}),
+            }
+        if self.attrs:
+            rec["attrs"] = self.attrs
+        return rec
+
+
+@dataclass
+class _TraceCtx:
+    trace_id: str
+    sampled: bool
+
+
+# ------------------------------
+# Exporters
+# ------------------------------
+class FileExporter:
+    """JSONL 파일에 한 줄씩 추가. 여러 스레드에서 호출해도 안전."""
+
+    def __init__(self, path: str = DEFAULT_TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class ConsoleExporter:
+    """디버깅용: 레코드 한 건을 한 줄로 출력."""
+
+    def export(self, record: Dict[str, Any]) -> None:
+        if record.get("kind") == "span":
+            llm = record.get("llm") or {}
+            print(f"[trace] {record['name']} {record['duration_ms']:.1f}ms"
+                  + (f" llm={llm['calls']}x/{llm['latency_ms']:.0f}ms tok={llm['prompt_tokens']}+{llm['completion_tokens']}" if llm else "")
+                  + (f" diff={json.dumps(record.get('attrs', {}).get('diff', {}), ensure_ascii=False, default=str)}"
+                     if record.get("attrs", {}).get("diff") else ""))
+        else:
+            print(f"[trace] · {record.get('name')} {json.dumps(record.get('attrs', {}), ensure_ascii=False, default=str)}")
+
+
+class MemoryExporter:
+    """테스트/벤치마크용: 레코드를 리스트에 보관."""
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+
+    def export(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+
+
+# ------------------------------
+# Tracer
+# ------------------------------
+_trace_var: contextvars.ContextVar[Optional[_TraceCtx]] = contextvars.ContextVar("agent_trace", default=None)
+_span_var: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("agent_span", default=None)
+
+
+class Tracer:
+    def __init__(self, level: str = "off", sample_rate: float = 1.0, exporter: Any = None):
+        if level not in LEVELS:
+            raise ValueError(f"unknown trace level: {level}")
+        self.level = level
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def enabled(self, level: str = "info") -> bool:
+        return self.exporter is not None and LEVELS[self.level] >= LEVELS[level]
+
+    def _sampled(self) -> bool:
+        ctx = _trace_var.get()
+        if ctx is not None:
+            return ctx.sampled
+        return random.random() < self.sample_rate
+
+    @contextlib.contextmanager
+    def trace(self, **attrs: Any) -> Iterator[Optional[_TraceCtx]]:
+        """한 턴의 루트. 샘플링은 여기서 한 번만 결정해 하위 span 전체에 적용."""
+        if not self.enabled():
+            yield None
+            return
+        ctx = _TraceCtx(trace_id=uuid.uuid4().hex, sampled=random.random() < self.sample_rate)
+        token = _trace_var.set(ctx)
+        try:
+            with self.span("turn", **attrs):
+                yield ctx
+        finally:
+            _trace_var.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+        if not self.enabled() or not self._sampled():
+            yield None
+            return
+        ctx = _trace_var.get()
+        parent = _span_var.get()
+        sp = Span(name=name, trace_id=ctx.trace_id if ctx else uuid.uuid4().hex,
+                  parent_id=parent.span_id if parent else None, attrs=dict(attrs))
+        token = _span_var.set(sp)
+        t0 = time.perf_counter()
+        try:
+            yield sp
+        except Exception as e:
+            sp.attrs["error"] = _short(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            sp.duration_ms = (time.perf_counter() - t0) * 1000.0
+            _span_var.reset(token)
+            self.exporter.export(sp.to_record())
+
+    def node(self, name: str) -> Callable[[Callable], Callable]:
+        """그래프 노드 데코레이터: span + 반환 update의 state diff 기록"""
+        def deco(fn: Callable[[Dict[str, Any]], Dict[str, Any]]):
+            @functools.wraps(fn)
+            def wrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+                if not self.enabled():
+                    return fn(state)
+                # 노드가 state를 제자리 수정할 수 있으므로 diff 기준점을 먼저 잡아 둔다
+                before = snapshot(state) if isinstance(state, dict) else {}
+                with self.span(name) as sp:
+                    update = fn(state)
+                    if sp is not None:
+                        diff = state_diff(before, update)
+                        if diff:
+                            sp.attrs["diff"] = diff
+                    return update
+            return wrapper
+        return deco
+
+    def event(self, name: str, level: str = "debug", **attrs: Any) -> None:
+        if not self.enabled(level) or not self._sampled():
+            return
+        ctx = _trace_var.get()
+        parent = _span_var.get()
+        self.exporter.export({
+            "kind": "event", "name": name, "ts": time.time(),
+            "trace_id": ctx.trace_id if ctx else None,
+            "span_id": parent.span_id if parent else None,
+            "attrs": {k: _short(v) for k, v in attrs.items()},
+        })
+
+
+def record_llm(model: Optional[str], latency_sec: float, usage: Any = None) -> None:
+    """현재 span에 LLM 호출 1건을 기록 (span이 없으면 무시). usage는 OpenAI 응답의 usage 객체."""
+    sp = _span_var.get()
+    if sp is None:
+        return
+    sp.llm_calls.append({
+        "model": model,
+        "latency_ms": latency_sec * 1000.0,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+    })
+
+
+# ------------------------------
+# 전역 트레이서 (환경변수로 설정)
+# ------------------------------
+_tracer: Optional[Tracer] = None
+
+
+def tracer_from_env() -> Tracer:
+    level = os.getenv("AGENT_TRACE_LEVEL", "off").lower()
+    sample = float(os.getenv("AGENT_TRACE_SAMPLE", "1.0"))
+    target = os.getenv("AGENT_TRACE_FILE", DEFAULT_TRACE_FILE)
+    exporter = None
+    if level != "off":
+        exporter = ConsoleExporter() if target == "-" else FileExporter(target)
+    return Tracer(level=level, sample_rate=sample, exporter=exporter)
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = tracer_from_env()
+    return _tracer
+
+
+def set_tracer(tracer: Optional[Tracer]) -> None:
+    global _tracer
+    _tracer = tracer
@@ -0,0 +1,245 @@
+# voting.py
+"""
+다중 시청자 투표 집계
+
+한 세션(씬)의 선택지에 수백 명이 투표하는 상황을 위한 집계기.
+GraphState.user_votes처럼 유저별 dict를 상태에 쌓고 읽을 때마다 세는 대신,
+- VoteRound : 샤드별 카운터. user_id 해시로 샤드를 고르고, 중복 확인 + 증가를 그 샤드 락 안에서 처리
+              → 서로 다른 샤드의 투표는 경합하지 않는다 (전역 락 없음)
+- 시간 창   : opened_at ~ opened_at + window_sec 안의 투표만 인정 (늦은 표는 "late")
+- 중복 제거 : dedup="first"(첫 표 고정) / "last"(마지막 표로 변경)
+- 조기 종료 : expected_voters를 알면, 남은 표가 모두 2위에 가도 1위가 바뀌지 않는 순간 마감
+              (표 변경이 가능한 "last" 모드에서는 조기 종료하지 않음)
+- 결과      : VoteResult.as_choice_hint() → ParentAgent가 그대로 받는 router_choice_hint
+
+집계 읽기(tally)는 락 없이 샤드 카운터를 더한다. 동시에 들어오는 표 때문에 약간 덜 센 값이 나올 수는
+있지만, 덜 센 표는 "남은 표"로 계산되므로 조기 종료 판정은 항상 보수적이다.
+"""
+
+from __future__ import annotations
+import threading, time, zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from metrics import VOTES, VOTE_ROUNDS, VOTE_ROUND_SECONDS
+
+DEDUP_POLICIES = ("first", "last")
+
+
+class _Shard:
+    __slots__ = ("lock", "counts", "voters")
+
+    def __init__(self, n_options: int):
+        self.lock = threading.Lock()
+        self.counts = [0] * n_options
+        self.voters: Dict[str, int] = {}   # user_id → option index (이 샤드에 속한 유저만)
+
+
+@dataclass(frozen=True)
+class VoteResult:
+    round_id: str
+    winner: Optional[str]
+    counts: Dict[str, int]
+    total: int
+    reason: str                 # decided | deadline | manual
+    duration_sec: float
+
+    def as_choice_hint(self) -> Optional[Dict[str, Any]]:
+        """ParentAgent.INTENT_CONF_THRESHOLD를 넘는 확신도로 승자를 넘긴다. 표가 없으면 None."""
+        if self.winner is None:
+            return None
+        return {"value": self.winner, "confidence": 1.0, "source": "vote",
+                "votes": dict(self.counts), "total": self.total}
+
+
+class VoteRound:
+    def __init__(self, round_id: str, options: Sequence[str], window_sec: float = 30.0,
+                 expected_voters: Optional[int] = None, dedup: str = "first", shards: int = 16,
+                 clock: Callable[[], float] = time.monotonic):
+        if not options:
+            raise ValueError("vote round needs at least one option")
+        if dedup not in DEDUP_POLICIES:
+            raise ValueError(f"unknown dedup policy: {dedup}")
+        self.round_id = round_id
+        self.options: List[str] = list(dict.fromkeys(options))   # 선언 순서 = 동점 시 우선순위
+        self._index = {opt: i for i, opt in enumerate(self.options)}
+        self.window_sec = window_sec
+        self.expected_voters = expected_voters
+        self.dedup = dedup
+        self._clock = clock
+        self.opened_at = clock()
+        self.closes_at = self.opened_at + window_sec
+        self._shards = [_Shard(len(self.options)) for _ in range(max(1, shards))]
+        self._close_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._result: Optional[VoteResult] = None
+
+    # ---- 투표 ----
+    def _shard_for(self, user_id: str) -> _Shard:
+        return self._shards[zlib.crc32(user_id.encode("utf-8")) % len(self._shards)]
+
+    def cast(self, user_id: str, option: str) -> str:
+        """결과: accepted | changed | duplicate | invalid | late | closed"""
+        outcome = self._cast(user_id, option)
+        VOTES.inc(outcome=outcome)
+        if outcome == "accepted" and self.expected_voters and self.decided() is not None:
+            self.close("decided")
+        return outcome
+
+    def _cast(self, user_id: str, option: str) -> str:
+        if self._closed.is_set():
+            return "closed"
+        if self._clock() > self.closes_at:
+            return "late"
+        idx = self._index.get(option)
+        if idx is None:
+            return "invalid"
+        shard = self._shard_for(user_id)
+        with shard.lock:
+            if self._closed.is_set():  # close()의 최종 집계 이후에 들어온 표
+                return "closed"
+            prev = shard.voters.get(user_id)
+            if prev is None:
+                shard.voters[user_id] = idx
+                shard.counts[idx] += 1
+                return "accepted"
+            if self.dedup == "first" or prev == idx:
+                return "duplicate"
+            shard.voters[user_id] = idx
+            shard.counts[prev] -= 1
+            shard.counts[idx] += 1
+            return "changed"
+
+    # ---- 집계 ----
+    def tally(self) -> Dict[str, int]:
+        totals = [0] * len(self.options)
+        for shard in self._shards:
+            for i, c in enumerate(shard.counts):
+                totals[i] += c
+        return dict(zip(self.options, totals))
+
+    def _leader(self, counts: Dict[str, int]) -> Optional[str]:
+        if not any(counts.values()):
+            return None
+        # max는 첫 최댓값을 고르므로 동점이면 선언 순서가 앞선 선택지
+        return max(self.options, key=lambda o: counts[o])
+
+    def decided(self) -> Optional[str]:
+        """남은 표가 전부 2위에 가도 뒤집히지 않으면 1위 값, 아니면 None"""
+        if not self.expected_voters or self.dedup != "first":
+            return None
+        counts = self.tally()
+        leader = self._leader(counts)
+        if leader is None:
+            return None
+        runner_up = max((c for o, c in counts.items() if o != leader), default=0)
+        remaining = max(0, self.expected_voters - sum(counts.values()))
+        # 동점 가능성이 남아 있어도 마감하지 않는다 (엄격한 부등호)
+        return leader if counts[leader] - runner_up > remaining else None
+
+    # ---- 마감 ----
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def expired(self) -> bool:
+        return self._clock() > self.closes_at
+
+    def close(self, reason: str = "manual") -> VoteResult:
+        with self._close_lock:
+            if self._result is not None:
+                return self._result
+            self._closed.set()
+            # 진행 중인 cast가 샤드 락을 놓을 때까지 기다렸다가 최종 집계
+            for shard in self._shards:
+                with shard.lock:
+                    pass
+            counts = self.tally()
+            duration = self._clock() - self.opened_at
+            self._result = VoteResult(self.round_id, self._leader(counts), counts,
+                                      sum(counts.values()), reason, duration)
+        VOTE_ROUNDS.inc(reason=reason)
+        VOTE_ROUND_SECONDS.observe(duration)
+        return self._result
+
+    @property
+    def result(self) -> Optional[VoteResult]:
+        return self._result
+
+    def wait(self, timeout: Optional[float] = None) -> VoteResult:
+        """조기 종료 또는 창 마감까지 대기 후 결과 반환"""
+        if timeout is None:
+            timeout = max(0.0, self.closes_at - self._clock())
+        self._closed.wait(timeout)
+        return self._result or self.close("deadline")
+
+
+class VoteHub:
+    """session_id → 진행 중인 VoteRound. 세션 등록/해제만 락을 잡고, 투표 경로는 dict 조회 한 번."""
+
+    def __init__(self, shards: int = 16, clock: Callable[[], float] = time.monotonic):
+        self._rounds: Dict[str, VoteRound] = {}
+        self._lock = threading.Lock()
+        self._shards = shards
+        self._clock = clock
+        self._seq = 0
+
+    def open(self, session_id: str, options: Sequence[str], window_sec: float = 30.0,
+             expected_voters: Optional[int] = None, dedup: str = "first") -> VoteRound:
+        with self._lock:
+            old = self._rounds.get(session_id)
+            if old is not None and not old.closed:
+                old.close("manual")
+            self._seq += 1
+            rnd = VoteRound(f"{session_id}:{self._seq}", options, window_sec, expected_voters,
+                            dedup, self._shards, self._clock)
+            self._rounds[session_id] = rnd
+        return rnd
+
+    def open_for_scene(self, session_id: str, scene_def: Dict[str, Any], **kwargs: Any) -> VoteRound:
+        values = [c["value"] for c in scene_def.get("choices", []) if c.get("value")]
+        return self.open(session_id, values, **kwargs)
+
+    def get(self, session_id: str) -> Optional[VoteRound]:
+        return self._rounds.get(session_id)
+
+    def vote(self, session_id: str, user_id: str, option: str) -> str:
+        rnd = self._rounds.get(session_id)
+        if rnd is None:
+            VOTES.inc(outcome="no_round")
+            return "no_round"
+        return rnd.cast(user_id, option)
+
+    def close(self, session_id: str, reason: str = "manual") -> Optional[VoteResult]:
+        with self._lock:
+            rnd = self._rounds.pop(session_id, None)
+        return rnd.close(reason) if rnd is not None else None
+
+    def sweep(self) -> Dict[str, VoteResult]:
+        """창이 끝났거나 조기 종료된 라운드를 정리하고 {session_id: 결과} 반환"""
+        with self._lock:
+            done = {sid: r for sid, r in self._rounds.items() if r.closed or r.expired()}
+            for sid in done:
+                del self._rounds[sid]
+        return {sid: r.close("deadline") for sid, r in done.items()}
+
+
+# ============================================
+# GraphState 연동
+#   - 상태에는 선택지/진행 여부/결과 힌트만 두고, 표 자체는 VoteRound에 둔다
+# ============================================
+def begin_vote(state: Dict[str, Any], hub: VoteHub, scene_def: Dict[str, Any], **kwargs: Any) -> VoteRound:
+    rnd = hub.open_for_scene(state["session_id"], scene_def, **kwargs)
+    state["is_voting_active"] = True
+    state["vote_options"] = [{"id": c.get("id"), "text": c.get("text"), "value": c.get("value")}
+                             for c in scene_def.get("choices", []) if c.get("value")]
+    state["user_votes"] = {}
+    return rnd
+
+
+def apply_vote_result(state: Dict[str, Any], result: VoteResult) -> Dict[str, Any]:
+    """투표 결과를 다음 턴의 router_choice_hint로 넣는다 (parent 노드가 envelope로 전달)"""
+    state["is_voting_active"] = False
+    state["vote_options"] = []
+    state["router_choice_hint"] = result.as_choice_hint() or {}
+    return state